@@ -0,0 +1,80 @@
+"""Compare the XLSX and CSV paths for importing and exporting products.
+
+Run with `python benchmarks/bench_imports.py [number of products]`.
+"""
+import sys
+import tempfile
+import time
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+
+from copanier import config, imports, reports
+from copanier.models import Delivery, Producer, Product
+
+
+def make_delivery(size):
+    producers = {
+        f"producer-{i}": Producer(id=f"producer-{i}", name=f"Producer {i}")
+        for i in range(size // 100 or 1)
+    }
+    products = [
+        Product(
+            ref=f"product-{i}",
+            name=f"Product {i}",
+            price=i % 50 + 0.5,
+            unit="kg",
+            packing=i % 6 or None,
+            producer=f"producer-{i % len(producers)}",
+        )
+        for i in range(size)
+    ]
+    return Delivery(
+        name="Bench",
+        contact="bench@example.org",
+        from_date=datetime.now(),
+        to_date=datetime.now(),
+        order_before=datetime.now(),
+        products=products,
+        producers=producers,
+    )
+
+
+def timeit(label, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    print(f"{label:<12} {time.perf_counter() - start:8.3f}s")
+    return result
+
+
+def main(size=10_000):
+    config.DATA_ROOT = Path(tempfile.mkdtemp())
+    Delivery.init_fs()
+    delivery = make_delivery(size)
+    delivery.persist()
+    print(f"{size} products")
+
+    xlsx = timeit("xlsx export", reports.products, delivery)
+    csv = timeit("csv export", reports.products_csv, delivery)
+    print(f"{'size':<12} {len(xlsx):>8} / {len(csv)} bytes")
+
+    timeit(
+        "xlsx import",
+        imports.products_and_producers_from_xlsx,
+        delivery,
+        BytesIO(xlsx),
+    )
+    timeit(
+        "csv import", imports.products_and_producers_from_zip, delivery, BytesIO(csv)
+    )
+    timeit(
+        "csv merge",
+        imports.products_and_producers_from_zip,
+        delivery,
+        BytesIO(csv),
+        merge=True,
+    )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
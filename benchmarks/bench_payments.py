@@ -0,0 +1,114 @@
+"""Time the totals and settlement of a big delivery (payments page).
+
+Run with `python benchmarks/bench_payments.py [households] [producers]`.
+"""
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from random import Random
+
+from copanier import config
+from copanier.models import (
+    Delivery,
+    Group,
+    Groups,
+    Order,
+    Producer,
+    Product,
+    ProductOrder,
+)
+
+
+def make_delivery(households, producers):
+    random = Random(1)
+    delivery = Delivery(
+        name="Bench",
+        contact="bench@example.org",
+        from_date=datetime.now(),
+        to_date=datetime.now(),
+        order_before=datetime.now(),
+        producers={
+            f"producer-{i}": Producer(
+                id=f"producer-{i}",
+                name=f"Producer {i}",
+                referent=f"referent-{i}@example.org",
+                referent_name=f"Referent {i}",
+            )
+            for i in range(producers)
+        },
+        products=[
+            Product(
+                ref=f"product-{i}",
+                name=f"Product {i}",
+                price=round(random.uniform(0.5, 30), 2),
+                packing=random.choice([None, 6, 12]),
+                producer=f"producer-{i % producers}",
+            )
+            for i in range(producers * 10)
+        ],
+        # One producer in three charges for the delivery.
+        shipping={f"producer-{i}": 15 for i in range(0, producers, 3)},
+    )
+    for i in range(households):
+        refs = random.sample(range(len(delivery.products)), 20)
+        delivery.orders[f"household-{i}"] = Order(
+            products={
+                f"product-{ref}": ProductOrder(wanted=random.randint(1, 4))
+                for ref in refs
+            }
+        )
+    groups = Groups(
+        {
+            f"household-{i}": Group(
+                id=f"household-{i}",
+                name=f"Household {i}",
+                members=[f"referent-{i}@example.org"],
+            )
+            for i in range(households)
+        }
+    )
+    return delivery, groups
+
+
+def per_order_balance(delivery, groups):
+    """The balance, the way the payments view used to compute it."""
+    balance = [
+        (email, -order.total(delivery.products, delivery, email))
+        for email, order in delivery.orders.items()
+    ]
+    for producer in delivery.producers.values():
+        group = groups.get_user_group(producer.referent)
+        amount = delivery.total_for_producer(producer.id)
+        if amount:
+            balance.append((group.id if group else producer.referent_name, amount))
+    return balance
+
+
+def timeit(label, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    print(f"{label:<20} {time.perf_counter() - start:8.3f}s")
+    return result
+
+
+def main(households=300, producers=30):
+    config.DATA_ROOT = Path(tempfile.mkdtemp())
+    Delivery.init_fs()
+    Groups.init_fs()
+    delivery, groups = make_delivery(households, producers)
+    delivery.persist()
+    groups.persist()
+    groups = Groups.load()
+    print(f"{households} households, {producers} producers")
+
+    timeit("per order balance", per_order_balance, delivery, groups)
+    timeit("totals", delivery.compute_totals)
+    timeit("settlement", delivery.settle, groups)
+    timeit("settlement (miss)", delivery.get_settlement, groups)
+    timeit("settlement (hit)", delivery.get_settlement, groups)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -1,9 +1,10 @@
-from pathlib import Path
 import minicli
-from roll.extensions import simple_server, static
+from roll.extensions import simple_server
 
-from .models import Product, Person, Order, Delivery
-from .views.core import app
+from . import analytics, assets, config, warmup
+from .models import Product, Person, Order, Delivery, dedupe_refs
+from .views.core import app, env
+from . import scheduler  # noqa: registers its startup task.
 
 __version__ = "0.0.5"
 
@@ -28,14 +29,88 @@ def shell():
 
 
 @minicli.cli
-def serve(reload=False):
-    """Run a web server (for development only)."""
+def serve(reload=False, workers=0, host="127.0.0.1", port=2244):
+    """Run a web server.
+
+    :reload: restart on code changes (development only).
+    :workers: run this many pre-forked worker processes with gunicorn (needs
+              the prod extras), for production.
+    :host: interface to listen to.
+    :port: port to listen to.
+    """
+    if workers:
+        from . import server
+
+        server.run(app, host, port, workers)
+        return
     if reload:
         import hupper
 
         hupper.start_reloader("copanier.serve")
-    static(app, root=Path(__file__).parent / "static")
-    simple_server(app, port=2244)
+    assets.static(app)
+    simple_server(app, host=host, port=port)
+
+
+@minicli.cli
+def build_assets():
+    """Write fingerprinted and precompressed static files in static/dist."""
+    manifest = assets.build()
+    print(f"{len(manifest)} files built in {assets.STATIC_ROOT / 'dist'}")
+
+
+@minicli.cli
+def precompile_templates():
+    """Compile every template to the bytecode cache, at deploy time."""
+    count = warmup.compile_templates(env)
+    print(f"{count} templates compiled in {config.TEMPLATE_CACHE_ROOT}")
+
+
+@minicli.cli
+def repair_refs(dry_run=False):
+    """Rename the duplicated product refs of existing deliveries.
+
+    :dry_run: only list the refs that would be renamed.
+    """
+    config.init()
+    storage = Delivery.get_storage()
+    archived = storage.archived_ids(Delivery.__root__)
+    for id in storage.ids(Delivery.__root__) + archived:
+        delivery = Delivery.load(id)
+        renamed = dedupe_refs(delivery.products)
+        for old, new in renamed:
+            print(f"{delivery.id}: {old} -> {new}")
+        if renamed and not dry_run:
+            delivery.persist()
+            if id in archived:  # Persisting brought it back from the archive.
+                delivery.archive()
+
+
+@minicli.cli
+def archive(dry_run=False):
+    """Move the past deliveries to the compressed archive.
+
+    :dry_run: only list the deliveries that would be archived.
+    """
+    config.init()
+    for delivery in Delivery.all():
+        if not delivery.is_archivable:
+            continue
+        if dry_run:
+            print(f"{delivery.id}: {delivery.name}")
+            continue
+        size = delivery.archive()
+        print(f"{delivery.id}: {delivery.name} ({size} bytes)")
+
+
+@minicli.cli
+def rebuild_analytics():
+    """Fill the analytics table from every delivery, archived ones included."""
+    config.init()
+    storage = Delivery.get_storage()
+    ids = storage.ids(Delivery.__root__) + storage.archived_ids(Delivery.__root__)
+    for id in ids:
+        analytics.update(Delivery.load(id))
+    print(f"{len(ids)} distributions")
 
 
 def main():
@@ -0,0 +1,180 @@
+"""Order history across deliveries, kept in a SQLite table.
+
+There is one row per delivery × product × orderer, rewritten each time a
+delivery is persisted, so questions like "how much honey over the last ten
+distributions?" are answered with a query instead of loading every delivery.
+
+Product refs are not stable from one delivery to another, so products are
+grouped by producer, name and unit.
+"""
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+from . import config, metrics, timings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS order_lines (
+    delivery_id TEXT NOT NULL,
+    delivery_name TEXT NOT NULL,
+    delivery_date TEXT NOT NULL,
+    producer TEXT NOT NULL,
+    product_ref TEXT NOT NULL,
+    product_name TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    orderer TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (delivery_id, product_ref, orderer)
+);
+CREATE INDEX IF NOT EXISTS order_lines_date ON order_lines (delivery_date);
+CREATE INDEX IF NOT EXISTS order_lines_orderer ON order_lines (orderer);
+"""
+
+INSERT = "INSERT OR REPLACE INTO order_lines VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+# Restrict to the `last` deliveries having orders.
+LAST_DELIVERIES = """
+delivery_id IN (
+    SELECT delivery_id FROM order_lines
+    GROUP BY delivery_id ORDER BY MAX(delivery_date) DESC LIMIT ?
+)
+"""
+
+logger = logging.getLogger(__name__)
+
+_connections = {}
+_lock = threading.Lock()
+
+
+def get_path():
+    if config.STORAGE == "memory":
+        return ":memory:"
+    return str(Path(config.DATA_ROOT) / "analytics.sqlite")
+
+
+def connect():
+    path = get_path()
+    with _lock:
+        if path not in _connections:
+            # Shared by the executor threads, writes are serialized by _lock.
+            connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            if path != ":memory:":
+                connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            _connections[path] = connection
+    return _connections[path]
+
+
+def reset():
+    with _lock:
+        for connection in _connections.values():
+            connection.close()
+        _connections.clear()
+
+
+def lines(delivery):
+    products = delivery.product_index
+    date = delivery.from_date.isoformat()
+    for orderer, order in delivery.orders.items():
+        for ref, choice in order.products.items():
+            product = products.get(ref)
+            if not product or not choice.quantity:
+                continue
+            producer = delivery.producers.get(product.producer)
+            price = 0 if product.rupture else product.price
+            yield (
+                delivery.id,
+                delivery.name,
+                date,
+                producer.name if producer else product.producer or "",
+                ref,
+                product.name,
+                product.unit or "",
+                orderer,
+                choice.quantity,
+                round(choice.quantity * price, 2),
+            )
+
+
+@timings.timed("analytics", metrics.storage_seconds, operation="analytics")
+def update(delivery):
+    """Replace the rows of `delivery` with its current orders."""
+    connection = connect()
+    with _lock, connection:
+        connection.execute(
+            "DELETE FROM order_lines WHERE delivery_id = ?", (delivery.id,)
+        )
+        connection.executemany(INSERT, lines(delivery))
+
+
+def try_update(delivery):
+    """Like `update`, but log the errors instead of raising them.
+
+    The delivery is already saved at this point: a database locked by another
+    worker must not turn it into an error, `copanier rebuild-analytics` can
+    catch up later.
+    """
+    try:
+        update(delivery)
+    except sqlite3.Error:
+        logger.exception("Unable to update the analytics of %s", delivery.id)
+
+
+def query(sql, last=None, **filters):
+    where = [f"{name} = ?" for name in filters]
+    params = [*filters.values()]
+    if last:
+        where.append(LAST_DELIVERIES)
+        params.append(last)
+    sql = sql.format(where=" AND ".join(where) or "1")
+    connection = connect()
+    with _lock:
+        return [dict(row) for row in connection.execute(sql, params)]
+
+
+def products(last=None, **filters):
+    """Quantities and amounts per product, over the `last` deliveries."""
+    return query(
+        """
+        SELECT producer, product_name, unit,
+            SUM(quantity) AS quantity, ROUND(SUM(amount), 2) AS amount,
+            COUNT(DISTINCT orderer) AS orderers,
+            COUNT(DISTINCT delivery_id) AS deliveries
+        FROM order_lines WHERE {where}
+        GROUP BY producer, product_name, unit
+        ORDER BY producer, product_name, unit
+        """,
+        last=last,
+        **filters,
+    )
+
+
+def orderers(last=None, **filters):
+    """Amounts per orderer, over the `last` deliveries."""
+    return query(
+        """
+        SELECT orderer, ROUND(SUM(amount), 2) AS amount,
+            COUNT(DISTINCT delivery_id) AS deliveries
+        FROM order_lines WHERE {where}
+        GROUP BY orderer ORDER BY amount DESC
+        """,
+        last=last,
+        **filters,
+    )
+
+
+def history(orderer, last=None):
+    """What `orderer` ordered, delivery by delivery, most recent first."""
+    return query(
+        """
+        SELECT delivery_id, delivery_name, delivery_date, producer,
+            product_name, unit, quantity, amount
+        FROM order_lines WHERE {where}
+        ORDER BY delivery_date DESC, producer, product_name
+        """,
+        last=last,
+        orderer=orderer,
+    )
@@ -0,0 +1,53 @@
+"""Exports of the deliveries, kept on disk until the delivery changes.
+
+An artifact is a file (like "rapport-complet.xlsx") of a delivery, valid
+for a `key`: the versions of the delivery, of the groups and of the code it
+was computed from. They are written by the export views and by the
+`scheduler`, which prepares them when the orders close, before everyone
+downloads them.
+"""
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+from . import config
+
+
+def get_root():
+    return Path(config.ARTIFACTS_ROOT or Path(config.DATA_ROOT) / "artifacts")
+
+
+def key(version, groups_version):
+    from . import __version__
+
+    parts = [version.tag, groups_version.tag if groups_version else "", __version__]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+
+def path(delivery_id, name, key):
+    return get_root() / delivery_id / f"{key}-{name}"
+
+
+def exists(delivery_id, name, key):
+    return path(delivery_id, name, key).exists()
+
+
+def read(delivery_id, name, key):
+    """Return the artifact `name` of a delivery, None if missing or outdated."""
+    try:
+        return path(delivery_id, name, key).read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def write(delivery_id, name, key, body):
+    """Store the artifact, and remove its outdated versions."""
+    target = path(delivery_id, name, key)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(body)
+    tmp.replace(target)
+    for other in target.parent.glob(f"{'?' * len(key)}-{name}"):
+        if other != target:
+            other.unlink(missing_ok=True)
@@ -0,0 +1,145 @@
+"""Fingerprinted and precompressed static files.
+
+`build` copies `copanier/static` into `copanier/static/dist`. The copied files
+get the hash of their content in their names, plus `.gz` and `.br` variants.
+The `manifest.json` file maps the original names to the built ones. A built
+file never changes, so it can be cached forever.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import posixpath
+import re
+import shutil
+from http import HTTPStatus
+from pathlib import Path
+
+from roll import HttpError
+
+from . import utils
+
+try:
+    import brotli
+except ImportError:  # Optional: pip install copanier[brotli]
+    brotli = None
+
+STATIC_ROOT = Path(__file__).parent / "static"
+# Fonts (woff, woff2) and images (png, jpg) are already compressed.
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".svg", ".ttf", ".eot", ".json"}
+CSS_URL = re.compile(r"""url\((['"]?)([^'")]+)\1\)""")
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+_manifests = {}
+
+
+def fingerprint(path, content):
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return f"{path.stem}.{digest}{path.suffix}"
+
+
+def rewrite_urls(css, name, manifest):
+    """Point the relative `url()` of the `name` stylesheet to the built files."""
+    folder = posixpath.dirname(name)
+
+    def replace(match):
+        quote, ref = match.groups()
+        if ref.startswith(("data:", "http:", "https:", "/", "#")):
+            return match.group(0)
+        path = re.split(r"[?#]", ref, 1)[0]
+        built = manifest.get(posixpath.normpath(posixpath.join(folder, path)))
+        if not built:
+            return match.group(0)
+        ref = posixpath.relpath(built, folder or ".") + ref[len(path):]
+        return f"url({quote}{ref}{quote})"
+
+    return CSS_URL.sub(replace, css.decode()).encode()
+
+
+def build(root=STATIC_ROOT):
+    """Write the fingerprinted files and their manifest, return the manifest."""
+    root = Path(root)
+    dist = root / "dist"
+    shutil.rmtree(dist, ignore_errors=True)
+    sources = [p for p in root.rglob("*") if p.is_file() and dist not in p.parents]
+    manifest = {}
+    # Stylesheets last, so their url() can be rewritten.
+    for path in sorted(sources, key=lambda p: (p.suffix == ".css", p)):
+        name = path.relative_to(root).as_posix()
+        content = path.read_bytes()
+        if path.suffix == ".css":
+            content = rewrite_urls(content, name, manifest)
+        built = posixpath.join(posixpath.dirname(name), fingerprint(path, content))
+        target = dist / built
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(content)
+        if path.suffix in COMPRESSIBLE_SUFFIXES:
+            gz = gzip.compress(content, compresslevel=9, mtime=0)
+            target.with_name(target.name + ".gz").write_bytes(gz)
+            if brotli:
+                br = brotli.compress(content, quality=11)
+                target.with_name(target.name + ".br").write_bytes(br)
+        manifest[name] = built
+    (dist / "manifest.json").write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    reset()
+    return manifest
+
+
+def get_manifest(root=STATIC_ROOT):
+    root = Path(root)
+    if root not in _manifests:
+        path = root / "dist" / "manifest.json"
+        _manifests[root] = json.loads(path.read_text()) if path.exists() else {}
+    return _manifests[root]
+
+
+def reset():
+    _manifests.clear()
+
+
+def static_path(name):
+    """Return the path of a static file, fingerprinted when it has been built.
+
+    Otherwise, the app version in the query string still busts the browser
+    caches on upgrades.
+    """
+    from . import __version__
+
+    built = get_manifest().get(name)
+    return f"/static/dist/{built}" if built else f"/static/{name}?v={__version__}"
+
+
+def static(app, root=STATIC_ROOT, prefix="/static/"):
+    """Serve the static files, for development (nginx does it in production).
+
+    Built files are served with far-future caching, precompressed when the
+    client accepts it.
+    """
+    root = Path(root).resolve()
+    dist = root / "dist"
+
+    async def serve(request, response, path):
+        abspath = (root / path).resolve()
+        if root not in abspath.parents or not abspath.is_file():
+            raise HttpError(HTTPStatus.NOT_FOUND, path)
+        content_type, _ = mimetypes.guess_type(str(abspath))
+        response.headers["Content-Type"] = content_type or "application/octet-stream"
+        if dist in abspath.parents:
+            response.headers["Cache-Control"] = IMMUTABLE
+            response.headers["Vary"] = "Accept-Encoding"
+            variants = {
+                encoding: abspath.with_name(abspath.name + suffix)
+                for encoding, suffix in (("br", ".br"), ("gzip", ".gz"))
+            }
+            available = [e for e, variant in variants.items() if variant.exists()]
+            encoding = utils.accepted_encoding(
+                request.headers.get("ACCEPT-ENCODING", ""), available
+            )
+            if encoding:
+                abspath = variants[encoding]
+                response.headers["Content-Encoding"] = encoding
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        response.body = abspath.read_bytes()
+
+    app.route(f"{prefix}{{path:path}}", name="static")(serve)
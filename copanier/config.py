@@ -3,6 +3,8 @@ import os
 from pathlib import Path
 
 DATA_ROOT = Path(__file__).parent.parent / "db"
+# "file" (YAML files under DATA_ROOT) or "memory" (lost on restart, for tests).
+STORAGE = "file"
 LOG_ROOT = Path("/tmp")
 SECRET = "sikretfordevonly"
 JWT_ALGORITHM = "HS256"
@@ -20,6 +22,52 @@ SITE_NAME = "Copanier"
 SITE_URL = "http://localhost:2244"
 SITE_DESCRIPTION = "Shared orders"
 EMAIL_SIGNATURE = "The kind people behind copanier"
+# Compression of archived deliveries: "gzip", or "zstd" (needs zstandard).
+ARCHIVE_COMPRESSION = "gzip"
+# Compress HTML, CSS, JS… responses (turn off when nginx already does it).
+COMPRESS_RESPONSES = True
+GZIP_LEVEL = 6  # 1 (fastest) to 9 (smallest).
+BROTLI_QUALITY = 5  # 0 to 11, when the brotli package is installed.
+COMPRESSION_MIN_SIZE = 1024  # Bytes; smaller bodies are sent as is.
+# Bytes; bigger bodies are compressed in a thread, not on the event loop.
+COMPRESSION_THREAD_SIZE = 256 * 1024
+# Live totals (Server-Sent Events): seconds between two checks for changes
+# made by other processes, and before the browser is asked to reconnect.
+LIVE_POLL_SECONDS = 2
+LIVE_STREAM_SECONDS = 300
+# Compiled templates, shared by the processes and kept across restarts.
+TEMPLATE_CACHE_ROOT = Path("/tmp/copanier-templates")
+# Identical exports requested at the same time are computed once per worker.
+# With a folder here, they are computed once for all the workers, which
+# leave the results there for SINGLEFLIGHT_SECONDS.
+SINGLEFLIGHT_ROOT = ""
+SINGLEFLIGHT_SECONDS = 60
+# Exports kept until their delivery changes (DATA_ROOT/artifacts if empty),
+# and prepared when the orders close: seconds between two checks (0 to
+# disable).
+ARTIFACTS_ROOT = ""
+SCHEDULER_SECONDS = 60
+# Rendered template fragments kept in memory (per producer tables…).
+FRAGMENT_CACHE_SIZE = 500
+# Exports prepared in the background: threads per process running them,
+# seconds after which an unfinished one is considered lost (its process
+# stopped), and seconds during which their results can be downloaded.
+JOB_WORKERS = 2
+JOB_TIMEOUT_SECONDS = 600
+JOB_RESULTS_SECONDS = 24 * 60 * 60
+JOB_LIST_SIZE = 50  # Jobs listed on the staff page.
+# Expose the (unauthenticated) /metrics endpoint.
+METRICS_ENABLED = False
+# Production server (copanier serve --workers N): a worker using more than
+# this resident memory (MiB, 0 for no limit) is replaced by a fresh one.
+WORKER_MAX_MEMORY = 300
+WORKER_MEMORY_CHECK_SECONDS = 30
+# Threads used to run blocking I/O (storage, PDF and XLSX generation).
+IO_WORKERS = 4
+
+def to_bool(value):
+    return value.strip().lower() not in ("", "0", "false", "no", "off")
+
 
 def init():
     for key, value in globals().items():
@@ -28,6 +76,8 @@ def init():
             typ = type(value)
             if typ == list:
                 typ = lambda x: x.split()
+            elif typ == bool:
+                typ = to_bool
             if env_key in os.environ:
                 globals()[key] = typ(os.environ[env_key])
     locale.setlocale(locale.LC_ALL, LOCALE)
@@ -1,7 +1,7 @@
 from emails import Message
 import email.utils as utils
 
-from . import config
+from . import config, metrics, timings
 
 
 def send(to, subject, body, html=None, copy=None, attachments=None, mail_from=None):
@@ -47,17 +47,26 @@ def send(to, subject, body, html=None, copy=None, attachments=None, mail_from=No
             "local_hostname": domain
         }
 
-    message.send(
-        to=to,
-        mail_from=mail_from,
-        smtp=smtp
-    )
+    metrics.emails_sending.inc()
+    try:
+        with timings.measure("email", metrics.email_send_seconds):
+            message.send(
+                to=to,
+                mail_from=mail_from,
+                smtp=smtp
+            )
+    finally:
+        metrics.emails_sending.dec()
 
 
 def send_from_template(env, template, to, subject, mail_from=None, **params):
     params["config"] = config
-    html = env.get_template(f"emails/{template}.html").render(**params)
-    txt = env.get_template(f"emails/{template}.txt").render(**params)
+    html_template = f"emails/{template}.html"
+    with timings.measure("render", metrics.template_seconds, template=html_template):
+        html = env.get_template(html_template).render(**params)
+    txt_template = f"emails/{template}.txt"
+    with timings.measure("render", metrics.template_seconds, template=txt_template):
+        txt = env.get_template(txt_template).render(**params)
     send(to, subject, body=txt, html=html, mail_from=mail_from)
 
 
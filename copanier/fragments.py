@@ -0,0 +1,48 @@
+"""Cache of rendered template fragments.
+
+    {% cache "name", key, other_key %}…{% endcache %}
+
+The body is rendered once per distinct key, so the key must hold everything
+the fragment depends on (like the version of the delivery it displays).
+When a part of the key is None, the body is rendered without caching.
+The least recently used fragments are dropped beyond `FRAGMENT_CACHE_SIZE`.
+"""
+from jinja2 import nodes
+from jinja2.ext import Extension
+from jinja2.utils import LRUCache
+
+from . import config, metrics
+
+
+class FragmentCacheExtension(Extension):
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(
+            fragment_cache=LRUCache(config.FRAGMENT_CACHE_SIZE)
+            if config.FRAGMENT_CACHE_SIZE
+            else None
+        )
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        call = self.call_method("_render", [nodes.List(key)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        cache = self.environment.fragment_cache
+        if cache is None or any(part is None for part in key):
+            return caller()
+        key = tuple(key)
+        fragment = cache.get(key)
+        if fragment is not None:
+            metrics.cache_hit("fragment")
+            return fragment
+        metrics.cache_miss("fragment")
+        fragment = cache[key] = caller()
+        return fragment
@@ -1,6 +1,10 @@
-from zipfile import BadZipFile
-
-from openpyxl import load_workbook, Workbook
+import csv
+import io
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import PurePath
+from typing import List
+from zipfile import BadZipFile, ZipFile
 
 from .models import Product, Producer
 
@@ -9,6 +13,13 @@ PRODUCT_FIELDS = {"ref", "name", "price"}
 PRODUCER_FIELDS = {"id"}
 
 
+@dataclass
+class ImportReport:
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+
 def append_list(field, item):
     field.append(item)
 
@@ -17,40 +28,201 @@ def append_dict(field, item):
     field[item.id] = item
 
 
-def items_from_xlsx(data, items, model_class, required_fields, append_method):
-    if not data:
-        raise ValueError
-    headers = data[0]
+def split_headers(rows):
+    rows = iter(rows)
+    try:
+        headers = next(rows)
+    except StopIteration:
+        raise ValueError("Le fichier est vide.")
+    return list(headers), rows
+
+
+def items_from_rows(
+    headers, rows, items, model_class, required_fields, append_method
+):
     if not set(headers) >= required_fields:
         raise ValueError(f"Colonnes obligatoires: {', '.join(required_fields)}.")
-    for row in data[1:]:
+    for row in rows:
         raw = {k: v for k, v in dict(zip(headers, row)).items() if v}
+        if not raw:  # Blank lines are common at the end of CSV files.
+            continue
         try:
             append_method(items, model_class(**raw))
         except TypeError:
-            raise ValueError(f"Erreur durant l'importation de {raw['ref']}")
+            name = raw.get("ref", raw.get("id", ""))
+            raise ValueError(f"Erreur durant l'importation de {name}")
     return items
 
 
-def products_and_producers_from_xlsx(delivery, data):
+def check_unique_refs(products):
+    seen = set()
+    duplicates = []
+    for product in products:
+        if product.ref in seen and product.ref not in duplicates:
+            duplicates.append(product.ref)
+        seen.add(product.ref)
+    if duplicates:
+        raise ValueError(f"Références en double: {', '.join(duplicates)}.")
+
+
+def update_fields(existing, incoming, fields):
+    """Copy the `fields` of `incoming` that differ onto `existing`.
+
+    Returns True if anything changed.
+    """
+    changed = False
+    for name in fields:
+        value = getattr(incoming, name)
+        if getattr(existing, name) != value:
+            setattr(existing, name, value)
+            changed = True
+    return changed
+
+
+def merge_products(delivery, products, headers, remove_missing=False):
+    """Upsert `products` into `delivery`, keyed by ref.
+
+    Only the columns present in the sheet are compared, so a partial sheet
+    (say `ref`, `name` and `price`) doesn't wipe the other fields. Products
+    missing from the sheet are kept, unless `remove_missing` is set: they
+    are then removed along with their order lines.
+    """
+    report = ImportReport()
+    fields = set(headers) & set(Product.__dataclass_fields__)
+    fields -= {"ref", "last_update"}
+    index = delivery.product_index
+    for product in products:
+        existing = index.get(product.ref)
+        if existing is None:
+            delivery.products.append(product)
+            report.added.append(product.ref)
+        elif update_fields(existing, product, fields):
+            existing.last_update = datetime.now()
+            report.changed.append(product.ref)
+    if not remove_missing:
+        return report
+    refs = {product.ref for product in products}
+    for ref in list(index):
+        if ref not in refs:
+            delivery.delete_product(ref)
+            report.removed.append(ref)
+    return report
+
+
+def merge_producers(delivery, producers, headers):
+    fields = (set(headers) & set(Producer.__dataclass_fields__)) - {"id"}
+    for producer in producers.values():
+        existing = delivery.producers.get(producer.id)
+        if existing is None:
+            delivery.producers[producer.id] = producer
+        else:
+            update_fields(existing, producer, fields)
+
+
+def products_and_producers_from_rows(
+    delivery, products_rows, producers_rows, merge=False, remove_missing=False
+):
+    """Import products and producers from two iterables of rows.
+
+    The first row of each is the headers. By default, the delivery products
+    and producers are replaced. With `merge=True`, they are upserted instead
+    and an `ImportReport` is returned; `remove_missing=True` also removes the
+    products absent from the rows.
+    """
+    products_headers, products_rows = split_headers(products_rows)
+    products = items_from_rows(
+        products_headers, products_rows, [], Product, PRODUCT_FIELDS, append_list
+    )
+    producers_headers, producers_rows = split_headers(producers_rows)
+    producers = items_from_rows(
+        producers_headers, producers_rows, {}, Producer, PRODUCER_FIELDS, append_dict
+    )
+    check_unique_refs(products)
+
+    report = None
+    if merge:
+        report = merge_products(
+            delivery, products, products_headers, remove_missing=remove_missing
+        )
+        merge_producers(delivery, producers, producers_headers)
+    else:
+        delivery.set_products(products)
+        delivery.producers = producers
+    delivery.persist()
+    return report
+
+
+def products_and_producers_from_xlsx(
+    delivery, data, merge=False, remove_missing=False
+):
+    from openpyxl import load_workbook, Workbook  # Heavy, see reports.workbook.
+
     if not isinstance(data, Workbook):
         try:
-            data = load_workbook(data)
+            data = load_workbook(data, read_only=True)
         except BadZipFile:
             raise ValueError("Impossible de lire le fichier")
 
-    sheet_names = data.get_sheet_names()
+    sheet_names = data.sheetnames
     if len(sheet_names) != 2:
         raise ValueError("Le fichier doit comporter deux onglets.")
-    # First, get the products data from the first tab.
-    products_sheet = data.get_sheet_by_name(sheet_names[0])
-    delivery.products = items_from_xlsx(
-        list(products_sheet.values), [], Product, PRODUCT_FIELDS, append_list
+    # First tab holds the products, second one the producers.
+    return products_and_producers_from_rows(
+        delivery,
+        data[sheet_names[0]].values,
+        data[sheet_names[1]].values,
+        merge=merge,
+        remove_missing=remove_missing,
     )
 
-    # Then import producers info
-    producers_sheet = data.get_sheet_by_name(sheet_names[1])
-    delivery.producers = items_from_xlsx(
-        list(producers_sheet.values), {}, Producer, PRODUCER_FIELDS, append_dict
+
+def get_delimiter(filename):
+    return "\t" if PurePath(filename or "").suffix.lower() == ".tsv" else ","
+
+
+def rows_from_csv(data, delimiter=","):
+    """Stream the rows of a binary CSV file."""
+    if isinstance(data, bytes):
+        data = io.BytesIO(data)
+    # utf-8-sig swallows the BOM spreadsheets like to add.
+    text = io.TextIOWrapper(data, encoding="utf-8-sig", newline="")
+    try:
+        yield from csv.reader(text, delimiter=delimiter)
+    except (UnicodeDecodeError, csv.Error):
+        raise ValueError("Impossible de lire le fichier")
+    finally:
+        text.detach()
+
+
+def products_and_producers_from_csv(
+    delivery, products, producers, delimiter=",", merge=False, remove_missing=False
+):
+    return products_and_producers_from_rows(
+        delivery,
+        rows_from_csv(products, delimiter),
+        rows_from_csv(producers, delimiter),
+        merge=merge,
+        remove_missing=remove_missing,
     )
-    delivery.persist()
+
+
+def products_and_producers_from_zip(
+    delivery, data, merge=False, remove_missing=False
+):
+    """Import a zip of two CSV (or TSV) files: products first, then producers."""
+    try:
+        archive = ZipFile(data)
+    except BadZipFile:
+        raise ValueError("Impossible de lire le fichier")
+    with archive:
+        names = [n for n in archive.namelist() if not n.endswith("/")]
+        if len(names) != 2:
+            raise ValueError("L'archive doit comporter deux fichiers.")
+        with archive.open(names[0]) as products, archive.open(names[1]) as producers:
+            return products_and_producers_from_rows(
+                delivery,
+                rows_from_csv(products, get_delimiter(names[0])),
+                rows_from_csv(producers, get_delimiter(names[1])),
+                merge=merge,
+                remove_missing=remove_missing,
+            )
@@ -0,0 +1,98 @@
+"""Run long exports in the background.
+
+Big PDF and XLSX exports can take longer than a proxy is willing to wait
+for a response: the request only creates a `Job` and returns, the export is
+computed by the JOB_WORKERS threads of the process, and its result is left
+on disk (next to the job, under DATA_ROOT) for any worker to serve it.
+
+There is no broker: a job is run by the process that created it, and marked
+as failed after JOB_TIMEOUT_SECONDS if this process stopped meanwhile.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from . import config
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=config.JOB_WORKERS, thread_name_prefix="copanier-job"
+        )
+    return _executor
+
+
+def submit(compute, name, filename, content_type, delivery_id="", requested_by=""):
+    """Create a job running the blocking `compute()`, which must return bytes.
+
+    Blocking too (the job is persisted before returning): run it in an
+    executor.
+    """
+    job = Job(
+        id=uuid.uuid4().hex,
+        name=name,
+        filename=filename,
+        content_type=content_type,
+        delivery_id=delivery_id,
+        requested_by=requested_by,
+    )
+    job.persist()
+    context = contextvars.copy_context()
+    get_executor().submit(context.run, run, job, compute)
+    return job
+
+
+def run(job, compute):
+    job.status = Job.RUNNING
+    job.started = datetime.now()
+    job.persist()
+    try:
+        body = compute()
+        write(job.result_path, body)
+    except Exception as err:
+        logger.exception("Job %s (%s) failed", job.id, job.name)
+        job.status = Job.FAILED
+        job.error = str(err) or err.__class__.__name__
+    else:
+        job.status = Job.DONE
+    job.finished = datetime.now()
+    job.persist()
+    cleanup()
+
+
+def write(path, body):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(body)
+    tmp.replace(path)
+
+
+def read(job):
+    """Return the result of a finished `job`, None if it has expired."""
+    try:
+        return job.result_path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def cleanup():
+    """Remove the results older than JOB_RESULTS_SECONDS."""
+    expired = time.time() - config.JOB_RESULTS_SECONDS
+    for path in Job.get_root().glob("*.out"):
+        try:
+            if path.stat().st_mtime < expired:
+                path.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,53 @@
+"""Live totals of a delivery, pushed to the pages that watch it.
+
+Pages subscribe with Server-Sent Events and receive flat JSON deltas, like
+`{"wanted:lait": 12, "producer:ferme-du-coin": 180.5}`; a small script puts
+the values in the elements with the matching `data-live` attribute.
+
+`notify` wakes up the streams of this process as soon as a delivery is
+persisted; the other processes see the new version on their next poll.
+"""
+import asyncio
+from collections import defaultdict
+
+_waiters = defaultdict(set)  # Delivery id: {(loop, asyncio.Event)}
+
+
+def snapshot(delivery):
+    """Flat dict of the values the live pages display.
+
+    From the cached `Delivery.get_totals`: the same figures as a reload.
+    """
+    totals = delivery.get_totals()
+    data = {"orders": len(delivery.orders)}
+    for ref, product in totals.products.items():
+        data[f"wanted:{ref}"] = product.wanted
+        data[f"missing:{ref}"] = product.missing
+    for id, total in totals.producers.items():
+        data[f"producer:{id}"] = total
+    data["total"] = totals.total
+    return data
+
+
+def diff(old, new):
+    return {key: value for key, value in new.items() if old.get(key) != value}
+
+
+def subscribe(delivery_id):
+    event = asyncio.Event()
+    _waiters[delivery_id].add((asyncio.get_running_loop(), event))
+    return event
+
+
+def unsubscribe(delivery_id, event):
+    waiters = _waiters.get(delivery_id, set())
+    waiters -= {waiter for waiter in waiters if waiter[1] is event}
+    if not waiters:
+        _waiters.pop(delivery_id, None)
+
+
+def notify(delivery_id):
+    """Wake up the streams of `delivery_id`; callable from any thread."""
+    for loop, event in list(_waiters.get(delivery_id, ())):
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(event.set)
@@ -0,0 +1,143 @@
+"""In-process metrics, exposed in the Prometheus text format.
+
+Values live in module globals, so each worker process reports its own
+numbers; every sample carries a `worker` label with the process id.
+"""
+import os
+import threading
+from bisect import bisect_left
+
+# Seconds. Covers everything from a cached template to a big PDF.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 500_000, 1_000_000, 5_000_000, 10_000_000)
+
+registry = []
+_lock = threading.Lock()
+
+
+def format_labels(labels):
+    labels = {"worker": os.getpid(), **labels}
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{{{format_labels(labels)}}} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in list(self.values.items()):
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with _lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0, 0]
+            counts, _, _ = entry = self.values[key]
+            index = bisect_left(self.buckets, value)
+            if index < len(counts):
+                counts[index] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def samples(self):
+        for key, (counts, count, total) in list(self.values.items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": bucket}, cumulative
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+            yield f"{self.name}_count", labels, count
+            yield f"{self.name}_sum", labels, round(total, 6)
+
+
+def render():
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+storage_seconds = Histogram(
+    "copanier_storage_seconds",
+    "Time spent loading and persisting documents.",
+    labels=("operation", "kind"),
+)
+persist_bytes = Histogram(
+    "copanier_persist_bytes",
+    "Bytes written per persist.",
+    labels=("kind",),
+    buckets=SIZE_BUCKETS,
+)
+cache_requests = Counter(
+    "copanier_cache_requests_total",
+    "Cache lookups, by cache and result (hit or miss).",
+    labels=("cache", "result"),
+)
+template_seconds = Histogram(
+    "copanier_template_render_seconds",
+    "Time spent rendering templates.",
+    labels=("template",),
+)
+export_seconds = Histogram(
+    "copanier_export_seconds",
+    "Time spent generating PDF, XLSX and CSV files.",
+    labels=("format",),
+)
+emails_sending = Gauge("copanier_emails_sending", "Emails being sent right now.")
+email_send_seconds = Histogram("copanier_email_send_seconds", "Time to send an email.")
+active_requests = Gauge("copanier_active_requests", "Requests being processed.")
+request_seconds = Histogram(
+    "copanier_request_seconds", "Time to answer requests.", labels=("route",)
+)
+
+
+def cache_hit(cache):
+    cache_requests.inc(cache=cache, result="hit")
+
+
+def cache_miss(cache):
+    cache_requests.inc(cache=cache, result="miss")
@@ -1,15 +1,21 @@
+import asyncio
+import hashlib
 import inspect
 import threading
 import uuid
-from collections import Counter
+import weakref
 from datetime import datetime, timedelta
+from collections import defaultdict
 from dataclasses import dataclass, field, asdict
+from functools import partial
 from pathlib import Path
 from typing import List, Dict
 
 import yaml
+from jinja2.utils import LRUCache
+from debts.solver import order_balance, reduce_balance
 
-from . import config
+from . import analytics, config, live, metrics, storage, timings, utils
 
 
 def demo_mode_enabled():
@@ -20,6 +26,12 @@ class DoesNotExist(ValueError):
     pass
 
 
+# Totals and settlements of the deliveries, see `Delivery.get_totals` and
+# `Delivery.get_settlement`.
+_totals = LRUCache(100)
+_settlements = LRUCache(100)
+
+
 def datetime_field(value):
     if isinstance(value, datetime):
         return value
@@ -80,6 +92,10 @@ class Base:
         return yaml.dump(asdict(self), allow_unicode=True)
 
 
+# Document (kind, id): asyncio.Lock, see `PersistedBase.edit_lock`.
+_edit_locks = weakref.WeakValueDictionary()
+
+
 @dataclass
 class PersistedBase(Base):
     @classmethod
@@ -90,29 +106,99 @@ class PersistedBase(Base):
 
         return root / cls.__root__
 
+    @classmethod
+    def get_storage(cls):
+        if demo_mode_enabled():
+            return storage.get_demo()
+        return storage.get()
+
+    @classmethod
+    def read(cls, id):
+        data = cls.get_storage().read(cls.__root__, id)
+        if data is None:
+            return None
+        # Tolerate extra fields (but we'll lose them if instance is persisted)
+        return {k: v for k, v in data.items() if k in cls.__dataclass_fields__}
+
+    @classmethod
+    def get_version(cls, id):
+        """Return the `storage.Version` of the document `id`, or None."""
+        return cls.get_storage().version(cls.__root__, id)
+
+    @classmethod
+    def init_fs(cls):
+        cls.get_storage().init(cls.__root__)
+
+    @classmethod
+    async def aload(cls, *args):
+        return await utils.run_in_executor(cls.load, *args)
+
+    async def apersist(self):
+        return await utils.run_in_executor(self.persist)
+
+    @classmethod
+    def edit_lock(cls, id):
+        """Return the lock to hold from loading the document `id` to persisting it.
+
+        `aload` and `apersist` let other requests run meanwhile: without it,
+        two of them could change the same version, and the last one to
+        persist would erase the changes of the other.
+        """
+        return _edit_locks.setdefault((cls.__root__, id), asyncio.Lock())
+
+    @classmethod
+    def is_frozen(cls, id):
+        """Whether the document `id` must not be changed, see `Delivery.freeze`."""
+        return False
+
+    def write(self, id, kind):
+        size = self.get_storage().write(self.__root__, id, asdict(self))
+        if size is not None:
+            metrics.persist_bytes.observe(size, kind=kind)
+
 
 @dataclass
 class SavedConfiguration(PersistedBase):
+    __root__ = ""
     __lock__ = threading.Lock()
     demo_mode_enabled: bool = False
+    _applied = ()  # Version of the configuration `config` was set from.
 
     @classmethod
     def get_path(cls):
         return Path(config.DATA_ROOT) / "config.yml"
 
+    @classmethod
+    def get_storage(cls):
+        # Never in the demo storage: this is what enables the demo mode.
+        return storage.get()
+
+    @timings.timed(
+        "persist", metrics.storage_seconds, operation="persist", kind="config"
+    )
     def persist(self):
         with self.__lock__:
-            self.get_path().write_text(self.dump())
+            self.write("config", "config")
+            self.apply_to_config(self.get_version("config"))
 
     @classmethod
+    @timings.timed("load", metrics.storage_seconds, operation="load", kind="config")
     def load(cls):
-        path = cls.get_path()
-        if path.exists():
-            data = yaml.safe_load(path.read_text())
-            data = {k: v for k, v in data.items() if k in cls.__dataclass_fields__}
-        else:
-            data = {}
-        return cls(**data)
+        return cls(**(cls.read("config") or {}))
+
+    def apply_to_config(self, version):
+        config.DEMO_MODE = self.demo_mode_enabled
+        SavedConfiguration._applied = version
+
+    @classmethod
+    def refresh(cls):
+        """Set `config.DEMO_MODE` from the saved configuration.
+
+        Only read when it changed since, like when another worker saved it.
+        """
+        version = cls.get_version("config")
+        if version != cls._applied:
+            cls.load().apply_to_config(version)
 
 
 @dataclass
@@ -152,19 +238,21 @@ class Groups(PersistedBase):
     __lock__ = threading.Lock()
     groups: Dict[str, Group]
 
+    def __post_init__(self):
+        self.version = None  # Set by load and persist.
+        super().__post_init__()
+
     @classmethod
     def get_path(cls):
         return cls.get_root() / "groups.yml"
 
     @classmethod
+    @timings.timed("load", metrics.storage_seconds, operation="load", kind="groups")
     def load(cls):
-        path = cls.get_path()
-        if path.exists():
-            data = yaml.safe_load(path.read_text())
-            data = {k: v for k, v in data.items() if k in cls.__dataclass_fields__}
-        else:
-            data = {"groups": {}}
+        version = cls.get_version("groups")
+        data = cls.read("groups") or {"groups": {}}
         groups = cls(**data)
+        groups.version = version
         return groups
 
     @classmethod
@@ -172,9 +260,13 @@ class Groups(PersistedBase):
         groups = cls.load()
         return len(groups.groups) > 0
 
+    @timings.timed(
+        "persist", metrics.storage_seconds, operation="persist", kind="groups"
+    )
     def persist(self):
         with self.__lock__:
-            self.get_path().write_text(self.dump())
+            self.write("groups", "groups")
+            self.version = self.get_version("groups")
 
     def add_group(self, group):
         assert group.id not in self.groups, "Un foyer avec ce nom existe déjà."
@@ -196,10 +288,6 @@ class Groups(PersistedBase):
             if email in group.members:
                 return group
 
-    @classmethod
-    def init_fs(cls):
-        cls.get_root().mkdir(parents=True, exist_ok=True)
-
 
 @dataclass
 class Producer(Base):
@@ -314,6 +402,49 @@ class Order(Base):
     def has_adjustments(self):
         return any(choice.adjustment for email, choice in self)
 
+    @property
+    def tag(self):
+        """Digest of the order: the base its changes are made against."""
+        lines = sorted((ref, c.wanted, c.adjustment) for ref, c in self)
+        data = repr((lines, self.phone_number)).encode()
+        return hashlib.sha1(data).hexdigest()[:16]
+
+    def update(self, changes):
+        """Apply the `{ref: ProductOrder}` changes, dropping the empty lines."""
+        for ref, choice in changes.items():
+            if choice.wanted or choice.adjustment:
+                self.products[ref] = choice
+            else:
+                self.products.pop(ref, None)
+
+
+def unique_ref(ref, taken):
+    candidate = f"{ref}-dedupe"
+    counter = 2
+    while candidate in taken:
+        candidate = f"{ref}-dedupe-{counter}"
+        counter += 1
+    return candidate
+
+
+def dedupe_refs(products):
+    """Rename the products sharing a ref with a previous one.
+
+    Orders are keyed by ref, so the first product keeps it. Returns the list
+    of renamed refs, as `(old, new)` tuples.
+    """
+    taken = {p.ref for p in products}
+    seen = set()
+    renamed = []
+    for product in products:
+        if product.ref in seen:
+            ref = unique_ref(product.ref, taken)
+            renamed.append((product.ref, ref))
+            product.ref = ref
+            taken.add(ref)
+        seen.add(product.ref)
+    return renamed
+
 
 @dataclass
 class Delivery(PersistedBase):
@@ -344,6 +475,8 @@ class Delivery(PersistedBase):
 
     def __post_init__(self):
         self.id = None  # Not a field because we don't want to persist it.
+        self.version = None  # Set by load and persist.
+        self.bundle = None  # Set by load and freeze, once frozen.
         super().__post_init__()
 
     @property
@@ -392,7 +525,11 @@ class Delivery(PersistedBase):
 
     @property
     def total(self):
-        return round(sum(o.total(self.products, self) for o in self.orders.values()), 2)
+        if self.bundle:
+            return self.bundle.totals.total
+        return round(
+            sum(o.total(self.products, self, e) for e, o in self.orders.items()), 2
+        )
 
     @property
     def is_open(self):
@@ -426,81 +563,37 @@ class Delivery(PersistedBase):
         return self.has_packing and any(self.product_missing(p) for p in self.products)
 
     @classmethod
-    def init_fs(cls):
-        cls.get_root().mkdir(parents=True, exist_ok=True)
-
-    @classmethod
+    @timings.timed("load", metrics.storage_seconds, operation="load", kind="delivery")
     def load(cls, id):
-        path = cls.get_root() / f"{id}.yml"
-        if not path.exists():
+        # Before reading: at worst, the version is older than the data.
+        version = cls.get_version(id)
+        data = cls.read(id)
+        if data is None:
             raise DoesNotExist
 
-        def _dedupe_products(raw_data):
-            """On some rare occasions, different products get
-            the same identifier (ref).
-
-            This function finds them and appends "-dedupe" to it.
-            This is not ideal but fixes the problem before it causes more
-            trouble (such as https://github.com/spiral-project/copanier/issues/136)
-
-            This function returns True if dupes have been found.
-            """
-            if ("products" not in raw_data) or len(raw_data["products"]) < 1:
-                return False
-
-            products = raw_data["products"]
-
-            counter = Counter([p["ref"] for p in products])
-            most_common = counter.most_common(1)[0]
-            number_of_dupes = most_common[1]
-
-            if number_of_dupes < 2:
-                return False
-
-            dupe_id = most_common[0]
-            # Reconstruct the products list but change the duplicated ID.
-            counter = 0
-            new_products = []
-            for product in products:
-                ref = product["ref"]
-                if ref == dupe_id:
-                    counter = counter + 1
-                    if counter == number_of_dupes:  # Only change the last occurence.
-                        product["ref"] = f"{ref}-dedupe"
-                new_products.append(product)
-            raw_data["products"] = new_products
-            return True
-
-        data = yaml.safe_load(path.read_text())
-        dupe_found = _dedupe_products(data)
-
-        # Tolerate extra fields (but we'll lose them if instance is persisted)
-        data = {k: v for k, v in data.items() if k in cls.__dataclass_fields__}
         delivery = cls(**data)
         delivery.id = id
+        delivery.version = version
+        delivery.bundle = Bundle.find(id)
 
         if demo_mode_enabled():
+            # Keep the demo always open, without writing it back.
             delivery.from_date = datetime.now()
             delivery.to_date = datetime.now() + timedelta(days=10)
             delivery.order_before = datetime.now() + timedelta(days=5)
             delivery.validate_all_prices()
-            delivery.persist()
-
-        if dupe_found:
-            delivery.persist()
 
         return delivery
 
     @classmethod
     def all(cls):
-        root = cls.get_root()
-        for path in root.glob("*.yml"):
-            id_ = str(path.relative_to(cls.get_root())).replace(".yml", "")
+        for id_ in cls.get_storage().ids(cls.__root__):
             yield Delivery.load(id_)
 
     @classmethod
     def is_defined(cls):
-        return len(list(cls.all())) > 0
+        storage = cls.get_storage()
+        return bool(storage.ids(cls.__root__) or storage.archived_ids(cls.__root__))
 
     @classmethod
     def incoming(cls):
@@ -512,18 +605,53 @@ class Delivery(PersistedBase):
         former_deliveries = [d for d in cls.all() if not d.is_foreseen]
         return sorted(former_deliveries, key=lambda d: d.from_date, reverse=True)
 
+    @classmethod
+    def archived(cls):
+        """Summaries of the archived deliveries, without decompressing them."""
+        ids = set(cls.get_storage().archived_ids(cls.__root__))
+        summaries = [s for s in Archives.load().deliveries.values() if s.id in ids]
+        return sorted(summaries, key=lambda s: s.from_date, reverse=True)
+
+    @property
+    def is_archivable(self):
+        return self.over or self.to_date < datetime.now()
+
+    def archive(self):
+        """Move the delivery to compressed storage, and list it in the catalog.
+
+        It stays readable with `load`, and goes back to the regular storage
+        as soon as it's persisted again.
+        """
+        assert self.id, "Cannot operate on unsaved deliveries"
+        with self.__lock__:
+            size = self.get_storage().archive(
+                self.__root__, self.id, config.ARCHIVE_COMPRESSION
+            )
+        Archives.add(ArchivedDelivery.from_delivery(self))
+        return size
+
     @property
     def path(self):
         assert self.id, "Cannot operate on unsaved deliveries"
         return self.get_root() / f"{self.id}.yml"
 
+    @timings.timed(
+        "persist", metrics.storage_seconds, operation="persist", kind="delivery"
+    )
     def persist(self):
         with self.__lock__:
             if not self.id:
                 self.id = uuid.uuid4().hex
-            self.path.write_text(self.dump())
+            self.write(self.id, "delivery")
+            self.version = self.get_version(self.id)
+        # Outside the lock: a slow analytics store must not hold the writers.
+        if not demo_mode_enabled():
+            analytics.try_update(self)
+        live.notify(self.id)
 
     def product_wanted(self, product):
+        if self.bundle and product.ref in self.bundle.totals.products:
+            return self.bundle.totals.products[product.ref].wanted
         total = 0
         for order in self.orders.values():
             if product.ref in order.products:
@@ -531,18 +659,65 @@ class Delivery(PersistedBase):
         return total
 
     def product_missing(self, product):
+        if self.bundle and product.ref in self.bundle.totals.products:
+            return self.bundle.totals.products[product.ref].missing
         if not product.packing:
             return 0
         wanted = self.product_wanted(product)
         orphan = wanted % product.packing
         return product.packing - orphan if orphan else 0
 
+    def propose_adjustments(self):
+        """Spread the missing units of the products with a packing.
+
+        Return `{ref: {orderer: units to add}}`, in one pass over the orders:
+        units go one at a time to the orderers of the product, the biggest
+        orders first.
+        """
+        wanted = defaultdict(int)
+        orderers = defaultdict(list)  # Ref: [(quantity, orderer)].
+        for email, order in self.orders.items():
+            for ref, choice in order.products.items():
+                wanted[ref] += choice.quantity
+                if choice.quantity > 0:
+                    orderers[ref].append((choice.quantity, email))
+        proposals = {}
+        for product in self.products:
+            candidates = sorted(orderers[product.ref], key=lambda c: (-c[0], c[1]))
+            if not product.packing or product.rupture or not candidates:
+                continue
+            orphan = wanted[product.ref] % product.packing
+            if not orphan:
+                continue
+            proposal = defaultdict(int)
+            for unit in range(product.packing - orphan):
+                proposal[candidates[unit % len(candidates)][1]] += 1
+            proposals[product.ref] = dict(proposal)
+        return proposals
+
     def has_order(self, person):
         return person.email in self.orders
 
     def get_products_by(self, producer):
         return [p for p in self.products if p.producer == producer]
 
+    @property
+    def product_index(self):
+        return {p.ref: p for p in self.products}
+
+    def add_product(self, product):
+        """Append `product`, renaming its ref if another product already uses it."""
+        index = self.product_index
+        if product.ref in index:
+            product.ref = unique_ref(product.ref, index)
+        self.products.append(product)
+        return product
+
+    def set_products(self, products):
+        """Replace the products, making sure their refs are unique."""
+        dedupe_refs(products)
+        self.products = products
+
     def get_product(self, ref):
         products = [p for p in self.products if p.ref == ref]
         if products:
@@ -560,6 +735,11 @@ class Delivery(PersistedBase):
             return product
 
     def total_for_producer(self, producer, person=None, include_shipping=True):
+        if self.bundle and include_shipping:
+            totals = self.bundle.totals
+            if person:
+                return totals.orderer_producers.get(person, {}).get(producer, 0)
+            return totals.producers.get(producer, 0)
         producer_products = [p for p in self.products if p.producer == producer]
         if person:
             return self.orders.get(person).total(
@@ -587,6 +767,8 @@ class Delivery(PersistedBase):
     def total_for(self, person):
         if person.email not in self.orders:
             return 0
+        if self.bundle:
+            return self.bundle.totals.orderers.get(person.email, 0)
         return self.orders[person.email].total(self.products, self)
 
     def shipping_for(self, person, producer):
@@ -597,6 +779,9 @@ class Delivery(PersistedBase):
         if not person:
             return producer_shipping
 
+        if self.bundle:
+            return self.bundle.totals.shipping.get(person, {}).get(producer, 0)
+
         producer_total = (
             self.total_for_producer(producer, include_shipping=False)
             - producer_shipping
@@ -612,3 +797,377 @@ class Delivery(PersistedBase):
     def validate_all_prices(self):
         for product in self.products:
             product.last_update = datetime.now()
+
+    @property
+    def is_freezable(self):
+        """Orders can't change anymore: the delivery can be frozen."""
+        return self.over or datetime.now() > self.dates["adjustment_deadline"]
+
+    @classmethod
+    def is_frozen(cls, id):
+        return Bundle.get_version(id) is not None
+
+    def compute_totals(self):
+        """Compute the `Totals` in one pass over the orders.
+
+        Same amounts (and roundings) as `total`, `total_for_producer`,
+        `shipping_for`… which each go through all the orders again.
+        """
+        prices, producer_of = {}, {}
+        for product in self.products:
+            prices[product.ref] = 0 if product.rupture else product.price
+            producer_of[product.ref] = product.producer
+        shipped = {p for p in producer_of.values() if self.shipping.get(p)}
+
+        wanted = defaultdict(int)
+        amounts = {}  # Orderer: producer: amount, without shipping.
+        for email, order in self.orders.items():
+            amounts[email] = defaultdict(float)
+            for ref, choice in order.products.items():
+                wanted[ref] += choice.quantity
+                if ref in prices:
+                    amounts[email][producer_of[ref]] += choice.quantity * prices[ref]
+
+        subtotals = defaultdict(float)  # Producer: sum of the rounded amounts.
+        for orderer_amounts in amounts.values():
+            for producer, amount in orderer_amounts.items():
+                subtotals[producer] += round(amount, 2)
+
+        orderers, orderer_producers, shipping = {}, {}, {}
+        for email, orderer_amounts in amounts.items():
+            shipping[email] = {}
+            for producer in shipped:
+                cost = self.shipping[producer]
+                producer_total = round(subtotals[producer] + cost, 2) - cost
+                share = round(orderer_amounts.get(producer, 0), 2)
+                # Nobody ordered from this producer: nothing to share.
+                shipping[email][producer] = (
+                    share / producer_total * cost if producer_total else 0
+                )
+            orderers[email] = round(
+                sum(orderer_amounts.values()) + sum(shipping[email].values()), 2
+            )
+            orderer_producers[email] = {
+                producer: round(
+                    orderer_amounts.get(producer, 0) + shipping[email].get(producer, 0),
+                    2,
+                )
+                for producer in self.producers
+            }
+
+        products = {}
+        for product in self.products:
+            orphan = wanted[product.ref] % product.packing if product.packing else 0
+            products[product.ref] = ProductTotals(
+                wanted=wanted[product.ref],
+                missing=product.packing - orphan if orphan else 0,
+            )
+        return Totals(
+            total=round(sum(orderers.values()), 2),
+            producers={
+                id: round(subtotals[id] + self.shipping.get(id, 0), 2)
+                for id in self.producers
+            },
+            orderers=orderers,
+            orderer_producers=orderer_producers,
+            shipping=shipping,
+            products=products,
+        )
+
+    def settle(self, groups, totals=None):
+        """Return who has to pay whom, the orderers paying the referents.
+
+        From the `totals` if given, else computed.
+        """
+        totals = totals or self.compute_totals()
+        balance = [(email, -amount) for email, amount in totals.orderers.items()]
+
+        producer_groups = {}
+        groups_of = {}  # Member: first of its groups, see `get_user_group`.
+        for group in reversed(list(groups.groups.values())):
+            for member in group.members:
+                groups_of[member] = group
+
+        for producer in self.producers.values():
+            group = groups_of.get(producer.referent)
+            # When a group contains multiple producer contacts,
+            # the first one is elected to receive the money,
+            # and all the other ones are separated in the table.
+            group_id = None
+            if group is not None:
+                if (
+                    group.id not in producer_groups
+                    or producer_groups[group.id] == producer.referent_name
+                ):
+                    producer_groups[group.id] = producer.referent_name
+                    group_id = group.id
+            if not group_id:
+                group_id = producer.referent_name
+
+            amount = totals.producers[producer.id]
+            if amount:
+                balance.append((group_id, amount))
+
+        debiters, crediters = order_balance(balance)
+        results = reduce_balance(debiters[:], crediters[:]) or []
+        return Settlement(
+            debiters=[[id, float(amount)] for id, amount in debiters],
+            crediters=[[id, float(amount)] for id, amount in crediters],
+            results=[list(result) for result in results],
+            producer_groups=producer_groups,
+        )
+
+    def get_totals(self):
+        """Return the `Totals`, cached by version of the delivery."""
+        if self.bundle:
+            return self.bundle.totals
+        if not self.version:
+            return self.compute_totals()
+        key = (self.id, self.version.tag)
+        totals = _totals.get(key)
+        if totals is None:
+            metrics.cache_miss("totals")
+            totals = _totals[key] = self.compute_totals()
+        else:
+            metrics.cache_hit("totals")
+        return totals
+
+    def get_settlement(self, groups):
+        """Return the settlement, cached by versions of the delivery and groups."""
+        if self.bundle:
+            return self.bundle.settlement
+        if not self.version or not groups.version:
+            return self.settle(groups)
+        key = (self.id, self.version.tag, groups.version.tag)
+        settlement = _settlements.get(key)
+        if settlement is None:
+            metrics.cache_miss("settlement")
+            settlement = _settlements[key] = self.settle(groups, self.get_totals())
+        else:
+            metrics.cache_hit("settlement")
+        return settlement
+
+    def freeze(self, groups, by=""):
+        """Compute and persist the `Bundle` of the delivery, and use it.
+
+        It must not change anymore: see `is_freezable`.
+        """
+        totals = self.compute_totals()
+        bundle = Bundle(
+            id=self.id,
+            frozen_at=datetime.now(),
+            frozen_by=by,
+            totals=totals,
+            settlement=self.settle(groups, totals),
+        )
+        bundle.persist()
+        self.bundle = bundle
+        return bundle
+
+    def unfreeze(self):
+        if self.bundle:
+            self.bundle.delete()
+            self.bundle = None
+
+
+@dataclass
+class ProductTotals(Base):
+    wanted: int = 0
+    missing: int = 0
+
+
+@dataclass
+class Totals(Base):
+    """The amounts of a delivery, by producer, orderer and product."""
+
+    total: price_field = 0
+    producers: Dict[str, price_field] = field(default_factory=dict)
+    orderers: Dict[str, price_field] = field(default_factory=dict)
+    # Orderer: producer: amount (shipping share included).
+    orderer_producers: Dict[str, Dict[str, price_field]] = field(default_factory=dict)
+    # Orderer: producer: shipping share.
+    shipping: Dict[str, Dict[str, price_field]] = field(default_factory=dict)
+    products: Dict[str, ProductTotals] = field(default_factory=dict)
+
+
+@dataclass
+class Settlement(Base):
+    """Who pays whom.
+
+    Debiters and crediters are (id, amount) pairs, results are (debiter,
+    amount, crediter) payments.
+    """
+
+    debiters: list = field(default_factory=list)
+    crediters: list = field(default_factory=list)
+    results: list = field(default_factory=list)
+    # Group ids of the referents receiving the payments: their names.
+    producer_groups: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def table(self):
+        """Return the results as a debiter: crediter: amount mapping."""
+        table = defaultdict(partial(defaultdict, float))
+        for debiter, amount, crediter in self.results:
+            table[debiter][crediter] = amount
+        return table
+
+
+@dataclass
+class Bundle(PersistedBase):
+    """What is computed from a frozen delivery, written once.
+
+    Frozen deliveries read their totals and settlement from here, and their
+    exports from the artifacts with its `key`, until unfrozen.
+    """
+
+    __root__ = "bundle"
+    __lock__ = threading.Lock()
+
+    id: str  # The one of the delivery.
+    frozen_at: datetime_field
+    totals: Totals
+    settlement: Settlement
+    frozen_by: str = ""
+
+    @classmethod
+    @timings.timed("load", metrics.storage_seconds, operation="load", kind="bundle")
+    def find(cls, id):
+        """Return the bundle of the delivery `id`, None if not frozen."""
+        if cls.get_version(id) is None:
+            return None
+        data = cls.read(id)
+        return cls(**data) if data is not None else None
+
+    @timings.timed(
+        "persist", metrics.storage_seconds, operation="persist", kind="bundle"
+    )
+    def persist(self):
+        with self.__lock__:
+            self.write(self.id, "bundle")
+
+    def delete(self):
+        with self.__lock__:
+            self.get_storage().delete(self.__root__, self.id)
+
+    @property
+    def key(self):
+        """Key of its `artifacts`: they don't depend on later changes."""
+        frozen = f"{self.id}|{self.frozen_at.isoformat()}"
+        return hashlib.sha1(frozen.encode()).hexdigest()[:16]
+
+
+@dataclass
+class ArchivedDelivery(Base):
+    id: str
+    name: str
+    from_date: datetime_field
+    to_date: datetime_field
+    orders: int = 0
+    total: price_field = 0
+
+    @classmethod
+    def from_delivery(cls, delivery):
+        return cls(
+            id=delivery.id,
+            name=delivery.name,
+            from_date=delivery.from_date,
+            to_date=delivery.to_date,
+            orders=len(delivery.orders),
+            total=delivery.total,
+        )
+
+
+@dataclass
+class Archives(PersistedBase):
+    """Catalog of the archived deliveries."""
+
+    __root__ = "archive"
+    __lock__ = threading.RLock()
+    deliveries: Dict[str, ArchivedDelivery] = field(default_factory=dict)
+
+    @classmethod
+    @timings.timed("load", metrics.storage_seconds, operation="load", kind="archive")
+    def load(cls):
+        return cls(**(cls.read("catalog") or {}))
+
+    @timings.timed(
+        "persist", metrics.storage_seconds, operation="persist", kind="archive"
+    )
+    def persist(self):
+        with self.__lock__:
+            self.write("catalog", "archive")
+
+    @classmethod
+    def add(cls, summary):
+        with cls.__lock__:
+            archives = cls.load()
+            archives.deliveries[summary.id] = summary
+            archives.persist()
+
+
+@dataclass
+class Job(PersistedBase):
+    """An export computed in the background, see `jobs`."""
+
+    __root__ = "jobs"
+    __lock__ = threading.Lock()
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    id: str
+    name: str
+    filename: str
+    content_type: str
+    delivery_id: str = ""
+    requested_by: str = ""
+    status: str = PENDING
+    created: datetime_field = field(default_factory=datetime.now)
+    started: datetime_field = None
+    finished: datetime_field = None
+    error: str = ""
+
+    @classmethod
+    @timings.timed("load", metrics.storage_seconds, operation="load", kind="job")
+    def load(cls, id):
+        data = cls.read(id)
+        if data is None:
+            raise DoesNotExist
+        job = cls(**data)
+        if job.is_stale:
+            # Its worker stopped before the end (restart, crash…).
+            job.status = cls.FAILED
+            job.error = "Interrompu"
+        return job
+
+    @classmethod
+    def recent(cls, limit=None):
+        jobs = [cls.load(id_) for id_ in cls.get_storage().ids(cls.__root__)]
+        return sorted(jobs, key=lambda j: j.created, reverse=True)[:limit]
+
+    @timings.timed("persist", metrics.storage_seconds, operation="persist", kind="job")
+    def persist(self):
+        with self.__lock__:
+            self.write(self.id, "job")
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    @property
+    def is_stale(self):
+        timeout = timedelta(seconds=config.JOB_TIMEOUT_SECONDS)
+        return not self.is_finished and self.created < datetime.now() - timeout
+
+    @property
+    def duration(self):
+        """Seconds spent computing it, None while not finished."""
+        if self.started and self.finished:
+            return (self.finished - self.started).total_seconds()
+        return None
+
+    @property
+    def result_path(self):
+        return self.get_root() / f"{self.id}.out"
@@ -1,9 +1,24 @@
+import csv
+import io
 from dataclasses import fields as get_fields
-
-from openpyxl import Workbook
-from openpyxl.writer.excel import save_virtual_workbook
+from zipfile import ZipFile, ZIP_DEFLATED
 
 from .models import Product, Producer
+from .metrics import export_seconds
+from .timings import timed
+
+
+def workbook():
+    # Imported on first use: openpyxl is heavy, and most workers never need it.
+    from openpyxl import Workbook
+
+    return Workbook()
+
+
+def save(wb):
+    from openpyxl.writer.excel import save_virtual_workbook
+
+    return save_virtual_workbook(wb)
 
 
 def summary_for_products(wb, title, delivery, total=None, products=None):
@@ -33,8 +48,9 @@ def summary_for_products(wb, title, delivery, total=None, products=None):
     ws.append(["", "", "", "", "Total", total])
 
 
+@timed("xlsx", export_seconds, format="xlsx")
 def summary(delivery, producers=None):
-    wb = Workbook()
+    wb = workbook()
     wb.remove(wb.active)
     if not producers:
         producers = delivery.producers
@@ -47,11 +63,12 @@ def summary(delivery, producers=None):
             products=delivery.get_products_by(producer),
         )
 
-    return save_virtual_workbook(wb)
+    return save(wb)
 
 
+@timed("xlsx", export_seconds, format="xlsx")
 def full(delivery):
-    wb = Workbook()
+    wb = workbook()
     ws = wb.active
     ws.title = f"{delivery.name} {delivery.from_date.date()}"
     headers = ["ref", "produit", "prix"] + [e for e in delivery.orders] + ["total"]
@@ -67,28 +84,98 @@ def full(delivery):
         ws.append(row)
     footer = (
         ["Total", "", ""]
-        + [round(o.total(delivery.products, delivery), 2) for o in delivery.orders.values()]
+        + [
+            round(o.total(delivery.products, delivery, email), 2)
+            for email, o in delivery.orders.items()
+        ]
         + [round(delivery.total, 2)]
     )
     footer.insert(1, "")
 
     ws.append(footer)
-    return save_virtual_workbook(wb)
+    return save(wb)
 
 
-def products(delivery):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"{delivery.name} produits"
+def products_rows(delivery):
     product_fields = [f.name for f in get_fields(Product)]
-    ws.append(product_fields)
+    yield product_fields
     for product in delivery.products:
-        ws.append([getattr(product, field) for field in product_fields])
+        yield [getattr(product, field) for field in product_fields]
 
-    producer_sheet = wb.create_sheet(f"producteur⋅ice⋅s et référent⋅e⋅s")
+
+def producers_rows(delivery):
     producer_fields = [f.name for f in get_fields(Producer)]
-    producer_sheet.append(producer_fields)
+    yield producer_fields
     for producer in delivery.producers.values():
-        producer_sheet.append([getattr(producer, field) for field in producer_fields])
+        yield [getattr(producer, field) for field in producer_fields]
 
-    return save_virtual_workbook(wb)
+
+@timed("xlsx", export_seconds, format="xlsx")
+def products(delivery):
+    wb = workbook()
+    ws = wb.active
+    ws.title = f"{delivery.name} produits"
+    for row in products_rows(delivery):
+        ws.append(row)
+
+    producer_sheet = wb.create_sheet(f"producteur⋅ice⋅s et référent⋅e⋅s")
+    for row in producers_rows(delivery):
+        producer_sheet.append(row)
+
+    return save(wb)
+
+
+@timed("csv", export_seconds, format="csv")
+def products_csv(delivery, delimiter=","):
+    """Zip of two CSV files using the same columns as `products`."""
+    extension = "tsv" if delimiter == "\t" else "csv"
+    output = io.BytesIO()
+    with ZipFile(output, "w", ZIP_DEFLATED) as archive:
+        for name, rows in (
+            ("produits", products_rows(delivery)),
+            ("producteurs", producers_rows(delivery)),
+        ):
+            with archive.open(f"{name}.{extension}", "w") as raw:
+                text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+                csv.writer(text, delimiter=delimiter).writerows(rows)
+                text.flush()
+                text.detach()
+    return output.getvalue()
+
+
+@timed("xlsx", export_seconds, format="xlsx")
+def analytics(products, orderers, names=None):
+    """Export the results of `analytics.products` and `analytics.orderers`."""
+    names = names or {}
+    wb = workbook()
+    ws = wb.active
+    ws.title = "produits"
+    ws.append(
+        [
+            "producteur",
+            "produit",
+            "unité",
+            "quantité",
+            "total",
+            "foyers",
+            "distributions",
+        ]
+    )
+    for row in products:
+        ws.append(
+            [
+                row["producer"],
+                row["product_name"],
+                row["unit"],
+                row["quantity"],
+                row["amount"],
+                row["orderers"],
+                row["deliveries"],
+            ]
+        )
+    ws = wb.create_sheet("foyers")
+    ws.append(["foyer", "total", "distributions"])
+    for row in orderers:
+        name = names.get(row["orderer"], row["orderer"])
+        ws.append([name, row["amount"], row["deliveries"]])
+    return save(wb)
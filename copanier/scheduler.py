@@ -0,0 +1,88 @@
+"""Prepare the exports of the deliveries when their orders close.
+
+Right after `order_before`, and again after the adjustment deadline, the
+referents all download the same order forms and reports: a task of the app
+checks the incoming deliveries every SCHEDULER_SECONDS and leaves their
+`artifacts` on disk before they are asked for. With several workers, only
+the one holding the lock file does it.
+"""
+import asyncio
+import logging
+from datetime import datetime
+
+from . import artifacts, config, utils
+from .models import Delivery
+from .views import exports
+from .views.core import app
+
+logger = logging.getLogger(__name__)
+
+_prepared = {}  # delivery id: last deadline its artifacts were prepared for.
+_task = None
+
+
+def due(delivery, now=None):
+    """Return the last passed deadline of `delivery` not prepared for yet."""
+    now = now or datetime.now()
+    dates = delivery.dates
+    deadlines = (dates["order_before"], dates["adjustment_deadline"])
+    passed = [deadline for deadline in deadlines if deadline <= now]
+    if passed and _prepared.get(delivery.id) != passed[-1]:
+        return passed[-1]
+    return None
+
+
+async def tick(now=None):
+    for delivery in await utils.run_in_executor(Delivery.incoming):
+        deadline = due(delivery, now)
+        if deadline is None:
+            continue
+        try:
+            names = await exports.prepare(delivery)
+        except Exception:
+            logger.exception("Unable to prepare the exports of %s", delivery.id)
+            continue
+        _prepared[delivery.id] = deadline
+        if names:
+            logger.info("Prepared %s for %s", ", ".join(names), delivery.id)
+
+
+def acquire():
+    """Return the scheduler lock file if no other process holds it, else None."""
+    import fcntl  # Unix only.
+
+    root = artifacts.get_root()
+    root.mkdir(parents=True, exist_ok=True)
+    lock = open(root / "scheduler.lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock  # Held until the process stops.
+
+
+async def run():
+    lock = None
+    while True:
+        await asyncio.sleep(config.SCHEDULER_SECONDS)
+        lock = lock or await utils.run_in_executor(acquire)
+        if lock is None:
+            continue
+        try:
+            await tick()
+        except Exception:
+            logger.exception("Unable to prepare the exports")
+
+
+@app.listen("startup")
+async def start():
+    global _task
+    if config.SCHEDULER_SECONDS:
+        _task = asyncio.ensure_future(run())
+
+
+@app.listen("shutdown")
+async def stop():
+    if _task is not None:
+        _task.cancel()
@@ -0,0 +1,63 @@
+"""Production server: gunicorn, with pre-forked Roll workers.
+
+Needs the `prod` extras (pip install copanier[prod]); uvloop is used when
+installed. The app is loaded and warmed up once in the master process, then
+the workers are forked from it. A worker whose resident memory goes over
+`WORKER_MAX_MEMORY` is replaced by a fresh one, after its pending requests.
+"""
+import asyncio
+
+from gunicorn.app.base import BaseApplication
+from roll.worker import Worker as RollWorker
+
+from . import config, utils, warmup
+
+
+class Worker(RollWorker):
+    async def _run(self):
+        if config.WORKER_MAX_MEMORY:
+            self.loop.create_task(self.watch_memory())
+        await super()._run()
+
+    async def watch_memory(self):
+        limit = config.WORKER_MAX_MEMORY * 1024 * 1024
+        while self.alive:
+            await asyncio.sleep(config.WORKER_MEMORY_CHECK_SECONDS)
+            memory = utils.resident_memory()
+            if memory and memory > limit:
+                self.log.info(
+                    "Recycling worker %s, using %s MiB", self.pid, memory // 2 ** 20
+                )
+                self.alive = False  # Leaves the serving loop, then closes.
+
+
+class Application(BaseApplication):
+    def __init__(self, app, options):
+        self.app = app
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        templates, deliveries, elapsed = warmup.warm_up()
+        print(
+            f"Warmed up in {elapsed:.2f}s: {templates} templates, "
+            f"{deliveries} incoming deliveries"
+        )
+        return self.app
+
+
+def run(app, host, port, workers):
+    Application(
+        app,
+        {
+            "bind": f"{host}:{port}",
+            "workers": workers,
+            "worker_class": "copanier.server.Worker",
+            # Load (and warm up) once, before forking the workers.
+            "preload_app": True,
+        },
+    ).run()
@@ -0,0 +1,112 @@
+"""Share one computation between identical concurrent requests.
+
+Right after a distribution closes, several referents download the same
+exports within seconds: the first request computes them, the other ones
+wait for its result instead of computing them again.
+
+Within a worker, the requests share an asyncio task. With `SINGLEFLIGHT_ROOT`,
+the workers also take a lock file per key: the ones that waited for it read
+the result the first one left next to it.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+
+from . import config, metrics, utils
+
+_inflight = {}  # key: asyncio.Task
+LOCK_POLL_SECONDS = 0.05
+
+
+async def run(key, compute):
+    """Return `await compute()`, shared by the concurrent calls with `key`.
+
+    The result must be bytes, and `key` must identify it (versions included).
+    """
+    task = _inflight.get(key)
+    if task is None:
+        metrics.cache_miss("singleflight")
+        task = asyncio.ensure_future(_compute(key, compute))
+        _inflight[key] = task
+        task.add_done_callback(lambda task: _done(key, task))
+    else:
+        metrics.cache_hit("singleflight")
+    # A client going away must not cancel the computation of the others.
+    return await asyncio.shield(task)
+
+
+def _done(key, task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()  # Retrieved, even when every caller went away.
+
+
+async def _compute(key, compute):
+    if not config.SINGLEFLIGHT_ROOT:
+        return await compute()
+    root = Path(config.SINGLEFLIGHT_ROOT)
+    path = root / hashlib.sha1(repr(key).encode()).hexdigest()
+    lock = await acquire(path.with_suffix(".lock"))
+    if lock is None:
+        return await compute()
+    try:
+        result = path.with_suffix(".out")
+        body = await utils.run_in_executor(read_fresh, result)
+        if body is not None:
+            metrics.cache_hit("singleflight_file")
+            return body
+        body = await compute()
+        await utils.run_in_executor(write, result, body)
+        return body
+    finally:
+        lock.close()  # Releases the lock.
+
+
+async def acquire(path):
+    """Return the lock file `path` once held, or None after SINGLEFLIGHT_SECONDS.
+
+    Polled: a blocking flock would hold a thread of the I/O executor, which
+    the worker holding the lock may need to finish its computation.
+    """
+    import fcntl  # Unix only.
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lock = open(path, "w")
+    deadline = time.monotonic() + config.SINGLEFLIGHT_SECONDS
+    while True:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock
+        except BlockingIOError:
+            if time.monotonic() > deadline:
+                lock.close()
+                return None
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+
+
+def read_fresh(path):
+    """Return the content of the result `path`, unless it's too old."""
+    try:
+        if path.stat().st_mtime > time.time() - config.SINGLEFLIGHT_SECONDS:
+            return path.read_bytes()
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def write(path, body):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(body)
+    tmp.replace(path)
+    # Results are only useful to the requests that were waiting: clean up.
+    expired = time.time() - config.SINGLEFLIGHT_SECONDS
+    for other in path.parent.glob("*.out"):
+        try:
+            if other.stat().st_mtime < expired:
+                other.unlink()
+        except FileNotFoundError:
+            pass
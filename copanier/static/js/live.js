@@ -0,0 +1,28 @@
+/* Keep the totals of a delivery up to date, without reloading the page. */
+(function (window, document) {
+    var container = document.querySelector('[data-live-url]');
+    if (!container || !window.EventSource) {
+        return;
+    }
+    var source = new EventSource(container.dataset.liveUrl);
+    var orders = null;
+
+    source.onmessage = function (event) {
+        var changes = JSON.parse(event.data);
+        for (var key in changes) {
+            var elements = document.querySelectorAll('[data-live="' + CSS.escape(key) + '"]');
+            for (var i = 0; i < elements.length; i++) {
+                elements[i].textContent = changes[key];
+            }
+        }
+        // New orderers need new columns: only a reload can add them.
+        // Each (re)connection starts with all the values, hence the check.
+        var notice = document.querySelector('.live-notice');
+        if ('orders' in changes) {
+            if (notice && orders !== null && orders !== changes.orders) {
+                notice.hidden = false;
+            }
+            orders = changes.orders;
+        }
+    };
+}(this, this.document));
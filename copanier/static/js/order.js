@@ -0,0 +1,59 @@
+/* Send only the changed lines of an order, instead of the whole form. */
+(function (window, document) {
+    var form = document.querySelector('form[data-order-url]');
+    if (!form || !window.fetch) {
+        return;
+    }
+    var url = form.dataset.orderUrl + window.location.search;
+
+    function line(ref) {
+        var line = {};
+        var wanted = form.elements['wanted:' + ref];
+        var adjustment = form.elements['adjustment:' + ref];
+        if (wanted) {
+            line.wanted = parseInt(wanted.value, 10) || 0;
+        }
+        if (adjustment) {
+            line.adjustment = parseInt(adjustment.value, 10) || 0;
+        }
+        return line;
+    }
+
+    form.addEventListener('submit', function (event) {
+        event.preventDefault();
+        var lines = {};
+        var inputs = form.querySelectorAll('input[name^="wanted:"], input[name^="adjustment:"]');
+        for (var i = 0; i < inputs.length; i++) {
+            if (inputs[i].value !== inputs[i].defaultValue) {
+                var ref = inputs[i].name.slice(inputs[i].name.indexOf(':') + 1);
+                lines[ref] = line(ref);
+            }
+        }
+        var body = {
+            base: form.dataset.orderBase,
+            lines: lines,
+            phone_number: form.elements.phone_number.value
+        };
+        fetch(url, {
+            method: 'POST',
+            credentials: 'same-origin',
+            redirect: 'manual',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify(body)
+        }).then(function (response) {
+            if (response.status === 409) {
+                window.alert('La commande a été modifiée entre temps, la page va être rechargée.');
+                window.location.reload();
+                return;
+            }
+            if (!response.ok) {
+                throw new Error(response.status);
+            }
+            return response.json().then(function (data) {
+                window.location = data.redirect;
+            });
+        }).catch(function () {
+            form.submit();  // Fallback: post the whole form.
+        });
+    });
+}(this, this.document));
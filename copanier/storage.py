@@ -0,0 +1,235 @@
+"""Where persisted documents live.
+
+Documents are plain dicts, stored by kind (a sub-folder, like "delivery")
+and id. `FileStorage` keeps them as YAML files, `MemoryStorage` in a dict:
+it backs the demo mode (seeded once from `db/demo`, never written back)
+and can be used as a fast backend for tests.
+
+Documents that are not expected to change anymore (past deliveries) can be
+archived: they are then stored compressed, out of the listings, and
+decompressed when read. Writing an archived document makes it live again.
+"""
+import copy
+import gzip
+import itertools
+import os
+import threading
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone
+from pathlib import Path
+
+import yaml
+
+from . import config
+
+# Changes each time the document is written, see `version`.
+Version = namedtuple("Version", ["tag", "modified"])
+
+# Archive compression methods, with the suffix of their files.
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def compress(raw, method="gzip"):
+    if method == "zstd":
+        import zstandard  # Optional: pip install copanier[zstd]
+
+        return zstandard.ZstdCompressor(level=10).compress(raw)
+    return gzip.compress(raw)
+
+
+def decompress(raw, method="gzip"):
+    if method == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(raw)
+    return gzip.decompress(raw)
+
+
+class FileStorage:
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, kind, id):
+        return self.root / kind / f"{id}.yml"
+
+    def archive_path(self, kind, id, method):
+        return self.root / "archive" / kind / f"{id}.yml{COMPRESSIONS[method]}"
+
+    def find_archive(self, kind, id):
+        for method in COMPRESSIONS:
+            path = self.archive_path(kind, id, method)
+            if path.exists():
+                return path, method
+        return None, None
+
+    def init(self, kind):
+        (self.root / kind).mkdir(parents=True, exist_ok=True)
+
+    def exists(self, kind, id):
+        return self.path(kind, id).exists() or self.is_archived(kind, id)
+
+    def read(self, kind, id):
+        path = self.path(kind, id)
+        if path.exists():
+            return yaml.safe_load(path.read_text())
+        path, method = self.find_archive(kind, id)
+        if path:
+            return yaml.safe_load(decompress(path.read_bytes(), method))
+        return None
+
+    def write(self, kind, id, data):
+        """Write `data` and return the number of bytes written."""
+        raw = yaml.dump(data, allow_unicode=True).encode()
+        path = self.path(kind, id)
+        # Replace rather than rewrite: readers never see a partial file, and
+        # the new inode makes for a new version even within the same mtime.
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(raw)
+        tmp.replace(path)
+        for method in COMPRESSIONS:
+            self.archive_path(kind, id, method).unlink(missing_ok=True)
+        return len(raw)
+
+    def delete(self, kind, id):
+        self.path(kind, id).unlink(missing_ok=True)
+        for method in COMPRESSIONS:
+            self.archive_path(kind, id, method).unlink(missing_ok=True)
+
+    def ids(self, kind):
+        return [path.stem for path in (self.root / kind).glob("*.yml")]
+
+    def version(self, kind, id):
+        """Return the `Version` of a document, without reading it."""
+        path = self.path(kind, id)
+        if not path.exists():
+            path, _ = self.find_archive(kind, id)
+        try:
+            stat = path.stat() if path else None
+        except FileNotFoundError:  # Archived or restored meanwhile.
+            stat = None
+        if stat is None:
+            return None
+        modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+        tag = f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        return Version(tag, modified)
+
+    def archive(self, kind, id, method="gzip"):
+        """Move a document to the archive and return its compressed size."""
+        path = self.path(kind, id)
+        target = self.archive_path(kind, id, method)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        raw = compress(path.read_bytes(), method)
+        # Write aside first: the document must never be missing from both.
+        tmp = target.with_name(f"{target.name}.tmp")
+        tmp.write_bytes(raw)
+        tmp.replace(target)
+        path.unlink()
+        return len(raw)
+
+    def is_archived(self, kind, id):
+        return self.find_archive(kind, id)[0] is not None
+
+    def archived_ids(self, kind):
+        ids = []
+        for suffix in COMPRESSIONS.values():
+            suffix = f".yml{suffix}"
+            paths = (self.root / "archive" / kind).glob(f"*{suffix}")
+            ids.extend(path.name[: -len(suffix)] for path in paths)
+        return ids
+
+
+class MemoryStorage:
+    def __init__(self, seed=None):
+        self.documents = {}
+        self.archived = {}  # (kind, id): (method, compressed YAML)
+        self.versions = {}
+        # Tags must not collide with the ones of other processes.
+        self.counter = itertools.count()
+        self.prefix = uuid.uuid4().hex[:8]
+        self.lock = threading.Lock()
+        if seed and Path(seed).exists():
+            self.seed(FileStorage(seed))
+
+    def seed(self, source):
+        for kind in (p.name for p in source.root.iterdir() if p.is_dir()):
+            for id in source.ids(kind):
+                self.documents[(kind, id)] = source.read(kind, id)
+                self.touch(kind, id)
+
+    def init(self, kind):
+        pass
+
+    def exists(self, kind, id):
+        return (kind, id) in self.documents or (kind, id) in self.archived
+
+    def read(self, kind, id):
+        # Callers own what they get: never hand out the stored dicts.
+        data = self.documents.get((kind, id))
+        if data is not None:
+            return copy.deepcopy(data)
+        if (kind, id) in self.archived:
+            method, raw = self.archived[(kind, id)]
+            return yaml.safe_load(decompress(raw, method))
+        return None
+
+    def write(self, kind, id, data):
+        with self.lock:
+            self.documents[(kind, id)] = copy.deepcopy(data)
+            self.archived.pop((kind, id), None)
+            self.touch(kind, id)
+
+    def delete(self, kind, id):
+        with self.lock:
+            self.documents.pop((kind, id), None)
+            self.archived.pop((kind, id), None)
+            self.versions.pop((kind, id), None)
+
+    def touch(self, kind, id):
+        tag = f"{self.prefix}-{next(self.counter):x}"
+        self.versions[(kind, id)] = Version(tag, datetime.now(timezone.utc))
+
+    def ids(self, kind):
+        return [id for (kind_, id) in list(self.documents) if kind_ == kind]
+
+    def version(self, kind, id):
+        return self.versions.get((kind, id))
+
+    def archive(self, kind, id, method="gzip"):
+        with self.lock:
+            data = self.documents.pop((kind, id))
+            raw = compress(yaml.dump(data, allow_unicode=True).encode(), method)
+            self.archived[(kind, id)] = (method, raw)
+        return len(raw)
+
+    def is_archived(self, kind, id):
+        return (kind, id) in self.archived
+
+    def archived_ids(self, kind):
+        return [id for (kind_, id) in list(self.archived) if kind_ == kind]
+
+
+_instances = {}
+
+
+def get():
+    """Return the storage configured with `config.STORAGE` ("file" or "memory")."""
+    key = (config.STORAGE, str(config.DATA_ROOT))
+    if key not in _instances:
+        if config.STORAGE == "memory":
+            _instances[key] = MemoryStorage()
+        else:
+            _instances[key] = FileStorage(config.DATA_ROOT)
+    return _instances[key]
+
+
+def get_demo():
+    """Return the demo storage, seeded once from `DATA_ROOT/demo`."""
+    key = ("demo", str(config.DATA_ROOT))
+    if key not in _instances:
+        _instances[key] = MemoryStorage(seed=Path(config.DATA_ROOT) / "demo")
+    return _instances[key]
+
+
+def reset():
+    _instances.clear()
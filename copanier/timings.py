@@ -0,0 +1,52 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Seconds spent per step (load, persist, render…) during the current request.
+steps = contextvars.ContextVar("steps")
+
+
+def start():
+    steps.set({})
+
+
+def get():
+    return steps.get({})
+
+
+@contextmanager
+def measure(step, metric=None, **labels):
+    """Add the time spent in the block to `step`.
+
+    If given, the `metric` histogram also observes it with `labels`.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        current = steps.get(None)
+        if current is not None:
+            current[step] = current.get(step, 0) + elapsed
+        if metric is not None:
+            metric.observe(elapsed, **labels)
+
+
+def timed(step, metric=None, **labels):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(step, metric, **labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def server_timing(breakdown, total):
+    """Format a `Server-Timing` header value, durations in milliseconds."""
+    metrics = [f"{step};dur={secs * 1000:.1f}" for step, secs in breakdown.items()]
+    metrics.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(metrics)
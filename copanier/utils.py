@@ -1,10 +1,69 @@
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
+from functools import partial
 
 import jwt
 
 from . import config
 
 
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=config.IO_WORKERS, thread_name_prefix="copanier-io"
+        )
+    return _executor
+
+
+async def run_in_executor(func, *args, **kwargs):
+    """Run a blocking `func` in the I/O threads without blocking the loop.
+
+    The current context is copied, so context variables (like the session
+    user) are still readable from `func`.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_executor(), partial(context.run, func, *args, **kwargs)
+    )
+
+
+def accepted_encoding(header, encodings):
+    """Return the first of `encodings` accepted by an `Accept-Encoding` value."""
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0
+        accepted[name.strip().lower()] = quality
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def resident_memory():
+    """Return the resident memory of this process in bytes, None if unknown."""
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):  # Not Linux.
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
 def utcnow():
     return datetime.now(timezone.utc)
 
@@ -1 +1 @@
-from . import delivery, products, groups, login  # noqa : import to scan the routes.
+from . import delivery, products, groups, login, metrics, analytics, jobs, api  # noqa : import to scan the routes.
@@ -0,0 +1,44 @@
+from .core import app, staff_only
+from .. import analytics, reports, utils
+
+
+def get_filters(request):
+    last = request.query.int("derniers", 10) or None
+    orderer = request.query.get("foyer", None)
+    return last, orderer
+
+
+@app.route("/analyses", methods=["GET"])
+@staff_only
+async def show_analytics(request, response):
+    last, orderer = get_filters(request)
+    groups = request["groups"].groups
+    response.html(
+        "analytics/show_analytics.html",
+        last=last,
+        orderer=orderer,
+        names={id: group.name for id, group in groups.items()},
+        products=await utils.run_in_executor(analytics.products, last),
+        orderers=await utils.run_in_executor(analytics.orderers, last),
+        history=(
+            await utils.run_in_executor(analytics.history, orderer, last)
+            if orderer
+            else []
+        ),
+    )
+
+
+@app.route("/analyses/exporter", methods=["GET"])
+@staff_only
+async def export_analytics(request, response):
+    last, _ = get_filters(request)
+    groups = request["groups"].groups
+
+    def export():
+        return reports.analytics(
+            analytics.products(last),
+            analytics.orderers(last),
+            {id: group.name for id, group in groups.items()},
+        )
+
+    response.xlsx(await utils.run_in_executor(export), filename="analyses.xlsx")
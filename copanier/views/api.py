@@ -0,0 +1,143 @@
+"""Read only JSON views of the deliveries, for dashboards and scripts.
+
+Amounts come from `Delivery.get_totals`, cached by delivery version (or from
+its bundle once frozen): no template is rendered. `fields=name,total` only
+keeps these keys of the objects returned.
+"""
+from http import HTTPStatus
+
+from roll import HttpError
+
+from .core import app
+from ..models import Delivery
+
+STATUSES = {
+    Delivery.EMPTY: "empty",
+    Delivery.CLOSED: "closed",
+    Delivery.NEED_PRICE_UPDATE: "need_price_update",
+    Delivery.OPEN: "open",
+    Delivery.ADJUSTMENT: "adjustment",
+    Delivery.WAITING_PRODUCTS: "waiting_products",
+    Delivery.OVER: "over",
+}
+
+
+def project(request, data):
+    """Keep the keys of `data` (a dict or a list of dicts) asked in `fields`."""
+    fields = [f for f in request.query.get("fields", "").split(",") if f]
+    if not fields:
+        return data
+    items = data if isinstance(data, list) else [data]
+    unknown = set(fields) - set(items[0]) if items else set()
+    if unknown:
+        raise HttpError(
+            HTTPStatus.BAD_REQUEST, f"Champs inconnus : {', '.join(sorted(unknown))}"
+        )
+    items = [{field: item[field] for field in fields} for item in items]
+    return items if isinstance(data, list) else items[0]
+
+
+async def load_delivery(request, response, id):
+    """Return the delivery `id`, or None when the client copy is fresh."""
+    version = Delivery.get_version(id)
+    if version is None:
+        raise HttpError(HTTPStatus.NOT_FOUND, id)
+    if response.not_modified(version, html=False):
+        return None
+    return await Delivery.aload(id)
+
+
+@app.route("/api/distribution/{id}", methods=["GET"])
+async def api_delivery(request, response, id):
+    delivery = await load_delivery(request, response, id)
+    if delivery is None:
+        return
+    totals = delivery.get_totals()
+    response.json = project(
+        request,
+        {
+            "id": delivery.id,
+            "name": delivery.name,
+            "status": STATUSES[delivery.status],
+            "frozen": bool(delivery.bundle),
+            "contact": delivery.contact,
+            "where": delivery.where,
+            "from_date": delivery.from_date.isoformat(),
+            "to_date": delivery.to_date.isoformat(),
+            "order_before": delivery.order_before.isoformat(),
+            "adjustment_deadline": delivery.dates["adjustment_deadline"].isoformat(),
+            "products": len(delivery.products),
+            "producers": len(delivery.producers),
+            "orders": len(delivery.orders),
+            "total": totals.total,
+        },
+    )
+
+
+@app.route("/api/distribution/{id}/produits", methods=["GET"])
+async def api_products(request, response, id):
+    delivery = await load_delivery(request, response, id)
+    if delivery is None:
+        return
+    totals = delivery.get_totals()
+    response.json = project(
+        request,
+        [
+            {
+                "ref": product.ref,
+                "name": product.name,
+                "producer": product.producer,
+                "price": product.price,
+                "unit": product.unit,
+                "packing": product.packing,
+                "rupture": product.rupture,
+                "wanted": totals.products[product.ref].wanted,
+                "missing": totals.products[product.ref].missing,
+            }
+            for product in delivery.products
+        ],
+    )
+
+
+@app.route("/api/distribution/{id}/producteurs", methods=["GET"])
+async def api_producers(request, response, id):
+    delivery = await load_delivery(request, response, id)
+    if delivery is None:
+        return
+    totals = delivery.get_totals()
+    response.json = project(
+        request,
+        [
+            {
+                "id": producer.id,
+                "name": producer.name,
+                "referent": producer.referent,
+                "referent_name": producer.referent_name,
+                "shipping": delivery.shipping.get(producer.id, 0),
+                "total": totals.producers[producer.id],
+            }
+            for producer in delivery.producers.values()
+        ],
+    )
+
+
+@app.route("/api/distribution/{id}/commandes", methods=["GET"])
+async def api_orders(request, response, id):
+    delivery = await load_delivery(request, response, id)
+    if delivery is None:
+        return
+    totals = delivery.get_totals()
+    groups = request["groups"].groups
+    response.json = project(
+        request,
+        [
+            {
+                "id": orderer,
+                "name": groups[orderer].name if orderer in groups else orderer,
+                "total": totals.orderers[orderer],
+                "producers": totals.orderer_producers[orderer],
+                "shipping": round(sum(totals.shipping[orderer].values()), 2),
+            }
+            for orderer in delivery.orders
+        ],
+    )
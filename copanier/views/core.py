@@ -1,56 +1,176 @@
+import gzip
+import hashlib
+import logging
+import time
+from datetime import date, datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from functools import partial
+
 import ujson as json
 
 from urllib.parse import urljoin
 from pathlib import Path
-from jinja2 import Environment, PackageLoader, select_autoescape
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    PackageLoader,
+    select_autoescape,
+)
 from roll.extensions import traceback
 from roll import Roll as BaseRoll, Response as RollResponse
 
-from weasyprint import HTML
-
 from . import session
-from .. import config, utils, loggers
+from .. import artifacts, assets, config, utils, loggers, metrics, singleflight, timings
+from ..fragments import FragmentCacheExtension
+
+try:
+    import brotli
+except ImportError:  # Optional: pip install copanier[brotli]
+    brotli = None
+
+ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+
+# PDF, XLSX, ZIP and images are already compressed.
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+logger = logging.getLogger(__name__)
+
+# Responses built by an older code (and templates) must not be fresh anymore.
+STARTED = datetime.now(timezone.utc).replace(microsecond=0)
 
 
 class Response(RollResponse):
     def render_template(self, template_name, *args, **kwargs):
-        context = app.context()
-        context.update(kwargs)
-        context["request"] = self.request
-        context["config"] = config
-        context["request"] = self.request
-        context["url_for"] = app.url_for
-        from .. import __version__
-        context["version"] = __version__
         if self.request.cookies.get("message"):
             try:
-                message = json.loads(self.request.cookies["message"])
-                context["message"] = message
+                kwargs["message"] = json.loads(self.request.cookies["message"])
             except ValueError:
-                print('Unable to read the content of the cookie message. Skipping it.')
+                logger.warning("Unable to read the cookie message, skipping it.")
             self.cookies.set("message", "")
-        return env.get_template(template_name).render(*args, **context)
+        return render_template(template_name, *args, request=self.request, **kwargs)
+
+    def not_modified(self, version, html=True):
+        """Set the `ETag` and `Last-Modified` headers from a storage `version`.
+
+        If the client copy is still fresh, set a 304 status and return True:
+        the view has nothing left to do. Every response depends on the code
+        and on the groups (their names are displayed); HTML pages also
+        depend on the user, the flash message and the current date
+        (deliveries open and close).
+        """
+        if version is None:
+            return False
+        from .. import __version__
+        from ..models import Groups
+
+        groups = Groups.get_version("groups")
+        parts = [version.tag, __version__, groups.tag if groups else ""]
+        if html:
+            user = session.user.get(None)
+            parts += [
+                user.email if user else "",
+                user.group_id if user else "",
+                self.request.cookies.get("message", ""),
+                date.today().isoformat(),
+            ]
+        # All that If-Modified-Since can be checked against.
+        modified = max(version.modified, STARTED, *([groups.modified] if groups else []))
+        digest = hashlib.sha1("|".join(parts).encode()).hexdigest()[:20]
+        # Weak: the body may be compressed on the way.
+        etag = f'W/"{digest}"'
+        self.headers["ETag"] = etag
+        self.headers["Last-Modified"] = formatdate(modified.timestamp(), usegmt=True)
+        self.headers["Cache-Control"] = "private, no-cache"
+
+        if_none_match = self.request.headers.get("IF-NONE-MATCH")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            fresh = etag in tags or "*" in tags
+        elif not html and self.request.headers.get("IF-MODIFIED-SINCE"):
+            # Dates alone can't tell about the user or message of HTML pages.
+            try:
+                since = parsedate_to_datetime(
+                    self.request.headers["IF-MODIFIED-SINCE"]
+                )
+            except (TypeError, ValueError):
+                return False
+            fresh = int(modified.timestamp()) <= since.timestamp()
+        else:
+            fresh = False
+        if fresh:
+            metrics.cache_hit("http")
+            self.status = 304
+            self.body = b""
+        else:
+            metrics.cache_miss("http")
+        return fresh
 
     def html(self, template_name, *args, **kwargs):
         self.headers["Content-Type"] = "text/html; charset=utf-8"
         self.body = self.render_template(template_name, *args, **kwargs)
 
-    def render_pdf(self, template_name, *args, **kwargs):
+    async def render_pdf(self, template_name, *args, **kwargs):
         html = self.render_template(template_name, *args, **kwargs)
-
-        static_folder = Path(__file__).parent.parent / "static"
-        stylesheets = [
-            static_folder / "app.css",
-            static_folder / "icomoon.css",
-            static_folder / "page.css",
-        ]
-        if "css" in kwargs:
-            stylesheets.append(static_folder / kwargs["css"])
-
-        return HTML(string=html).write_pdf(stylesheets=stylesheets)
-
-    def pdf(self, template_name, *args, **kwargs):
-        self.body = self.render_pdf(template_name, *args, **kwargs)
+        return await utils.run_in_executor(write_pdf, html, kwargs.get("css"))
+
+    async def shared(self, version, compute):
+        """Return `await compute()`, or the result of an identical request.
+
+        Identical: same URL, same delivery `version` and groups version, see
+        `singleflight`. The results must not depend on the user: the user
+        parts of the pages (menus, edit buttons) are hidden from PDF.
+        """
+        from ..models import Groups
+
+        groups = Groups.get_version("groups")
+        key = (self.request.url, version.tag, groups.tag if groups else "")
+        return await singleflight.run(key, compute)
+
+    async def artifact(self, version, delivery, name, export):
+        """Return the artifact `name` of `delivery`, see `artifacts`.
+
+        Read from disk when there for this `version`, else computed with
+        `export` (see `exports`), once for identical requests, and left there
+        for the next ones.
+        """
+        from ..models import Groups
+
+        if delivery.bundle:
+            key = delivery.bundle.key
+        else:
+            key = artifacts.key(version, Groups.get_version("groups"))
+        body = await utils.run_in_executor(artifacts.read, delivery.id, name, key)
+        if body is not None:
+            metrics.cache_hit("artifact")
+            return body
+        metrics.cache_miss("artifact")
+
+        async def compute():
+            # Written meanwhile by a request which is not in flight anymore?
+            body = await utils.run_in_executor(artifacts.read, delivery.id, name, key)
+            if body is None:
+                compute = export(self.render_template, delivery)
+                body = await utils.run_in_executor(compute)
+                await utils.run_in_executor(
+                    artifacts.write, delivery.id, name, key, body
+                )
+            return body
+
+        return await self.shared(version, compute)
+
+    async def pdf(self, template_name, *args, version=None, **kwargs):
+        """Render `template_name` as a PDF attachment.
+
+        With the delivery `version`, identical requests share the rendering.
+        """
+        render = partial(self.render_pdf, template_name, *args, **kwargs)
+        self.body = await (self.shared(version, render) if version else render())
         mimetype = "application/pdf"
         filename = kwargs.get("filename", "file.pdf")
         self.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
@@ -62,6 +182,16 @@ class Response(RollResponse):
         self.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
         self.headers["Content-Type"] = f"{mimetype}; charset=utf-8"
 
+    def zip(self, body, filename=f"{config.SITE_NAME}.zip"):
+        self.body = body
+        self.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        self.headers["Content-Type"] = "application/zip"
+
+    def attachment(self, body, filename, content_type):
+        self.body = body
+        self.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        self.headers["Content-Type"] = content_type
+
     def redirect(self, location):
         self.status = 302
         self.headers["Location"] = url(location)
@@ -72,11 +202,51 @@ class Response(RollResponse):
         self.cookies.set("message", json.dumps((text, status)))
 
 
-def get_function_name(node):
-    if not node.payload:
+def render_template(template_name, *args, request, **kwargs):
+    """Render `template_name` for `request`.
+
+    Outside of a request (background tasks), `request` can be a dict with a
+    `groups` and a (None) `user`, the values templates read from it.
+    """
+    context = app.context()
+    context.update(kwargs)
+    context["request"] = request
+    context["config"] = config
+    context["url_for"] = app.url_for
+    context["static"] = static_url
+    from .. import __version__
+    context["version"] = __version__
+    with timings.measure(
+        "render", metrics.template_seconds, template=template_name
+    ):
+        return env.get_template(template_name).render(*args, **context)
+
+
+@timings.timed("pdf", metrics.export_seconds, format="pdf")
+def write_pdf(html, css=None):
+    """Return the PDF of `html`, with the app styles and the `css` static file.
+
+    Blocking: run it in an executor.
+    """
+    # Imported on first use: WeasyPrint (and cairo, pango…) is heavy.
+    from weasyprint import HTML
+
+    static_folder = Path(__file__).parent.parent / "static"
+    stylesheets = [
+        static_folder / "app.css",
+        static_folder / "icomoon.css",
+        static_folder / "page.css",
+    ]
+    if css:
+        stylesheets.append(static_folder / css)
+    return HTML(string=html).write_pdf(stylesheets=stylesheets)
+
+
+def get_function_name(node, method="GET"):
+    if not node.payload or method not in node.payload:
         return False
 
-    func = node.payload["GET"]
+    func = node.payload[method]
     if hasattr(func, "decorates"):
         return func.decorates.__name__
     else:
@@ -91,6 +261,9 @@ def url(path):
     return path
 
 
+def static_url(name):
+    return url(assets.static_path(name))
+
 
 class Roll(BaseRoll):
     Response = Response
@@ -108,7 +281,12 @@ class Roll(BaseRoll):
 
     def _find_route_by_name(self, name, node=None):
         node = node or self.routes.root
-        if get_function_name(node) == name:
+        # Any method: forms post to routes with no GET.
+        if node.payload and any(
+            get_function_name(node, method) == name
+            for method in node.payload
+            if method.isupper()
+        ):
             return node
 
         if node.edges:
@@ -139,18 +317,71 @@ def staff_only(view):
             return
         return await view(request, response, *args, **kwargs)
 
-    decorator.decorates = view
+    decorator.decorates = getattr(view, "decorates", view)
     return decorator
 
 
+def edits(model, key="id", methods=("POST",)):
+    """Run the `methods` requests of a view one at a time per `model` document.
+
+    For views that load a document, change it and persist it, see
+    `PersistedBase.edit_lock`. The document id is the `key` route param.
+    Frozen documents are not changed: the user is redirected.
+    """
+
+    def wrapper(view):
+        async def decorator(request, response, *args, **kwargs):
+            if request.method not in methods:
+                return await view(request, response, *args, **kwargs)
+            async with model.edit_lock(kwargs[key]):
+                if model.is_frozen(kwargs[key]):
+                    response.message(
+                        "Cette distribution est figée, il faut la défiger pour "
+                        "la modifier.",
+                        "warning",
+                    )
+                    response.redirect = request.headers.get("REFERRER", "/")
+                    return
+                return await view(request, response, *args, **kwargs)
+
+        decorator.decorates = getattr(view, "decorates", view)
+        return decorator
+
+    return wrapper
+
+
 def configure():
     config.init()
 
 
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=config.BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=config.GZIP_LEVEL, mtime=0)
+
+
+class BytecodeCache(FileSystemBytecodeCache):
+    """Compiled templates on disk, so new workers don't parse them again."""
+
+    def dump_bytecode(self, bucket):
+        # Created on first write: importing the app must not touch the disk.
+        Path(self.directory).mkdir(parents=True, exist_ok=True)
+        super().dump_bytecode(bucket)
+
+    def load_bytecode(self, bucket):
+        super().load_bytecode(bucket)
+        # Only asked for templates not compiled yet by this process.
+        if bucket.code is None:
+            metrics.cache_miss("bytecode")
+        else:
+            metrics.cache_hit("bytecode")
+
+
 env = Environment(
     loader=PackageLoader("copanier", "templates"),
     autoescape=select_autoescape(["copanier"]),
-    extensions=['jinja2.ext.loopcontrols']
+    extensions=["jinja2.ext.loopcontrols", FragmentCacheExtension],
+    bytecode_cache=BytecodeCache(str(config.TEMPLATE_CACHE_ROOT)),
 )
 
 
@@ -161,11 +392,77 @@ app = Roll()
 traceback(app)
 
 
+@app.listen("headers")
+async def start_timer(request, response):
+    request["started"] = time.perf_counter()
+    timings.start()
+    metrics.active_requests.inc()
+
+
 @app.listen("request")
 async def attach_request(request, response):
     response.request = request
 
 
+@app.listen("response")
+async def compress_response(request, response):
+    if not config.COMPRESS_RESPONSES or "Content-Encoding" in response.headers:
+        return
+    if not response.headers.get("Content-Type", "").startswith(COMPRESSIBLE_TYPES):
+        return
+    vary = response.headers.get("Vary")
+    response.headers["Vary"] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+    body = response.body
+    if isinstance(body, str):
+        body = response.body = body.encode()
+    if not isinstance(body, bytes) or len(body) < config.COMPRESSION_MIN_SIZE:
+        return
+    encoding = utils.accepted_encoding(
+        request.headers.get("ACCEPT-ENCODING", ""), ENCODINGS
+    )
+    if not encoding:
+        return
+    with timings.measure("compress"):
+        if len(body) >= config.COMPRESSION_THREAD_SIZE:
+            body = await utils.run_in_executor(compress, body, encoding)
+        else:
+            body = compress(body, encoding)
+    response.body = body
+    response.headers["Content-Encoding"] = encoding
+
+
+@app.listen("response")
+async def log_request(request, response):
+    if "started" not in request:  # Unparsable request.
+        return
+    total = time.perf_counter() - request["started"]
+    route = get_function_name(request.route, request.method) or None
+    metrics.active_requests.dec()
+    metrics.request_seconds.observe(total, route=route or "")
+    breakdown = timings.get()
+    if isinstance(response.body, str):
+        # Encode once here, so we know the real size (Roll would do it anyway).
+        response.body = response.body.encode()
+    size = len(response.body) if isinstance(response.body, bytes) else None
+    user = session.user.get(None)
+    if user and user.is_staff:
+        response.headers["Server-Timing"] = timings.server_timing(breakdown, total)
+    loggers.request_logger.info(
+        json.dumps(
+            {
+                "time": utils.utcnow().isoformat(),
+                "method": request.method,
+                "path": request.path,
+                "route": route,
+                "status": response.status.value,
+                "size": size,
+                "duration": round(total * 1000, 2),
+                "steps": {k: round(v * 1000, 2) for k, v in breakdown.items()},
+            }
+        )
+    )
+
+
 @app.listen("startup")
 async def on_startup():
     configure()
@@ -1,49 +1,68 @@
-from collections import defaultdict
+import asyncio
+from dataclasses import asdict
 from functools import partial
-from roll import HttpError
+from http import HTTPStatus
 
-from debts.solver import order_balance, check_balance, reduce_balance
+import ujson as json
+from roll import HttpError
 
-from .core import app, session, env
-from ..models import Delivery, Person, Order, ProductOrder, Groups, SavedConfiguration
-from .. import utils, reports, emails, config
+from .core import app, edits, session, env, staff_only
+from . import exports
+from ..models import (
+    Archives,
+    Bundle,
+    Delivery,
+    Person,
+    Order,
+    ProductOrder,
+    Groups,
+    SavedConfiguration,
+)
+from .. import utils, reports, emails, config, live
 
 
 @app.listen("startup")
 async def on_startup():
     Delivery.init_fs()
+    Archives.init_fs()
+    Bundle.init_fs()
+
+
+def is_onboarded():
+    return Delivery.is_defined() or Groups.is_defined()
 
 
 @app.route("/", methods=["GET"])
 async def home(request, response):
-    if not Delivery.is_defined() and not Groups.is_defined():
+    if not await utils.run_in_executor(is_onboarded):
         response.redirect = app.url_for("onboarding")
         return
     if not request["user"].group_id:
         response.redirect = app.url_for("groups")
         return
 
-    deliveries=Delivery.incoming()
+    deliveries = await utils.run_in_executor(Delivery.incoming)
     if len(deliveries) == 1:
         response.redirect = app.url_for("show_delivery", id=deliveries[0].id)
     else:
         response.html(
             "delivery/list_deliveries.html",
-            deliveries=Delivery.incoming(),
+            deliveries=deliveries,
         )
 
 
 @app.route("/archives", methods=["GET"])
 async def archives(request, response):
-    if not Delivery.is_defined() and not Groups.is_defined():
+    if not await utils.run_in_executor(is_onboarded):
         response.redirect = app.url_for("onboarding")
         return
     if not request["user"].group_id:
         response.redirect = app.url_for("groups")
         return
     response.html(
-        "delivery/list_deliveries.html",
-        deliveries=Delivery.former(),
+        "delivery/list_archives.html",
+        deliveries=await utils.run_in_executor(Delivery.former),
+        archived=await utils.run_in_executor(Delivery.archived),
     )
 
 
@@ -64,14 +83,14 @@ def create_delivery_from_form(form):
 @app.route("/distribution", methods=["POST"])
 async def create_delivery(request, response):
     delivery = create_delivery_from_form(request.form)
-    delivery.persist()
+    await delivery.apersist()
     response.message("La distribution a bien été créée!")
     response.redirect = f"/distribution/{delivery.id}"
 
 
 @app.route("/distribution/{id}/transmettre", methods=["GET"])
 async def hand_over_delivery(request, response, id):
-    delivery = Delivery.load(id)
+    delivery = await Delivery.aload(id)
 
     response.html(
         "delivery/handover_delivery.html",
@@ -80,13 +99,14 @@ async def hand_over_delivery(request, response, id):
 
 
 @app.route("/distribution/{id}/transmettre", methods=["POST"])
+@edits(Delivery)
 async def hand_over_delivery_post(request, response, id):
-    old_delivery = Delivery.load(id)
+    old_delivery = await Delivery.aload(id)
 
     form = request.form
     new_delivery = create_delivery_from_form(form)
     new_delivery.producers = old_delivery.producers
-    new_delivery.products = old_delivery.products
+    new_delivery.set_products(old_delivery.products)
 
     # Update referent fields.
     for producer_id, producer in new_delivery.producers.items():
@@ -94,11 +114,11 @@ async def hand_over_delivery_post(request, response, id):
         producer.referent_name = form.get(f'producer_{producer_id}_referent_name')
         producer.referent_tel = form.get(f'producer_{producer_id}_referent_tel')
         new_delivery.producers[producer_id] = producer
-    new_delivery.persist()
+    await new_delivery.apersist()
 
     # Mark the old delivery as over.
     old_delivery.over = True
-    old_delivery.persist()
+    await old_delivery.apersist()
 
     emails.send_from_template(
         env,
@@ -119,17 +139,22 @@ async def hand_over_delivery_post(request, response, id):
 
 @app.route("/distribution/{id}/{producer}/bon-de-commande.pdf", methods=["GET"])
 async def pdf_for_producer(request, response, id, producer):
-    delivery = Delivery.load(id)
-    response.pdf(
-        "list_products.html",
-        {"list_only": True, "delivery": delivery, "producers": [producer]},
-        filename=utils.prefix(f"bon-de-commande-{producer}.pdf", delivery),
+    version = Delivery.get_version(id)
+    if response.not_modified(version, html=False):
+        return
+    delivery = await Delivery.aload(id)
+    name = f"bon-de-commande-{producer}.pdf"
+    export = partial(exports.producer_order_form, producer=producer)
+    response.attachment(
+        await response.artifact(version, delivery, name, export),
+        utils.prefix(name, delivery),
+        exports.PDF,
     )
 
 
 @app.route("/distribution/{id}/gérer", methods=["GET"])
 async def show_delivery_toolbox(request, response, id):
-    delivery = Delivery.load(id)
+    delivery = await Delivery.aload(id)
     response.html(
         "delivery/show_toolbox.html",
         {
@@ -141,7 +166,7 @@ async def show_delivery_toolbox(request, response, id):
 
 @app.route("/distribution/{id}/envoi-email-referentes", methods=["GET", "POST"])
 async def send_referent_emails(request, response, id):
-    delivery = Delivery.load(id)
+    delivery = await Delivery.aload(id)
     if request.method == "POST":
         email_body = request.form.get("email_body")
         email_subject = request.form.get("email_subject")
@@ -151,7 +176,7 @@ async def send_referent_emails(request, response, id):
             attachments = []
             for producer in producers:
                 if delivery.producers[producer].has_active_products(delivery):
-                    pdf_file = response.render_pdf(
+                    pdf_file = await response.render_pdf(
                         "list_products.html",
                         {
                             "list_only": True,
@@ -185,49 +210,160 @@ async def send_referent_emails(request, response, id):
 
 @app.route("/distribution/{id}/exporter", methods=["GET"])
 async def export_products(request, response, id):
-    delivery = Delivery.load(id)
-    response.xlsx(reports.products(delivery))
+    if response.not_modified(Delivery.get_version(id), html=False):
+        return
+    delivery = await Delivery.aload(id)
+    format = request.query.get("format", "xlsx")
+    if format in ("csv", "tsv"):
+        delimiter = "\t" if format == "tsv" else ","
+        response.zip(
+            await utils.run_in_executor(reports.products_csv, delivery, delimiter),
+            filename=utils.prefix(f"produits-{format}.zip", delivery),
+        )
+    else:
+        response.xlsx(await utils.run_in_executor(reports.products, delivery))
 
 
 @app.route("/distribution/{id}/edit", methods=["GET"])
 async def edit_delivery(request, response, id):
-    delivery = Delivery.load(id)
+    delivery = await Delivery.aload(id)
     response.html("delivery/edit_delivery.html", {"delivery": delivery})
 
 
 @app.route("/distribution/{id}/edit", methods=["POST"])
+@edits(Delivery)
 async def post_delivery(request, response, id):
-    delivery = Delivery.load(id)
+    delivery = await Delivery.aload(id)
     form = request.form
     delivery.from_date = f"{form.get('date')} {form.get('from_time')}"
     delivery.to_date = f"{form.get('date')} {form.get('to_time')}"
     for name in Delivery.__dataclass_fields__.keys():
         if name in form:
             setattr(delivery, name, form.get(name))
-    delivery.persist()
+    await delivery.apersist()
     response.message("La distribution a bien été mise à jour!")
     response.redirect = f"/distribution/{delivery.id}"
 
 
 @app.route("/distribution/{id}", methods=["GET"])
 async def show_delivery(request, response, id):
-    delivery = Delivery.load(id)
+    if response.not_modified(Delivery.get_version(id)):
+        return
+    delivery = await Delivery.aload(id)
     response.html("delivery/show_delivery.html", {"delivery": delivery})
 
 
+@app.route("/distribution/{id}/direct", methods=["GET"])
+async def live_delivery(request, response, id):
+    """Stream the changes of the delivery totals, as Server-Sent Events."""
+    if not Delivery.get_version(id):
+        raise HttpError(HTTPStatus.NOT_FOUND, id)
+    transport = getattr(request.protocol, "transport", None)
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + config.LIVE_STREAM_SECONDS
+        changed = live.subscribe(id)
+        version = None
+        previous = {}
+        try:
+            yield "retry: 3000\n\n"
+            while loop.time() < deadline:
+                if transport and transport.is_closing():
+                    break
+                current = Delivery.get_version(id)
+                if current != version:
+                    version = current
+                    delivery = await Delivery.aload(id)
+                    snapshot = live.snapshot(delivery)
+                    delta = live.diff(previous, snapshot)
+                    previous = snapshot
+                    if delta:
+                        yield f"data: {json.dumps(delta)}\n\n"
+                else:
+                    yield ": ping\n\n"  # Detects closed connections.
+                try:
+                    await asyncio.wait_for(changed.wait(), config.LIVE_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                changed.clear()
+        finally:
+            live.unsubscribe(id, changed)
+
+    response.headers["Content-Type"] = "text/event-stream"
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Don't let nginx buffer.
+    response.body = events()
+
+
+def get_orderer(request):
+    """Return the person the order is placed for, None if unknown."""
+    orderer = request.query.get("orderer", None)
+    if orderer:
+        return Person(email=orderer, group_id=orderer)
+    return session.user.get(None)
+
+
+def send_order_emails(request, delivery, orderer, order):
+    """Send the recap of `order` to `orderer`, or to everyone in their group."""
+    groups = request["groups"].groups
+    if orderer.group_id in groups.keys():
+        recipients = groups[orderer.group_id].members
+        group_id = orderer.group_id
+    else:
+        recipients = [orderer.email]
+        group_id = orderer.email
+    for email in recipients:
+        emails.send_order(
+            request,
+            env,
+            person=Person(email=email),
+            delivery=delivery,
+            order=order,
+            group_id=group_id,
+            url_for=app.url_for,
+        )
+
+
+def read_order_changes(delivery, order, lines):
+    """Return the `{ref: ProductOrder}` of the changed `lines` of a JSON order.
+
+    A line without `wanted` or `adjustment` keeps the value of `order`. Raise
+    an HttpError if one of them is not a product of the delivery, or not a
+    valid quantity.
+    """
+    if not isinstance(lines, dict):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "`lines` doit être un objet")
+    index = delivery.product_index
+    changes = {}
+    for ref, line in lines.items():
+        if ref not in index:
+            raise HttpError(HTTPStatus.UNPROCESSABLE_ENTITY, f"Produit inconnu : {ref}")
+        try:
+            choice = ProductOrder(
+                wanted=int(line.get("wanted", order[ref].wanted)),
+                adjustment=int(line.get("adjustment", order[ref].adjustment)),
+            )
+        except (AttributeError, TypeError, ValueError):
+            raise HttpError(
+                HTTPStatus.UNPROCESSABLE_ENTITY, f"Quantité invalide : {ref}"
+            )
+        if choice.wanted < 0 or choice.quantity < 0:
+            raise HttpError(
+                HTTPStatus.UNPROCESSABLE_ENTITY, f"Quantité négative : {ref}"
+            )
+        changes[ref] = choice
+    return changes
+
+
 @app.route("/distribution/{id}/commander", methods=["POST", "GET"])
+@edits(Delivery)
 async def place_order(request, response, id):
-    delivery = Delivery.load(id)
-    # email = request.query.get("email", None)
+    delivery = await Delivery.aload(id)
     user = session.user.get(None)
-    orderer = request.query.get("orderer", None)
-    if orderer:
-        orderer = Person(email=orderer, group_id=orderer)
+    orderer = get_orderer(request)
 
     delivery_url = f"/distribution/{delivery.id}"
-    if not orderer and user:
-        orderer = user
-
     if not orderer:
         response.message("Impossible de comprendre pour qui passer commande…", "error")
         response.redirect = delivery_url
@@ -262,37 +398,15 @@ async def place_order(request, response, id):
         if not order.products:
             if orderer.id in delivery.orders:
                 del delivery.orders[orderer.id]
-                delivery.persist()
+                await delivery.apersist()
             response.message("La commande est vide.", status="warning")
             response.redirect = delivery_url
             return
         delivery.orders[orderer.id] = order
-        delivery.persist()
+        await delivery.apersist()
 
         if user and orderer.id == user.id:
-            # Send the emails to everyone in the group.
-            groups = request["groups"].groups
-            if orderer.group_id in groups.keys():
-                for email in groups[orderer.group_id].members:
-                    emails.send_order(
-                        request,
-                        env,
-                        person=Person(email=email),
-                        delivery=delivery,
-                        order=order,
-                        group_id=orderer.group_id,
-                        url_for=app.url_for,
-                    )
-            else:
-                emails.send_order(
-                    request,
-                    env,
-                    person=Person(email=orderer.email),
-                    delivery=delivery,
-                    order=order,
-                    group_id=orderer.email,
-                    url_for=app.url_for,
-                )
+            send_order_emails(request, delivery, orderer, order)
         response.message(
             f"La commande pour « {orderer.name} » a bien été prise en compte, "
             "on a envoyé un récap par email 😘"
@@ -310,19 +424,78 @@ async def place_order(request, response, id):
         )
 
 
+@app.route("/distribution/{id}/commande.json", methods=["POST"])
+@edits(Delivery)
+async def update_order(request, response, id):
+    """Apply the changed lines of an order, sent as JSON.
+
+    The body is `{"base": …, "lines": {ref: {"wanted": …, "adjustment": …}}}`,
+    with an optional `phone_number`. `base` is the `Order.tag` the changes
+    were made against: if the order changed meanwhile, nothing is applied and
+    the current order is returned with a 409 status.
+    """
+    delivery = await Delivery.aload(id)
+    user = session.user.get(None)
+    orderer = get_orderer(request)
+    if not orderer:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Pour qui passer commande ?")
+    if delivery.status == delivery.CLOSED and not (user and user.is_staff):
+        raise HttpError(HTTPStatus.FORBIDDEN, "La distribution est fermée")
+    data = request.json
+    if not isinstance(data, dict):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Commande invalide")
+
+    order = delivery.orders.get(orderer.id) or Order()
+    changes = read_order_changes(delivery, order, data.get("lines", {}))
+    if data.get("base") != order.tag:
+        response.status = HTTPStatus.CONFLICT
+        response.json = {
+            "tag": order.tag,
+            "lines": {ref: asdict(choice) for ref, choice in order},
+        }
+        return
+    order.update(changes)
+    if "phone_number" in data:
+        order.phone_number = str(data["phone_number"])
+
+    delivery_url = f"/distribution/{delivery.id}"
+    if not order.products:
+        if orderer.id in delivery.orders:
+            del delivery.orders[orderer.id]
+            await delivery.apersist()
+        response.message("La commande est vide.", status="warning")
+        response.json = {"tag": Order().tag, "redirect": delivery_url}
+        return
+    delivery.orders[orderer.id] = order
+    await delivery.apersist()
+
+    if user and orderer.id == user.id:
+        send_order_emails(request, delivery, orderer, order)
+    response.message(
+        f"La commande pour « {orderer.name} » a bien été prise en compte, "
+        "on a envoyé un récap par email 😘"
+    )
+    response.json = {"tag": order.tag, "redirect": delivery_url}
+
+
 @app.route("/distribution/{id}/résumé-de-commandes", methods=["GET"])
 async def show_orders_summary(request, response, id):
-    delivery = Delivery.load(id)
-    response.pdf(
-        "delivery/show_orders_summary.html",
-        {"delivery": delivery, "display_prices": True},
-        css="order-summary.css",
-        filename=utils.prefix("résumé-de-commandes.pdf", delivery),
+    version = Delivery.get_version(id)
+    if response.not_modified(version, html=False):
+        return
+    delivery = await Delivery.aload(id)
+    name = "résumé-de-commandes.pdf"
+    response.attachment(
+        await response.artifact(version, delivery, name, exports.orders_summary),
+        utils.prefix(name, delivery),
+        exports.PDF,
     )
 
 @app.route("/distribution/{id}/résumé-de-commandes.html", methods=["GET"])
 async def show_orders_summary(request, response, id):
-    delivery = Delivery.load(id)
+    if response.not_modified(Delivery.get_version(id)):
+        return
+    delivery = await Delivery.aload(id)
     response.html(
         "delivery/show_orders_summary.html",
         delivery=delivery,
@@ -331,17 +504,21 @@ async def show_orders_summary(request, response, id):
 
 @app.route("/distribution/{id}/rapport-complet.xlsx", methods=["GET"])
 async def generate_report(request, response, id):
-    delivery = Delivery.load(id)
-    date = delivery.to_date.strftime("%Y-%m-%d")
+    version = Delivery.get_version(id)
+    if response.not_modified(version, html=False):
+        return
+    delivery = await Delivery.aload(id)
+    name = "rapport-complet.xlsx"
     response.xlsx(
-        reports.full(delivery),
-        filename=f"{config.SITE_NAME}-{date}-rapport-complet.xlsx",
+        await response.artifact(version, delivery, name, exports.full_report),
+        filename=utils.prefix(name, delivery),
     )
 
 
 @app.route("/distribution/{id}/ajuster/{ref}", methods=["GET", "POST"])
+@edits(Delivery)
 async def adjust_product(request, response, id, ref):
-    delivery = Delivery.load(id)
+    delivery = await Delivery.aload(id)
     delivery_url = f"/distribution/{delivery.id}"
     product = None
     for product in delivery.products:
@@ -357,7 +534,7 @@ async def adjust_product(request, response, id, ref):
             choice = order[product]
             choice.adjustment = form.int(email, 0)
             order[product] = choice
-        delivery.persist()
+        await delivery.apersist()
         response.message(f"Le produit «{product.ref}» a bien été ajusté!")
         response.redirect = delivery_url
     else:
@@ -366,56 +543,82 @@ async def adjust_product(request, response, id, ref):
         )
 
 
+@app.route("/distribution/{id}/ajuster", methods=["GET", "POST"])
+@staff_only
+@edits(Delivery)
+async def adjust_products(request, response, id):
+    delivery = await Delivery.aload(id)
+    if request.method == "POST":
+        form = request.form
+        adjusted = set()
+        for product in delivery.products:
+            for email, order in delivery.orders.items():
+                key = f"{product.ref}:{email}"
+                if key in form:
+                    choice = order[product]
+                    choice.adjustment = form.int(key, 0)
+                    order[product] = choice
+                    adjusted.add(product.ref)
+        if adjusted:
+            await delivery.apersist()
+        response.message(f"{len(adjusted)} produit(s) ajusté(s) !")
+        response.redirect = f"/distribution/{delivery.id}"
+        return
+    proposals = delivery.propose_adjustments()
+    response.html(
+        "delivery/adjust_products.html",
+        {
+            "delivery": delivery,
+            "products": [p for p in delivery.products if p.ref in proposals],
+            "proposals": proposals,
+        },
+    )
+
+
 @app.route("/distribution/{id}/paiements", methods=["GET"])
 async def compute_payments(request, response, id):
-    delivery = Delivery.load(id)
+    delivery = await Delivery.aload(id)
     groups = request["groups"]
-
-    balance = []
-    for group_id, order in delivery.orders.items():
-        balance.append(
-            (group_id, order.total(delivery.products, delivery, group_id) * -1)
-        )
-
-    producer_groups = {}
-
-    for producer in delivery.producers.values():
-        group = groups.get_user_group(producer.referent)
-        # When a group contains multiple producer contacts,
-        # the first one is elected to receive the money,
-        # and all the other ones are separated in the table.
-        group_id = None
-        if hasattr(group, "id"):
-            if (
-                group.id not in producer_groups
-                or producer_groups[group.id] == producer.referent_name
-            ):
-                producer_groups[group.id] = producer.referent_name
-                group_id = group.id
-        if not group_id:
-            group_id = producer.referent_name
-
-        amount = delivery.total_for_producer(producer.id)
-        print(producer.id, amount)
-        if amount:
-            balance.append((group_id, amount))
-
-    debiters, crediters = order_balance(balance)
-    results = reduce_balance(debiters[:], crediters[:])
-
-    results_dict = defaultdict(partial(defaultdict, float))
-
-    for debiter, amount, crediter in results:
-        results_dict[debiter][crediter] = amount
+    settlement = delivery.get_settlement(groups)
 
     template_name = "delivery/compute_balance.html"
     template_args = {
         "delivery": delivery,
-        "debiters": debiters,
-        "crediters": crediters,
-        "results": results_dict,
+        "debiters": settlement.debiters,
+        "crediters": settlement.crediters,
+        "results": settlement.table,
         "debiters_groups": groups.groups,
-        "crediters_groups": producer_groups,
+        "crediters_groups": settlement.producer_groups,
     }
 
     response.html(template_name, template_args)
+
+
+@app.route("/distribution/{id}/figer", methods=["POST"])
+@staff_only
+@edits(Delivery)
+async def freeze_delivery(request, response, id):
+    delivery = await Delivery.aload(id)
+    response.redirect = f"/distribution/{id}/gérer"
+    if not delivery.is_freezable:
+        response.message(
+            "La distribution ne peut être figée qu'une fois les ajustements "
+            "terminés.",
+            "warning",
+        )
+        return
+    await utils.run_in_executor(
+        delivery.freeze, request["groups"], by=request["user"].email
+    )
+    await exports.prepare(delivery)
+    response.message("La distribution est figée.")
+
+
+@app.route("/distribution/{id}/défiger", methods=["POST"])
+@staff_only
+async def unfreeze_delivery(request, response, id):
+    async with Delivery.edit_lock(id):
+        delivery = await Delivery.aload(id)
+        await utils.run_in_executor(delivery.unfreeze)
+    response.message("La distribution peut à nouveau être modifiée.")
+    response.redirect = f"/distribution/{id}/gérer"
@@ -0,0 +1,86 @@
+"""The files exported for a delivery.
+
+Each function renders what needs the templates with `render` (like
+`Response.render_template`), and returns the blocking function computing
+the file: the views run it in an executor, the jobs and the scheduler in
+their own threads.
+"""
+from functools import partial
+
+from .core import render_template, write_pdf
+from .. import artifacts, reports, utils
+from ..models import Groups
+
+PDF = "application/pdf"
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def producer_order_form(render, delivery, producer):
+    html = render(
+        "products/list_products.html",
+        {"list_only": True, "delivery": delivery, "producers": [producer]},
+    )
+    return partial(write_pdf, html)
+
+
+def products_list(render, delivery, referent=None):
+    html = render(
+        "products/list_products.html",
+        {
+            "edit_mode": False,
+            "list_only": True,
+            "delivery": delivery,
+            "referent": referent,
+        },
+    )
+    return partial(write_pdf, html, "landscape.css")
+
+
+def orders_summary(render, delivery):
+    html = render(
+        "delivery/show_orders_summary.html",
+        {"delivery": delivery, "display_prices": True},
+    )
+    return partial(write_pdf, html, "order-summary.css")
+
+
+def full_report(render, delivery):
+    return partial(reports.full, delivery)
+
+
+def artifacts_for(delivery):
+    """Return the exports everyone downloads once the orders are closed.
+
+    As a dict of artifact names and functions taking `render` and the
+    delivery.
+    """
+    files = {
+        "produits.pdf": products_list,
+        "résumé-de-commandes.pdf": orders_summary,
+        "rapport-complet.xlsx": full_report,
+    }
+    for id, producer in delivery.producers.items():
+        if producer.has_active_products(delivery):
+            files[f"bon-de-commande-{id}.pdf"] = partial(
+                producer_order_form, producer=id
+            )
+    return files
+
+
+async def prepare(delivery):
+    """Compute the missing artifacts of `delivery`, return their names."""
+    groups = await Groups.aload()
+    # No user: exports are the same for everyone.
+    render = partial(render_template, request={"user": None, "groups": groups})
+    if delivery.bundle:
+        key = delivery.bundle.key
+    else:
+        key = artifacts.key(delivery.version, groups.version)
+    names = []
+    for name, export in artifacts_for(delivery).items():
+        if await utils.run_in_executor(artifacts.exists, delivery.id, name, key):
+            continue
+        body = await utils.run_in_executor(export(render, delivery))
+        await utils.run_in_executor(artifacts.write, delivery.id, name, key, body)
+        names.append(name)
+    return names
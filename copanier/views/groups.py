@@ -17,7 +17,7 @@ async def groups(request, response):
 async def join_group(request, response, id):
     user = session.user.get(None)
     group = request["groups"].add_user(user.email, id)
-    request["groups"].persist()
+    await request["groups"].apersist()
     redirect = "/" if not request["user"].group_id else "/groupes"
 
     response.message(f"Vous avez bien rejoint le foyer « {group.name} »")
@@ -40,7 +40,7 @@ async def create_group(request, response):
             id=slugify(form.get("name")), name=form.get("name"), members=members
         )
         request["groups"].add_group(group)
-        request["groups"].persist()
+        await request["groups"].apersist()
         response.message(f"Le foyer {group.name} à bien été créé")
         response.redirect = "/"
     response.html("groups/edit_group.html", group=group)
@@ -58,7 +58,7 @@ async def edit_group(request, response, id):
         group.members = members
         group.name = form.get("name")
         request["groups"].groups[id] = group
-        request["groups"].persist()
+        await request["groups"].apersist()
         response.redirect = "/groupes"
     response.html("groups/edit_group.html", group=group)
 
@@ -67,6 +67,6 @@ async def edit_group(request, response, id):
 async def delete_group(request, response, id):
     assert id in request["groups"].groups, "Impossible de trouver le foyer"
     deleted = request["groups"].groups.pop(id)
-    request["groups"].persist()
+    await request["groups"].apersist()
     response.message(f"Le foyer {deleted.name} à bien été supprimé")
     response.redirect = "/groupes"
@@ -0,0 +1,109 @@
+from http import HTTPStatus
+
+from roll import HttpError
+
+from .core import app, session, staff_only
+from . import exports
+from ..models import Delivery, DoesNotExist, Job
+from .. import config, jobs, utils
+
+
+@app.listen("startup")
+async def on_startup():
+    Job.init_fs()
+
+
+# Exports that can be prepared in the background: labels, functions, file
+# names and types. Templates are rendered right away, the slow part is left to
+# the job.
+EXPORTS = {
+    "rapport-complet": (
+        "Tableau des commandes",
+        exports.full_report,
+        "rapport-complet.xlsx",
+        exports.XLSX,
+    ),
+    "résumé-de-commandes": (
+        "Fiches de commandes par foyer",
+        exports.orders_summary,
+        "résumé-de-commandes.pdf",
+        exports.PDF,
+    ),
+    "produits": (
+        "Liste des produits commandés",
+        exports.products_list,
+        "producteurices.pdf",
+        exports.PDF,
+    ),
+}
+
+
+async def load_job(id):
+    try:
+        return await Job.aload(id)
+    except DoesNotExist:
+        raise HttpError(HTTPStatus.NOT_FOUND, id)
+
+
+def can_see(job):
+    """Only the staff and the person who asked for it see a job."""
+    user = session.user.get(None)
+    return user and (user.is_staff or user.email == job.requested_by)
+
+
+def refuse(request, response):
+    response.message("Désolé, c'est réservé au staff par ici", "warning")
+    response.redirect = request.headers.get("REFERRER", "/")
+
+
+@app.route("/distribution/{id}/préparer/{export}", methods=["POST"])
+async def create_export_job(request, response, id, export):
+    if export not in EXPORTS:
+        raise HttpError(HTTPStatus.NOT_FOUND, export)
+    label, export, filename, content_type = EXPORTS[export]
+    delivery = await Delivery.aload(id)
+    compute = export(response.render_template, delivery)
+    user = session.user.get(None)
+    job = await utils.run_in_executor(
+        jobs.submit,
+        compute,
+        name=f"{label} — {delivery.name}",
+        filename=utils.prefix(filename, delivery),
+        content_type=content_type,
+        delivery_id=delivery.id,
+        requested_by=user.email if user else "",
+    )
+    response.redirect = app.url_for("show_job", id=job.id)
+
+
+@app.route("/tâches/{id}", methods=["GET"])
+async def show_job(request, response, id):
+    job = await load_job(id)
+    if not can_see(job):
+        return refuse(request, response)
+    response.html("jobs/show_job.html", job=job)
+
+
+@app.route("/tâches/{id}/télécharger", methods=["GET"])
+async def download_job(request, response, id):
+    job = await load_job(id)
+    if not can_see(job):
+        return refuse(request, response)
+    body = None
+    if job.status == Job.DONE:
+        body = await utils.run_in_executor(jobs.read, job)
+        if body is None:
+            response.message("Ce fichier n'est plus disponible", "warning")
+    if body is None:
+        response.redirect = app.url_for("show_job", id=job.id)
+        return
+    response.attachment(body, job.filename, job.content_type)
+
+
+@app.route("/tâches", methods=["GET"])
+@staff_only
+async def list_jobs(request, response):
+    response.html(
+        "jobs/list_jobs.html",
+        jobs=await utils.run_in_executor(Job.recent, config.JOB_LIST_SIZE),
+    )
@@ -12,11 +12,7 @@ async def auth_required(request, response):
     if request.path.startswith("/static/"):
         return
 
-    saved_config = SavedConfiguration.load()
-    if saved_config.demo_mode_enabled:
-        setattr(config, "DEMO_MODE", True)
-    else:
-        setattr(config, "DEMO_MODE", False)
+    SavedConfiguration.refresh()
 
     if request.route.payload and not request.route.payload.get("unprotected"):
         token = request.cookies.get("token")
@@ -28,7 +24,7 @@ async def auth_required(request, response):
             response.redirect = f"/connexion?next={url(request.path)}"
             return response
 
-        groups = Groups.load()
+        groups = await Groups.aload()
         request["groups"] = groups
 
         group = groups.get_user_group(email)
@@ -99,16 +95,16 @@ async def onboarding(request, response):
 
 @app.route("/premier-lancement/demo", methods=["GET"])
 async def activate_demo(request, response):
-    saved_config = SavedConfiguration.load()
+    saved_config = await SavedConfiguration.aload()
     saved_config.demo_mode_enabled = True
 
-    saved_config.persist()
+    await saved_config.apersist()
     response.redirect = "/"
 
 
 @app.route("/premier-lancement/demo/désactiver", methods=["GET"])
 async def desactivate_demo(request, response):
-    saved_config = SavedConfiguration.load()
+    saved_config = await SavedConfiguration.aload()
     saved_config.demo_mode_enabled = False
-    saved_config.persist()
+    await saved_config.apersist()
     response.redirect = "/"
@@ -0,0 +1,14 @@
+from http import HTTPStatus
+
+from roll import HttpError
+
+from .core import app
+from .. import config, metrics
+
+
+@app.route("/metrics", methods=["GET"], unprotected=True)
+async def show_metrics(request, response):
+    if not config.METRICS_ENABLED:
+        raise HttpError(HTTPStatus.NOT_FOUND, request.path)
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    response.body = metrics.render()
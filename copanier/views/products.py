@@ -4,15 +4,20 @@ import random
 import string
 
 from slugify import slugify
-from .core import app
+from .core import app, edits
+from . import exports
 from ..models import Delivery, Product, Producer
-from .. import utils
+from .. import imports, utils
 
 
 @app.route("/produits/{id}")
 @app.route("/produits/{id}/produits.pdf")
 async def list_products(request, response, id):
-    delivery = Delivery.load(id)
+    is_pdf = request.url.endswith(b".pdf")
+    version = Delivery.get_version(id)
+    if response.not_modified(version, html=not is_pdf):
+        return
+    delivery = await Delivery.aload(id)
     template_name = "products/list_products.html"
     template_params = {
         "edit_mode": True,
@@ -21,21 +26,31 @@ async def list_products(request, response, id):
         "referent": request.query.get("referent", None),
     }
 
-    if request.url.endswith(b".pdf"):
+    if is_pdf and not template_params["referent"]:
+        response.attachment(
+            await response.artifact(
+                version, delivery, "produits.pdf", exports.products_list
+            ),
+            utils.prefix("producteurices.pdf", delivery),
+            exports.PDF,
+        )
+    elif is_pdf:
         template_params["edit_mode"] = False
-        response.pdf(
+        await response.pdf(
             template_name,
             template_params,
             css="landscape.css",
             filename=utils.prefix("producteurices.pdf", delivery),
+            version=version,
         )
     else:
         response.html(template_name, template_params)
 
 
 @app.route("/produits/{delivery_id}/producteurs/créer", methods=["GET", "POST"])
+@edits(Delivery, key="delivery_id")
 async def create_producer(request, response, delivery_id):
-    delivery = Delivery.load(delivery_id)
+    delivery = await Delivery.aload(delivery_id)
     producer = None
     if request.method == "POST":
         form = request.form
@@ -50,7 +65,7 @@ async def create_producer(request, response, delivery_id):
         producer.contact = form.get("contact")
 
         delivery.producers[producer_id] = producer
-        delivery.persist()
+        await delivery.apersist()
         response.message(f"« {producer.name} » à bien été créé !")
         response.redirect = f"/produits/{delivery.id}/producteurs/{producer.id}"
 
@@ -60,8 +75,9 @@ async def create_producer(request, response, delivery_id):
 
 
 @app.route("/produits/{delivery_id}/producteurs/{producer_id}", methods=["GET", "POST"])
+@edits(Delivery, key="delivery_id")
 async def edit_producer(request, response, delivery_id, producer_id):
-    delivery = Delivery.load(delivery_id)
+    delivery = await Delivery.aload(delivery_id)
     producer = delivery.producers.get(producer_id)
     if request.method == "POST":
         form = request.form
@@ -72,7 +88,7 @@ async def edit_producer(request, response, delivery_id, producer_id):
         producer.contact = form.get("contact")
         producer.practical_info = form.get("practical_info")
         delivery.producers[producer_id] = producer
-        delivery.persist()
+        await delivery.apersist()
 
     response.html(
         "products/edit_producer.html",
@@ -88,9 +104,10 @@ async def edit_producer(request, response, delivery_id, producer_id):
     "/produits/{delivery_id}/producteurs/{producer_id}/supprimer",
     methods=["GET", "POST"],
 )
+@edits(Delivery, key="delivery_id")
 async def delete_producer(request, response, delivery_id, producer_id):
     # Delete the producer and all the related products.
-    delivery = Delivery.load(delivery_id)
+    delivery = await Delivery.aload(delivery_id)
     producer = delivery.producers.get(producer_id)
     if request.method == "POST":
         delivery.producers.pop(producer_id)
@@ -99,7 +116,7 @@ async def delete_producer(request, response, delivery_id, producer_id):
             delivery.products.remove(product)
             for order in delivery.orders.values():
                 order.products.pop(product.ref)
-        delivery.persist()
+        await delivery.apersist()
 
         response.message(f"{producer.name} à bien été supprimé !")
         response.redirect = f"/produits/{delivery.id}"
@@ -117,14 +134,15 @@ async def delete_producer(request, response, delivery_id, producer_id):
 @app.route(
     "/produits/{delivery_id}/producteurs/{producer_id}/valider-prix", methods=["GET"]
 )
+@edits(Delivery, key="delivery_id", methods=("GET",))
 async def validate_producer_prices(request, response, delivery_id, producer_id):
-    delivery = Delivery.load(delivery_id)
+    delivery = await Delivery.aload(delivery_id)
     producer = delivery.producers.get(producer_id)
 
     for product in delivery.products:
         if product.producer == producer_id:
             product.last_update = datetime.now()
-    delivery.persist()
+    await delivery.apersist()
 
     response.message(
         f"Les prix ont été marqués comme OK pour « { producer.name } », merci !"
@@ -133,10 +151,11 @@ async def validate_producer_prices(request, response, delivery_id, producer_id):
 
 
 @app.route("/produits/{delivery_id}/valider-prix", methods=["GET"])
+@edits(Delivery, key="delivery_id", methods=("GET",))
 async def mark_all_prices_as_ok(request, response, delivery_id):
-    delivery = Delivery.load(delivery_id)
+    delivery = await Delivery.aload(delivery_id)
     delivery.validate_all_prices()
-    delivery.persist()
+    await delivery.apersist()
 
     response.message(f"Les prix ont été marqués comme OK pour toute la distribution !")
     response.redirect = f"/produits/{delivery_id}"
@@ -146,8 +165,9 @@ async def mark_all_prices_as_ok(request, response, delivery_id):
     "/produits/{delivery_id}/producteurs/{producer_id}/produits/créer",
     methods=["GET", "POST"],
 )
+@edits(Delivery, key="delivery_id")
 async def create_product(request, response, delivery_id, producer_id):
-    delivery = Delivery.load(delivery_id)
+    delivery = await Delivery.aload(delivery_id)
     product = Product(name="", ref="", price=0)
     producer = delivery.producers.get(producer_id)
 
@@ -162,8 +182,8 @@ async def create_product(request, response, delivery_id, producer_id):
             f"{producer_id}-{product.name}-{product.unit}-{random_string}"
         )
 
-        delivery.products.append(product)
-        delivery.persist()
+        delivery.add_product(product)
+        await delivery.apersist()
         response.message("Le produit à bien été créé")
         response.redirect = f"/produits/{delivery_id}/producteurs/{producer_id}"
         return
@@ -178,8 +198,9 @@ async def create_product(request, response, delivery_id, producer_id):
     "/produits/{delivery_id}/producteurs/{producer_id}/produits/{product_ref}",
     methods=["GET", "POST"],
 )
+@edits(Delivery, key="delivery_id")
 async def edit_product(request, response, delivery_id, producer_id, product_ref):
-    delivery = Delivery.load(delivery_id)
+    delivery = await Delivery.aload(delivery_id)
     product = delivery.get_product(product_ref)
     producer = delivery.producers.get(producer_id)
 
@@ -198,7 +219,7 @@ async def edit_product(request, response, delivery_id, producer_id, product_ref)
             product.rupture = form.get("rupture")
         else:
             product.rupture = None
-        delivery.persist()
+        await delivery.apersist()
         response.message("Le produit à bien été modifié")
         response.redirect = f"/produits/{delivery_id}/producteurs/{producer_id}"
         return
@@ -213,10 +234,11 @@ async def edit_product(request, response, delivery_id, producer_id, product_ref)
     "/produits/{delivery_id}/producteurs/{producer_id}/produits/{product_ref}/supprimer",
     methods=["GET"],
 )
+@edits(Delivery, key="delivery_id", methods=("GET",))
 async def delete_product(request, response, delivery_id, producer_id, product_ref):
-    delivery = Delivery.load(delivery_id)
+    delivery = await Delivery.aload(delivery_id)
     product = delivery.delete_product(product_ref)
-    delivery.persist()
+    await delivery.apersist()
     response.message(f"Le produit « { product.name } » à bien été supprimé.")
     response.redirect = f"/produits/{delivery_id}/producteurs/{producer_id}"
 
@@ -225,8 +247,9 @@ async def delete_product(request, response, delivery_id, producer_id, product_re
     "/produits/{delivery_id}/producteurs/{producer_id}/frais-de-livraison",
     methods=["GET", "POST"],
 )
+@edits(Delivery, key="delivery_id")
 async def edit_shipping_price(request, response, delivery_id, producer_id):
-    delivery = Delivery.load(delivery_id)
+    delivery = await Delivery.aload(delivery_id)
     producer = delivery.producers.get(producer_id)
 
     if request.method == "POST":
@@ -234,7 +257,7 @@ async def edit_shipping_price(request, response, delivery_id, producer_id):
         shipping = form.float("shipping")
 
         delivery.shipping[producer_id] = shipping
-        delivery.persist()
+        await delivery.apersist()
         response.message("Les frais de livraison ont bien été enregistrés, merci !")
         response.redirect = f"/produits/{delivery_id}"
         return
@@ -249,17 +272,81 @@ async def edit_shipping_price(request, response, delivery_id, producer_id):
     )
 
 
+def get_upload(files, name):
+    # Browsers send empty file inputs as a part without filename.
+    upload = files.get(name, None)
+    if upload and upload.filename:
+        return upload
+
+
+@app.route("/produits/{id}/importer", methods=["GET", "POST"])
+@edits(Delivery)
+async def import_products(request, response, id):
+    delivery = await Delivery.aload(id)
+    if request.method == "POST":
+        merge = bool(request.form.get("merge", ""))
+        remove_missing = bool(request.form.get("remove_missing", ""))
+        data = get_upload(request.files, "data")
+        products = get_upload(request.files, "products")
+        producers = get_upload(request.files, "producers")
+        try:
+            if data and data.filename.lower().endswith(".zip"):
+                report = await utils.run_in_executor(
+                    imports.products_and_producers_from_zip,
+                    delivery,
+                    data,
+                    merge=merge,
+                    remove_missing=remove_missing,
+                )
+            elif data:
+                report = await utils.run_in_executor(
+                    imports.products_and_producers_from_xlsx,
+                    delivery,
+                    data,
+                    merge=merge,
+                    remove_missing=remove_missing,
+                )
+            elif products and producers:
+                report = await utils.run_in_executor(
+                    imports.products_and_producers_from_csv,
+                    delivery,
+                    products,
+                    producers,
+                    delimiter=imports.get_delimiter(products.filename),
+                    merge=merge,
+                    remove_missing=remove_missing,
+                )
+            else:
+                raise ValueError("Aucun fichier à importer.")
+        except ValueError as e:
+            response.message(str(e) or "Impossible d'importer le fichier", "error")
+            response.redirect = f"/produits/{id}/importer"
+            return
+        if report:
+            response.message(
+                f"Import terminé : {len(report.added)} ajouté(s), "
+                f"{len(report.changed)} modifié(s), {len(report.removed)} supprimé(s)."
+            )
+        else:
+            response.message("Les produits ont bien été importés.")
+        response.redirect = f"/produits/{id}"
+        return
+    response.html("products/import_products.html", {"delivery": delivery})
+
+
 @app.route("/produits/{id}/copier", methods=["GET"])
 async def copy_products(request, response, id):
-    deliveries = Delivery.all()
+    deliveries = await utils.run_in_executor(lambda: list(Delivery.all()))
+    deliveries += await utils.run_in_executor(Delivery.archived)
     response.html("products/copy_products.html", {"deliveries": deliveries})
 
 
 @app.route("/produits/{id}/copier", methods=["POST"])
+@edits(Delivery)
 async def copy_products_post(request, response, id):
-    delivery = Delivery.load(id)
-    to_copy = delivery.load(request.form.get("to_copy"))
+    delivery = await Delivery.aload(id)
+    to_copy = await Delivery.aload(request.form.get("to_copy"))
     delivery.producers = to_copy.producers
-    delivery.products = to_copy.products
-    delivery.persist()
+    delivery.set_products(to_copy.products)
+    await delivery.apersist()
     response.redirect = f"/produits/{id}"
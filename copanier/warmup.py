@@ -0,0 +1,41 @@
+"""Pay the cold start costs before the first request.
+
+Called by the production server in the master process, before the workers
+are forked: they all start with the work already done.
+"""
+import time
+
+from . import assets
+from .models import Delivery, Groups
+
+
+def compile_templates(env):
+    """Compile every template of `env` (emails included), return their number.
+
+    With a bytecode cache, the compiled templates are also written to disk
+    for the next processes.
+    """
+    names = env.list_templates(extensions=["html", "txt"])
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def warm_up():
+    """Compile the templates, and fill the caches the first pages will need.
+
+    The totals and settlements of the incoming deliveries are cached by
+    version: the forked workers start with them. Return the number of
+    templates and of incoming deliveries, and the time spent in seconds.
+    """
+    from .views.core import env
+
+    start = time.perf_counter()
+    templates = compile_templates(env)
+    assets.get_manifest()
+    groups = Groups.load()
+    deliveries = Delivery.incoming()
+    for delivery in deliveries:
+        delivery.get_totals()
+        delivery.get_settlement(groups)
+    return templates, len(deliveries), time.perf_counter() - start
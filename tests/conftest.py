@@ -1,5 +1,7 @@
 import os
+import shutil
 from datetime import datetime, timedelta
+from pathlib import Path
 
 import pytest
 from roll.extensions import traceback
@@ -7,8 +9,19 @@ from roll.testing import Client as BaseClient
 
 from copanier import app as copanier_app
 from copanier import config as kconfig
+from copanier import analytics, artifacts, scheduler, storage
 from copanier.utils import create_token
-from copanier.models import Delivery, Person, Product, Producer, Groups, Group
+from copanier.models import (
+    Archives,
+    Bundle,
+    Delivery,
+    Person,
+    Product,
+    Producer,
+    Groups,
+    Group,
+    Job,
+)
 
 
 def pytest_configure(config):
@@ -17,11 +30,25 @@ def pytest_configure(config):
     os.environ["COPANIER_STAFF"] = ""
     kconfig.init()
     assert str(kconfig.DATA_ROOT) == "tmp/db"
+    Delivery.init_fs()
+    Groups.init_fs()
+    Job.init_fs()
+    Bundle.init_fs()
 
 
 def pytest_runtest_setup(item):
     for path in Delivery.get_root().glob("*.yml"):
         path.unlink()
+    for path in Bundle.get_root().glob("*.yml"):
+        path.unlink()
+    for path in Job.get_root().iterdir():
+        path.unlink()
+    shutil.rmtree(Archives.get_root(), ignore_errors=True)
+    shutil.rmtree(artifacts.get_root(), ignore_errors=True)
+    scheduler._prepared.clear()
+    analytics.reset()
+    for path in Path(kconfig.DATA_ROOT).glob("analytics.sqlite*"):
+        path.unlink()
 
 
 class Client(BaseClient):
@@ -64,6 +91,15 @@ def app():  # Requested by Roll testing utilities.
     return copanier_app
 
 
+@pytest.fixture
+def memory_storage(monkeypatch):
+    """Keep documents in memory instead of YAML files."""
+    monkeypatch.setattr(kconfig, "STORAGE", "memory")
+    storage.reset()
+    yield storage.get()
+    storage.reset()
+
+
 @pytest.fixture
 def delivery():
     return Delivery(
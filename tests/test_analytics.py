@@ -0,0 +1,70 @@
+import sqlite3
+from datetime import timedelta
+from io import BytesIO
+
+import pytest
+from openpyxl import load_workbook
+
+from copanier import analytics
+from copanier.models import Delivery, Order, ProductOrder
+
+pytestmark = pytest.mark.asyncio
+
+
+def order(**wanted):
+    return Order(products={ref: ProductOrder(wanted=q) for ref, q in wanted.items()})
+
+
+async def test_persist_updates_the_analytics(delivery, yaourt):
+    delivery.products.append(yaourt)
+    delivery.orders["fractal-brocolis"] = order(lait=2, yaourt=1)
+    delivery.orders["ndp"] = order(lait=1)
+    delivery.persist()
+    rows = analytics.products()
+    assert [(r["product_name"], r["quantity"], r["amount"]) for r in rows] == [
+        ("Lait", 3, 4.5),
+        ("Yaourt", 1, 3.5),
+    ]
+    assert rows[0]["producer"] == "Ferme du coin"
+
+    # Orders are replaced, not added up.
+    delivery.orders["ndp"] = order(lait=4)
+    delivery.persist()
+    assert analytics.products()[0]["quantity"] == 6
+    assert [r["amount"] for r in analytics.orderers()] == [6.5, 6]
+
+
+async def test_persist_does_not_depend_on_the_analytics(delivery, monkeypatch):
+    def locked(delivery):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(analytics, "update", locked)
+    delivery.orders["ndp"] = order(lait=1)
+    delivery.persist()
+    assert "ndp" in Delivery.load(delivery.id).orders
+
+
+async def test_analytics_can_be_restricted_to_last_deliveries(delivery):
+    delivery.orders["ndp"] = order(lait=1)
+    delivery.persist()
+    delivery.id = None
+    delivery.from_date = delivery.from_date + timedelta(days=30)
+    delivery.orders["ndp"] = order(lait=5)
+    delivery.persist()
+    assert analytics.products()[0]["quantity"] == 6
+    assert analytics.products(last=1)[0]["quantity"] == 5
+    history = analytics.history("ndp")
+    assert [row["quantity"] for row in history] == [5, 1]
+
+
+async def test_staff_can_see_and_export_analytics(client, delivery, groups):
+    groups.persist()
+    delivery.orders["fractal-brocolis"] = order(lait=2)
+    delivery.persist()
+    resp = await client.get("/analyses?foyer=fractal-brocolis")
+    assert resp.status == 200
+    assert "The Fractal Brocolis" in resp.body.decode()
+    resp = await client.get("/analyses/exporter")
+    assert resp.status == 200
+    wb = load_workbook(BytesIO(resp.body))
+    assert list(wb["produits"].values)[1][:5] == ("Ferme du coin", "Lait", None, 2, 3)
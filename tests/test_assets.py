@@ -0,0 +1,51 @@
+import gzip
+
+import pytest
+
+from copanier import __version__, assets
+from copanier import app as copanier_app
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture(scope="module")
+def static_root(tmp_path_factory):
+    root = tmp_path_factory.mktemp("static")
+    (root / "fonts").mkdir()
+    (root / "fonts" / "icons.woff").write_bytes(b"wOFF")
+    (root / "app.css").write_text(
+        "@font-face { src: url('./fonts/icons.woff?v1#icons'); }\n" * 100
+    )
+    assets.build(root)
+    assets.static(copanier_app, root=root, prefix="/test-static/")
+    return root
+
+
+async def test_build_writes_fingerprinted_files(static_root):
+    manifest = assets.get_manifest(static_root)
+    font = manifest["fonts/icons.woff"]
+    assert font.startswith("fonts/icons.") and font != "fonts/icons.woff"
+    css = (static_root / "dist" / manifest["app.css"]).read_text()
+    assert f"url('{font}?v1#icons')" in css
+    assert (static_root / "dist" / f"{manifest['app.css']}.gz").exists()
+    # Already compressed.
+    assert not (static_root / "dist" / f"{font}.gz").exists()
+
+
+async def test_static_path_falls_back_to_the_source_file():
+    path = assets.static_path("unknown.css")
+    assert path == f"/static/unknown.css?v={__version__}"
+
+
+async def test_built_files_are_served_precompressed(client, static_root):
+    manifest = assets.get_manifest(static_root)
+    resp = await client.get(
+        f"/test-static/dist/{manifest['app.css']}",
+        headers={"Accept-Encoding": "gzip"},
+    )
+    assert resp.status == 200
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert resp.headers["Cache-Control"] == assets.IMMUTABLE
+    assert gzip.decompress(resp.body).startswith(b"@font-face")
+    resp = await client.get("/test-static/app.css")
+    assert resp.headers["Cache-Control"] == "no-cache"
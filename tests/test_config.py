@@ -24,3 +24,11 @@ def test_config_should_read_from_env():
     else:
         del os.environ["COPANIER_SECRET"]
     config.init()
+
+
+def test_config_should_parse_booleans_from_env(monkeypatch):
+    monkeypatch.setattr(config, "METRICS_ENABLED", False)  # Restored after.
+    for value, expected in [("0", False), ("false", False), ("", False), ("1", True)]:
+        monkeypatch.setenv("COPANIER_METRICS_ENABLED", value)
+        config.init()
+        assert config.METRICS_ENABLED is expected
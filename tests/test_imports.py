@@ -0,0 +1,129 @@
+from io import BytesIO
+from zipfile import ZipFile
+
+import pytest
+from openpyxl import Workbook
+
+from copanier import imports, reports
+from copanier.models import Delivery, Order, ProductOrder
+
+
+def make_workbook(products, producers):
+    wb = Workbook()
+    products_sheet = wb.active
+    products_sheet.title = "produits"
+    for row in products:
+        products_sheet.append(row)
+    producers_sheet = wb.create_sheet("producteurs")
+    for row in producers:
+        producers_sheet.append(row)
+    return wb
+
+
+def test_import_replaces_products(delivery):
+    wb = make_workbook(
+        [("ref", "name", "price", "producer"), ("pain", "Pain", 3, "boulange")],
+        [("id", "name"), ("boulange", "Boulange")],
+    )
+    assert imports.products_and_producers_from_xlsx(delivery, wb) is None
+    assert [p.ref for p in delivery.products] == ["pain"]
+    assert list(delivery.producers) == ["boulange"]
+
+
+def test_merge_import_upserts_by_ref(delivery, yaourt, fromage):
+    delivery.products.append(yaourt)
+    delivery.products.append(fromage)
+    delivery.orders["fractal-brocolis"] = Order(
+        products={"lait": ProductOrder(wanted=2), "fromage": ProductOrder(wanted=1)}
+    )
+    lait = delivery.products[0]
+    lait_update = lait.last_update
+    yaourt_update = yaourt.last_update
+    wb = make_workbook(
+        [
+            ("ref", "name", "price", "producer"),
+            ("lait", "Lait", 1.5, "ferme-du-coin"),
+            ("yaourt", "Yaourt", 4, "ferme-du-coin"),
+            ("pain", "Pain", 3, "boulange"),
+        ],
+        [("id", "name"), ("ferme-du-coin", "Ferme du coin"), ("boulange", "Boulange")],
+    )
+    report = imports.products_and_producers_from_xlsx(
+        delivery, wb, merge=True, remove_missing=True
+    )
+    assert report.added == ["pain"]
+    assert report.changed == ["yaourt"]
+    assert report.removed == ["fromage"]
+
+    delivery = Delivery.load(delivery.id)
+    products = delivery.product_index
+    assert list(products) == ["lait", "yaourt", "pain"]
+    assert products["lait"].last_update == lait_update
+    assert products["yaourt"].price == 4
+    assert products["yaourt"].last_update > yaourt_update
+    # Columns absent from the sheet are left alone.
+    assert products["yaourt"].packing == 4
+    assert products["yaourt"].unit == "pot 125ml"
+    assert set(delivery.producers) == {"ferme-du-coin", "boulange"}
+    order = delivery.orders["fractal-brocolis"]
+    assert order.products["lait"].wanted == 2
+    assert "fromage" not in order.products
+
+
+def test_merge_import_keeps_missing_products_by_default(delivery, fromage):
+    delivery.products.append(fromage)
+    delivery.orders["fractal-brocolis"] = Order(
+        products={"fromage": ProductOrder(wanted=1)}
+    )
+    wb = make_workbook(
+        [("ref", "name", "price"), ("lait", "Lait", 2)],
+        [("id", "name"), ("ferme-du-coin", "Ferme du coin")],
+    )
+    report = imports.products_and_producers_from_xlsx(delivery, wb, merge=True)
+    assert report.changed == ["lait"]
+    assert report.removed == []
+    delivery = Delivery.load(delivery.id)
+    assert [p.ref for p in delivery.products] == ["lait", "fromage"]
+    assert delivery.orders["fractal-brocolis"].products["fromage"].wanted == 1
+
+
+def test_import_from_csv(delivery):
+    products = b'ref,name,price,packing,producer\r\npain,Pain,"3,5",6,boulange\r\n\r\n'
+    producers = b"id,name\r\nboulange,Boulange\r\n"
+    imports.products_and_producers_from_csv(delivery, products, producers)
+    assert delivery.products[0].price == 3.5
+    assert delivery.products[0].packing == 6
+    assert delivery.producers["boulange"].name == "Boulange"
+
+
+def test_import_from_tsv(delivery):
+    products = "ref\tname\tprice\nmiel\tMiel\t8\n".encode("utf-8-sig")
+    producers = b"id\tname\nruche\tLa ruche\n"
+    imports.products_and_producers_from_csv(
+        delivery, products, producers, delimiter=imports.get_delimiter("a.TSV")
+    )
+    assert delivery.products[0].ref == "miel"
+    assert list(delivery.producers) == ["ruche"]
+
+
+def test_csv_export_can_be_imported_back(delivery, yaourt):
+    delivery.products.append(yaourt)
+    delivery.persist()
+    data = BytesIO(reports.products_csv(delivery, delimiter="\t"))
+    assert ZipFile(data).namelist() == ["produits.tsv", "producteurs.tsv"]
+    other = Delivery.load(delivery.id)
+    other.products = []
+    other.producers = {}
+    imports.products_and_producers_from_zip(other, data)
+    assert other.products == delivery.products
+    assert other.producers == delivery.producers
+
+
+def test_import_rejects_duplicated_refs(delivery):
+    wb = make_workbook(
+        [("ref", "name", "price"), ("pain", "Pain", 3), ("pain", "Pain bis", 4)],
+        [("id", "name")],
+    )
+    with pytest.raises(ValueError):
+        imports.products_and_producers_from_xlsx(delivery, wb)
+    assert [p.ref for p in delivery.products] == ["lait"]
@@ -0,0 +1,135 @@
+import asyncio
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import pytest
+from openpyxl import load_workbook
+
+from copanier import config, jobs
+from copanier.models import Job
+
+pytestmark = pytest.mark.asyncio
+
+
+async def wait_for(job_id):
+    for _ in range(200):
+        job = Job.load(job_id)
+        if job.is_finished:
+            return job
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"Job {job_id} still {job.status}")
+
+
+async def test_export_job_is_prepared_then_downloaded(client, delivery):
+    delivery.persist()
+    resp = await client.post(f"/distribution/{delivery.id}/préparer/rapport-complet")
+    assert resp.status == 302
+    job_id = resp.headers["Location"].rsplit("/", 1)[-1]
+    job = await wait_for(job_id)
+    assert job.status == Job.DONE
+    assert job.delivery_id == delivery.id
+    assert job.requested_by == "foo@bar.org"
+    assert job.duration >= 0
+
+    resp = await client.get(f"/tâches/{job_id}")
+    assert resp.status == 200
+    assert "Télécharger" in resp.body.decode()
+
+    resp = await client.get(f"/tâches/{job_id}/télécharger")
+    assert resp.status == 200
+    assert resp.headers["Content-Disposition"] == f'attachment; filename="{job.filename}"'
+    assert load_workbook(filename=BytesIO(resp.body)).sheetnames
+
+
+@pytest.mark.parametrize("export", ["produits", "résumé-de-commandes"])
+async def test_pdf_export_jobs(client, delivery, export):
+    delivery.persist()
+    resp = await client.post(f"/distribution/{delivery.id}/préparer/{export}")
+    job = await wait_for(resp.headers["Location"].rsplit("/", 1)[-1])
+    assert job.status == Job.DONE, job.error
+    assert job.content_type == "application/pdf"
+
+
+async def test_toolbox_links_to_background_exports(client, delivery):
+    delivery.persist()
+    resp = await client.get(f"/distribution/{delivery.id}/gérer")
+    assert resp.status == 200
+    assert f"/distribution/{delivery.id}/préparer/produits" in resp.body.decode()
+
+
+async def test_unknown_export_is_not_found(client, delivery):
+    delivery.persist()
+    resp = await client.post(f"/distribution/{delivery.id}/préparer/inconnu")
+    assert resp.status == 404
+
+
+async def test_pending_job_page_refreshes_itself(client):
+    job = Job(id="pending", name="Test", filename="test.pdf", content_type="x")
+    job.persist()
+    resp = await client.get("/tâches/pending")
+    assert 'http-equiv="refresh"' in resp.body.decode()
+    resp = await client.get("/tâches/pending/télécharger")
+    assert resp.status == 302
+
+
+async def test_failed_job_keeps_the_error(client):
+    def compute():
+        raise ValueError("Boom")
+
+    job = jobs.submit(compute, "Test", "test.pdf", "application/pdf")
+    job = await wait_for(job.id)
+    assert job.status == Job.FAILED
+    assert job.error == "Boom"
+    resp = await client.get(f"/tâches/{job.id}")
+    assert "Boom" in resp.body.decode()
+
+
+def test_lost_job_is_failed():
+    job = Job(
+        id="lost",
+        name="Test",
+        filename="test.pdf",
+        content_type="x",
+        status=Job.RUNNING,
+        created=datetime.now() - timedelta(seconds=config.JOB_TIMEOUT_SECONDS + 1),
+    )
+    job.persist()
+    assert Job.load("lost").status == Job.FAILED
+
+
+async def test_staff_can_list_jobs_with_durations(client):
+    job = Job(
+        id="done",
+        name="Liste des produits",
+        filename="test.pdf",
+        content_type="x",
+        status=Job.DONE,
+        started=datetime(2020, 1, 1, 10),
+        finished=datetime(2020, 1, 1, 10, 0, 12),
+    )
+    job.persist()
+    resp = await client.get("/tâches")
+    assert resp.status == 200
+    body = resp.body.decode()
+    assert "Liste des produits" in body
+    assert "12.0&nbsp;s" in body
+
+
+async def test_only_staff_and_requester_see_a_job(client, monkeypatch):
+    monkeypatch.setattr("copanier.config.STAFF", ["staff@bar.org"])
+    job = Job(
+        id="other",
+        name="Test",
+        filename="test.pdf",
+        content_type="x",
+        requested_by="someone@else.org",
+    )
+    job.persist()
+    for url in ("/tâches/other", "/tâches/other/télécharger"):
+        resp = await client.get(url)
+        assert resp.status == 302
+        assert "other" not in resp.headers["Location"]
+    job.requested_by = "foo@bar.org"
+    job.persist()
+    resp = await client.get("/tâches/other")
+    assert resp.status == 200
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from copanier import live
+from copanier.models import Order, Producer, ProductOrder
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_snapshot_matches_the_delivery_totals(delivery, yaourt):
+    yaourt.packing = 4
+    delivery.products.append(yaourt)
+    delivery.shipping["ferme-du-coin"] = 10
+    # Nobody orders from it: its shipping is not in the total.
+    delivery.producers["ferme-du-loin"] = Producer(id="ferme-du-loin", name="Loin")
+    delivery.shipping["ferme-du-loin"] = 20
+    delivery.orders["ndp"] = Order(
+        products={"lait": ProductOrder(wanted=2), "yaourt": ProductOrder(wanted=3)}
+    )
+    data = live.snapshot(delivery)
+    assert data["orders"] == 1
+    assert data["wanted:lait"] == delivery.product_wanted(delivery.products[0])
+    assert data["missing:yaourt"] == delivery.product_missing(yaourt) == 1
+    assert data["producer:ferme-du-coin"] == delivery.total_for_producer(
+        "ferme-du-coin"
+    )
+    assert data["total"] == delivery.total
+
+
+async def test_diff_only_keeps_changed_values():
+    old = {"orders": 1, "total": 10}
+    assert live.diff(old, {"orders": 1, "total": 12}) == {"total": 12}
+    assert live.diff({}, old) == old
+
+
+async def test_persist_notifies_the_subscribers(delivery):
+    delivery.persist()
+    event = live.subscribe(delivery.id)
+    delivery.persist()
+    await asyncio.wait_for(event.wait(), 1)
+    live.unsubscribe(delivery.id, event)
+    assert delivery.id not in live._waiters
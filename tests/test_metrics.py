@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from copanier import metrics
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_seconds", "Test.", buckets=(0.1, 1))
+    metrics.registry.remove(histogram)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    worker = f'worker="{os.getpid()}"'
+    assert histogram.render().splitlines()[2:] == [
+        f'test_seconds_bucket{{{worker},le="0.1"}} 1',
+        f'test_seconds_bucket{{{worker},le="1"}} 2',
+        f'test_seconds_bucket{{{worker},le="+Inf"}} 3',
+        f"test_seconds_count{{{worker}}} 3",
+        f"test_seconds_sum{{{worker}}} 5.55",
+    ]
+
+
+async def test_metrics_are_disabled_by_default(client):
+    resp = await client.get("/metrics")
+    assert resp.status == 404
+
+
+async def test_metrics_endpoint(client, delivery, monkeypatch):
+    monkeypatch.setattr("copanier.config.METRICS_ENABLED", True)
+    delivery.persist()
+    await client.get(f"/distribution/{delivery.id}")
+    client.logout()
+    resp = await client.get("/metrics")
+    assert resp.status == 200
+    body = resp.body.decode()
+    assert 'copanier_storage_seconds_count{worker="' in body
+    assert 'operation="persist",kind="delivery"} ' in body
+    assert 'template="delivery/show_delivery.html"' in body
+    assert "copanier_active_requests" in body
+
+
+async def test_conditional_requests_are_counted_as_cache_lookups(client, delivery):
+    delivery.persist()
+    url = f"/distribution/{delivery.id}"
+    values = metrics.cache_requests.values
+    hits, misses = values.get(("http", "hit"), 0), values.get(("http", "miss"), 0)
+    resp = await client.get(url)
+    await client.get(url, headers={"If-None-Match": resp.headers["ETag"]})
+    assert values[("http", "hit")] == hits + 1
+    assert values[("http", "miss")] == misses + 1
@@ -1,16 +1,22 @@
 from datetime import datetime, timedelta
+from pathlib import Path
+from random import Random
 
 import pytest
 
-from copanier import config
+import copanier
+from copanier import config, storage
 from copanier.models import (
     Delivery,
     Product,
+    Producer,
     Person,
     Order,
     ProductOrder,
     Groups,
     Group,
+    SavedConfiguration,
+    dedupe_refs,
 )
 
 
@@ -183,3 +189,210 @@ def test_group_management():
     assert "simon@tld" in groups.groups[ladouce.id].members
     assert "simon@tld" not in groups.groups[ndp.id].members
 
+
+
+@pytest.mark.asyncio
+async def test_can_persist_and_load_delivery_asynchronously(delivery):
+    delivery.name = "Corto"
+    await delivery.apersist()
+    assert delivery.path.exists()
+    loaded = await Delivery.aload(delivery.id)
+    assert loaded.name == "Corto"
+
+
+def test_can_use_memory_storage(memory_storage, delivery):
+    delivery.persist()
+    assert not delivery.path.exists()
+    assert memory_storage.exists("delivery", delivery.id)
+    loaded = Delivery.load(delivery.id)
+    loaded.name = "Corto"
+    assert Delivery.load(delivery.id).name == "CRAC d'automne"
+    assert [d.id for d in Delivery.all()] == [delivery.id]
+
+
+def test_demo_mode_never_writes_on_disk(monkeypatch):
+    root = Path(__file__).parent.parent / "db"
+    monkeypatch.setattr(config, "DATA_ROOT", root)
+    monkeypatch.setattr(config, "DEMO_MODE", True, raising=False)
+    storage.reset()
+    try:
+        files = {path: path.stat().st_mtime for path in root.glob("demo/*/*.yml")}
+        delivery = list(Delivery.all())[0]
+        assert delivery.is_open
+        delivery.name = "Changed"
+        delivery.persist()
+        assert Delivery.load(delivery.id).name == "Changed"
+        assert Groups.load().groups
+        assert files == {path: path.stat().st_mtime for path in files}
+    finally:
+        storage.reset()
+
+
+def test_demo_mode_is_read_when_the_configuration_changes(monkeypatch):
+    monkeypatch.setattr(config, "DEMO_MODE", False, raising=False)
+    saved = SavedConfiguration.load()
+    saved.demo_mode_enabled = True
+    saved.persist()
+    assert config.DEMO_MODE
+    loads = []
+    monkeypatch.setattr(SavedConfiguration, "load", lambda: loads.append(1))
+    SavedConfiguration.refresh()
+    assert not loads
+    saved.demo_mode_enabled = False
+    saved.persist()
+    assert not config.DEMO_MODE
+
+
+def test_add_product_keeps_refs_unique(delivery, yaourt):
+    delivery.add_product(yaourt)
+    delivery.add_product(Product(name="Yaourt nature", ref="yaourt", price=3))
+    assert [p.ref for p in delivery.products] == ["lait", "yaourt", "yaourt-dedupe"]
+
+
+def test_dedupe_refs_renames_every_duplicate():
+    products = [
+        Product(name=name, ref=ref, price=1)
+        for name, ref in [("A", "x"), ("B", "x"), ("C", "x-dedupe"), ("D", "x")]
+    ]
+    assert dedupe_refs(products) == [("x", "x-dedupe-2"), ("x", "x-dedupe-3")]
+    assert [p.ref for p in products] == ["x", "x-dedupe-2", "x-dedupe", "x-dedupe-3"]
+    assert dedupe_refs(products) == []
+
+
+def test_can_archive_delivery(delivery):
+    delivery.to_date = now() - timedelta(days=1)
+    assert delivery.is_archivable
+    delivery.persist()
+    delivery.archive()
+    assert not delivery.path.exists()
+    assert list(Delivery.all()) == []
+    assert Delivery.is_defined()
+    assert [s.name for s in Delivery.archived()] == ["CRAC d'automne"]
+    loaded = Delivery.load(delivery.id)
+    assert loaded.products == delivery.products
+    # Persisting it again moves it back to the regular storage.
+    loaded.persist()
+    assert [d.id for d in Delivery.all()] == [delivery.id]
+    assert Delivery.archived() == []
+
+
+def test_repair_refs_also_fixes_archived_deliveries(delivery):
+    delivery.to_date = now() - timedelta(days=1)
+    delivery.products.append(Product(ref="lait", name="Lait cru", price=2))
+    delivery.persist()
+    delivery.archive()
+    copanier.repair_refs()
+    loaded = Delivery.load(delivery.id)
+    assert [p.ref for p in loaded.products] == ["lait", "lait-dedupe"]
+    # Still archived.
+    assert [s.id for s in Delivery.archived()] == [delivery.id]
+
+
+def test_can_archive_delivery_in_memory(memory_storage, delivery):
+    delivery.persist()
+    delivery.archive()
+    assert memory_storage.is_archived("delivery", delivery.id)
+    assert memory_storage.ids("delivery") == []
+    assert Delivery.load(delivery.id).name == "CRAC d'automne"
+
+
+def test_frozen_delivery_reads_its_totals_from_the_bundle(delivery, groups):
+    delivery.orders["foo@bar.org"] = Order(products={"lait": ProductOrder(wanted=2)})
+    delivery.over = True
+    delivery.persist()
+    bundle = delivery.freeze(groups, by="foo@bar.org")
+    assert bundle.totals.total == 3.0
+    assert bundle.totals.producers == {"ferme-du-coin": 3.0}
+    assert bundle.totals.orderers == {"foo@bar.org": 3.0}
+    assert bundle.settlement.table["foo@bar.org"][""] == 3.0
+
+    loaded = Delivery.load(delivery.id)
+    assert loaded.bundle.key == bundle.key
+    loaded.orders.clear()  # Not read anymore.
+    assert loaded.total == 3.0
+    assert loaded.product_wanted(loaded.products[0]) == 2
+    assert loaded.total_for_producer("ferme-du-coin", "foo@bar.org") == 3.0
+
+    loaded.unfreeze()
+    assert not Delivery.is_frozen(delivery.id)
+    assert Delivery.load(delivery.id).bundle is None
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_totals_match_the_per_order_computations(delivery, seed):
+    random = Random(seed)
+    delivery.producers = {
+        f"p{i}": Producer(id=f"p{i}", name=f"P{i}") for i in range(4)
+    }
+    delivery.products = [
+        Product(
+            ref=f"r{i}",
+            name=f"R{i}",
+            price=round(random.uniform(0.5, 20), 2),
+            producer=f"p{i % 4}",
+            packing=random.choice([None, 3, 6]),
+            rupture="épuisé" if i == 5 else None,
+        )
+        for i in range(20)
+    ]
+    delivery.shipping = {"p0": 12.5, "p1": 7}
+    for j in range(15):
+        refs = random.sample(range(20), 6) + [0, 1]
+        delivery.orders[f"o{j}@example.org"] = Order(
+            products={
+                f"r{i}": ProductOrder(
+                    wanted=random.randint(1, 5), adjustment=random.randint(0, 1)
+                )
+                for i in refs
+            }
+        )
+
+    totals = delivery.compute_totals()
+    assert totals.total == delivery.total
+    for id in delivery.producers:
+        assert totals.producers[id] == delivery.total_for_producer(id)
+    for email, order in delivery.orders.items():
+        assert totals.orderers[email] == order.total(delivery.products, delivery, email)
+        for id in delivery.producers:
+            expected = delivery.total_for_producer(id, email)
+            assert totals.orderer_producers[email][id] == expected
+        for id in delivery.shipping:
+            expected = delivery.shipping_for(email, id)
+            assert totals.shipping[email][id] == pytest.approx(expected)
+    for product in delivery.products:
+        assert totals.products[product.ref].wanted == delivery.product_wanted(product)
+        assert totals.products[product.ref].missing == delivery.product_missing(product)
+
+
+def test_settlement_is_cached_by_versions(delivery, groups):
+    delivery.orders["foo@bar.org"] = Order(products={"lait": ProductOrder(wanted=2)})
+    delivery.persist()
+    groups = Groups.load()
+    settlement = delivery.get_settlement(groups)
+    assert settlement.table["foo@bar.org"][""] == 3.0
+    assert delivery.get_settlement(groups) is settlement
+    delivery.orders["foo@bar.org"].products["lait"].wanted = 3
+    delivery.persist()
+    assert delivery.get_settlement(groups).table["foo@bar.org"][""] == 4.5
+
+
+def test_missing_units_are_proposed_to_the_biggest_orders(delivery, yaourt):
+    delivery.products[0].packing = 6
+    delivery.products.append(yaourt)  # Packing of 4.
+    delivery.orders["a"] = Order(products={"lait": ProductOrder(wanted=1)})
+    delivery.orders["b"] = Order(
+        products={"lait": ProductOrder(wanted=2), "yaourt": ProductOrder(wanted=4)}
+    )
+    delivery.orders["c"] = Order(products={"lait": ProductOrder(wanted=0)})
+    assert delivery.propose_adjustments() == {"lait": {"b": 2, "a": 1}}
+
+
+def test_totals_are_cached_by_version(delivery):
+    delivery.orders["foo@bar.org"] = Order(products={"lait": ProductOrder(wanted=2)})
+    delivery.persist()
+    totals = delivery.get_totals()
+    assert totals.total == 3.0
+    assert delivery.get_totals() is totals
+    delivery.orders["foo@bar.org"].products["lait"].wanted = 3
+    delivery.persist()
+    assert delivery.get_totals().total == 4.5
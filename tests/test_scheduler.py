@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from copanier import artifacts, metrics, scheduler
+from copanier.models import Groups
+
+pytestmark = pytest.mark.asyncio
+
+
+def test_exports_are_due_at_each_deadline(delivery):
+    delivery.persist()
+    order_before = delivery.order_before
+    assert scheduler.due(delivery, order_before - timedelta(minutes=1)) is None
+    assert scheduler.due(delivery, order_before) == order_before
+    scheduler._prepared[delivery.id] = order_before
+    assert scheduler.due(delivery, order_before + timedelta(days=1)) is None
+    deadline = delivery.dates["adjustment_deadline"]
+    assert scheduler.due(delivery, deadline) == deadline
+
+
+async def test_closed_orders_exports_are_prepared(client, delivery, groups):
+    delivery.order_before = datetime.now() - timedelta(hours=1)
+    delivery.persist()
+    await scheduler.tick()
+    key = artifacts.key(delivery.version, Groups.get_version("groups"))
+    for name in [
+        "produits.pdf",
+        "résumé-de-commandes.pdf",
+        "rapport-complet.xlsx",
+        "bon-de-commande-ferme-du-coin.pdf",
+    ]:
+        assert artifacts.exists(delivery.id, name, key), name
+
+    hits = metrics.cache_requests.values.get(("artifact", "hit"), 0)
+    resp = await client.get(f"/distribution/{delivery.id}/rapport-complet.xlsx")
+    assert resp.status == 200
+    assert resp.body == artifacts.read(delivery.id, "rapport-complet.xlsx", key)
+    assert metrics.cache_requests.values[("artifact", "hit")] == hits + 1
+
+
+async def test_open_deliveries_are_left_alone(delivery):
+    delivery.persist()
+    await scheduler.tick()
+    assert not artifacts.get_root().exists()
+
+
+async def test_exports_are_computed_again_when_the_delivery_changes(client, delivery):
+    delivery.persist()
+    url = f"/distribution/{delivery.id}/résumé-de-commandes"
+    values = metrics.cache_requests.values
+    misses = values.get(("artifact", "miss"), 0)
+    await client.get(url)
+    await client.get(url)
+    assert values[("artifact", "miss")] == misses + 1
+    delivery.name = "Renamed"
+    delivery.persist()
+    await client.get(url)
+    assert values[("artifact", "miss")] == misses + 2
+    assert len(list((artifacts.get_root() / delivery.id).iterdir())) == 1
@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from copanier import reports, singleflight
+
+pytestmark = pytest.mark.asyncio
+
+
+def counting(result=b"done"):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return result
+
+    return compute, calls
+
+
+async def test_concurrent_calls_share_one_computation():
+    compute, calls = counting()
+    results = await asyncio.gather(
+        *(singleflight.run("key", compute) for _ in range(3))
+    )
+    assert results == [b"done"] * 3
+    assert len(calls) == 1
+    # Once done, the next call computes again.
+    await singleflight.run("key", compute)
+    assert len(calls) == 2
+
+
+async def test_errors_are_shared_too():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("nope")
+
+    results = await asyncio.gather(
+        singleflight.run("key", fail),
+        singleflight.run("key", fail),
+        return_exceptions=True,
+    )
+    assert [str(result) for result in results] == ["nope", "nope"]
+
+
+async def test_results_are_shared_between_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr("copanier.config.SINGLEFLIGHT_ROOT", str(tmp_path))
+    compute, calls = counting(b"first")
+    assert await singleflight.run("key", compute) == b"first"
+    # Like another worker, which waited for the lock meanwhile.
+    other, other_calls = counting(b"second")
+    assert await singleflight.run("key", other) == b"first"
+    assert other_calls == []
+    monkeypatch.setattr("copanier.config.SINGLEFLIGHT_SECONDS", 0)
+    assert await singleflight.run("key", other) == b"second"
+
+
+async def test_identical_exports_are_generated_once(client, delivery, monkeypatch):
+    delivery.persist()
+    calls = []
+    original = reports.full
+
+    def full(delivery):
+        calls.append(delivery.id)
+        return original(delivery)
+
+    monkeypatch.setattr(reports, "full", full)
+    url = f"/distribution/{delivery.id}/rapport-complet.xlsx"
+    other = type(client)(client.app)
+    responses = await asyncio.gather(client.get(url), other.get(url))
+    assert [resp.status for resp in responses] == [200, 200]
+    assert responses[0].body == responses[1].body
+    assert calls == [delivery.id]
+
+
+async def test_lock_held_by_another_worker_times_out(tmp_path, monkeypatch):
+    monkeypatch.setattr("copanier.config.SINGLEFLIGHT_ROOT", str(tmp_path))
+    monkeypatch.setattr("copanier.config.SINGLEFLIGHT_SECONDS", 0.1)
+    path = tmp_path / hashlib.sha1(repr("key").encode()).hexdigest()
+    # Like another worker, which doesn't release the lock.
+    held = await singleflight.acquire(path.with_suffix(".lock"))
+    compute, calls = counting()
+    assert await singleflight.run("key", compute) == b"done"
+    assert calls == [1]
+    held.close()
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+
+from copanier import metrics, utils, warmup
+from copanier.models import Groups
+from copanier.views.core import env
+
+# Seconds. Generous, but catches a heavy import slipping back in at boot.
+IMPORT_BUDGET = float(os.environ.get("COPANIER_IMPORT_BUDGET", 1))
+
+
+def test_import_stays_light():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import copanier"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # Lines are like "import time: self [us] | cumulative | imported package".
+    imports = {}
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            imports[name.strip()] = int(cumulative)
+    assert "weasyprint" not in imports
+    assert "openpyxl" not in imports
+    assert imports["copanier"] / 1_000_000 < IMPORT_BUDGET
+
+
+def test_import_does_not_create_the_template_cache(tmp_path):
+    root = tmp_path / "templates"
+    env = dict(os.environ, COPANIER_TEMPLATE_CACHE_ROOT=str(root))
+    subprocess.run([sys.executable, "-c", "import copanier"], env=env, check=True)
+    assert not root.exists()
+
+
+def test_warm_up(delivery, groups):
+    delivery.persist()
+    env.cache.clear()
+    templates, deliveries, _ = warmup.warm_up()
+    assert templates > 20
+    assert len(env.cache) == templates
+    assert deliveries == 1
+    hits = metrics.cache_requests.values.get(("settlement", "hit"), 0)
+    delivery.get_settlement(Groups.load())
+    assert metrics.cache_requests.values[("settlement", "hit")] == hits + 1
+
+
+def test_compiled_templates_are_loaded_from_the_bytecode_cache():
+    env.cache.clear()
+    warmup.compile_templates(env)
+    env.cache.clear()  # Like a new process.
+    values = metrics.cache_requests.values
+    hits = values.get(("bytecode", "hit"), 0)
+    env.get_template("emails/order_summary.txt")
+    assert values[("bytecode", "hit")] == hits + 1
+
+
+def test_resident_memory():
+    if sys.platform.startswith("linux"):
+        assert utils.resident_memory() > 1024 * 1024
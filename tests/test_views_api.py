@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from copanier.models import Order, ProductOrder
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def ordered(delivery, groups, yaourt):
+    delivery.products.append(yaourt)
+    delivery.shipping["ferme-du-coin"] = 10
+    delivery.orders["fractal-brocolis"] = Order(
+        products={"lait": ProductOrder(wanted=2), "yaourt": ProductOrder(wanted=3)}
+    )
+    delivery.orders["bio"] = Order(products={"lait": ProductOrder(wanted=1)})
+    delivery.persist()
+    return delivery
+
+
+async def test_delivery_header(client, ordered):
+    resp = await client.get(f"/api/distribution/{ordered.id}")
+    assert resp.status == 200
+    assert resp.headers["Content-Type"].startswith("application/json")
+    data = json.loads(resp.body)
+    assert data["name"] == ordered.name
+    assert data["status"] == "open"
+    assert data["orders"] == 2
+    assert data["total"] == ordered.total
+
+
+async def test_products_with_fields(client, ordered):
+    resp = await client.get(f"/api/distribution/{ordered.id}/produits?fields=ref,wanted,missing")
+    assert json.loads(resp.body) == [
+        {"ref": "lait", "wanted": 3, "missing": 0},
+        {"ref": "yaourt", "wanted": 3, "missing": 1},
+    ]
+
+
+async def test_unknown_fields_are_refused(client, ordered):
+    resp = await client.get(f"/api/distribution/{ordered.id}/produits?fields=ref,foo")
+    assert resp.status == 400
+
+
+async def test_producers_and_orders_totals(client, ordered):
+    resp = await client.get(f"/api/distribution/{ordered.id}/producteurs?fields=id,total")
+    assert json.loads(resp.body) == [
+        {"id": "ferme-du-coin", "total": ordered.total_for_producer("ferme-du-coin")}
+    ]
+    resp = await client.get(f"/api/distribution/{ordered.id}/commandes")
+    orders = {order["id"]: order for order in json.loads(resp.body)}
+    assert orders["fractal-brocolis"]["name"] == "The Fractal Brocolis"
+    assert orders["bio"]["name"] == "bio"
+    for id, order in ordered.orders.items():
+        assert orders[id]["total"] == order.total(ordered.products, ordered, id)
+
+
+async def test_not_modified_until_the_delivery_changes(client, ordered):
+    url = f"/api/distribution/{ordered.id}/commandes"
+    resp = await client.get(url)
+    etag = resp.headers["ETag"]
+    resp = await client.get(url, headers={"If-None-Match": etag})
+    assert resp.status == 304
+    ordered.orders["bio"].products["lait"].wanted = 5
+    ordered.persist()
+    resp = await client.get(url, headers={"If-None-Match": etag})
+    assert resp.status == 200
+
+
+async def test_unknown_delivery(client):
+    resp = await client.get("/api/distribution/unknown")
+    assert resp.status == 404
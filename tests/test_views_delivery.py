@@ -1,10 +1,15 @@
+import asyncio
+import gzip
+import json
 from datetime import datetime, timedelta
 from io import BytesIO
+from zipfile import ZipFile
 
 import pytest
 from openpyxl import load_workbook
 from pyquery import PyQuery as pq
 
+from copanier import artifacts, metrics
 from copanier.views.core import url
 from copanier.models import Delivery, Order, ProductOrder, Product
 
@@ -32,6 +37,18 @@ async def test_home_should_list_active_delivery(client, delivery, groups):
     assert delivery.name in resp.body.decode()
 
 
+async def test_archives_should_list_archived_delivery(client, delivery, groups):
+    groups.persist()
+    delivery.over = True
+    delivery.persist()
+    delivery.archive()
+    resp = await client.get("/archives")
+    assert resp.status == 200
+    assert delivery.name in resp.body.decode()
+    resp = await client.get(f"/distribution/{delivery.id}")
+    assert resp.status == 200
+
+
 async def test_home_should_redirect_to_login_if_not_logged(client):
     client.logout()
     resp = await client.get("/")
@@ -73,6 +90,19 @@ async def test_place_order_with_session(client, delivery):
     assert delivery.orders["fractal-brocolis"].products["lait"].wanted == 3
 
 
+async def test_concurrent_orders_are_all_kept(client, delivery):
+    delivery.persist()
+    other = type(client)(client.app)
+    url = f"/distribution/{delivery.id}/commander"
+    responses = await asyncio.gather(
+        client.post(f"{url}?orderer=ndp", body={"wanted:lait": "1"}),
+        other.post(f"{url}?orderer=bio", body={"wanted:lait": "2"}),
+    )
+    assert [resp.status for resp in responses] == [302, 302]
+    delivery = Delivery.load(id=delivery.id)
+    assert set(delivery.orders) == {"ndp", "bio"}
+
+
 async def test_place_empty_order(client, delivery):
     delivery.persist()
     resp = await client.post(f"/distribution/{delivery.id}/commander", body={})
@@ -101,6 +131,58 @@ async def test_place_order_with_empty_string(client, delivery):
     assert not delivery.orders
 
 
+async def test_update_order_with_changed_lines(client, delivery, yaourt):
+    delivery.products.append(yaourt)
+    delivery.orders["fractal-brocolis"] = Order(
+        products={"lait": ProductOrder(wanted=2), "yaourt": ProductOrder(wanted=1)}
+    )
+    delivery.persist()
+    base = delivery.orders["fractal-brocolis"].tag
+    body = {"base": base, "lines": {"yaourt": {"wanted": 4}, "lait": {"wanted": 0}}}
+    url = f"/distribution/{delivery.id}/commande.json"
+    resp = await client.post(url, body=body, content_type="application/json")
+    assert resp.status == 200
+    order = Delivery.load(delivery.id).orders["fractal-brocolis"]
+    assert order.products == {"yaourt": ProductOrder(wanted=4)}
+    assert json.loads(resp.body)["tag"] == order.tag
+
+    # Changes made against the previous order are refused.
+    body = {"base": base, "lines": {"lait": {"wanted": 1}}}
+    resp = await client.post(url, body=body, content_type="application/json")
+    assert resp.status == 409
+    assert json.loads(resp.body) == {
+        "tag": order.tag,
+        "lines": {"yaourt": {"wanted": 4, "adjustment": 0}},
+    }
+
+
+@pytest.mark.parametrize(
+    "lines",
+    [{"unknown": {"wanted": 1}}, {"lait": {"wanted": "abc"}}, {"lait": {"wanted": -1}}],
+)
+async def test_update_order_validates_lines(client, delivery, lines):
+    delivery.persist()
+    body = {"base": Order().tag, "lines": lines}
+    resp = await client.post(
+        f"/distribution/{delivery.id}/commande.json",
+        body=body,
+        content_type="application/json",
+    )
+    assert resp.status == 422
+    assert not Delivery.load(delivery.id).orders
+
+
+async def test_place_order_page_sends_changes_against_its_order(client, delivery):
+    delivery.orders["fractal-brocolis"] = Order(
+        products={"lait": ProductOrder(wanted=2)}
+    )
+    delivery.persist()
+    resp = await client.get(f"/distribution/{delivery.id}/commander")
+    form = pq(resp.body)("form[data-order-url]")
+    assert form.attr("data-order-url").endswith(f"/distribution/{delivery.id}/commande.json")
+    assert form.attr("data-order-base") == delivery.orders["fractal-brocolis"].tag
+
+
 async def test_get_place_order_if_not_adjustable(client, delivery, monkeypatch):
     monkeypatch.setattr("copanier.config.STAFF", ["someone@else.org"])
     delivery.order_before = datetime.now() - timedelta(days=1)
@@ -221,4 +303,208 @@ async def test_export_products(client, delivery):
             'rupture'
         ),
         ("Lait", "lait", 1.5, delivery.products[0].last_update, None, None, None, "ferme-du-coin", None),
-    ]
\ No newline at end of file
+    ]
+
+async def test_export_products_as_csv(client, delivery):
+    delivery.persist()
+    resp = await client.get(f"/distribution/{delivery.id}/exporter?format=csv")
+    assert resp.headers["Content-Type"] == "application/zip"
+    archive = ZipFile(BytesIO(resp.body))
+    assert archive.read("produits.csv").decode().splitlines()[0] == (
+        "name,ref,price,last_update,unit,description,packing,producer,rupture"
+    )
+    assert archive.read("producteurs.csv").decode().splitlines()[1].startswith(
+        "ferme-du-coin,Ferme du coin"
+    )
+
+
+async def test_delivery_page_answers_not_modified(client, delivery):
+    delivery.persist()
+    resp = await client.get(f"/distribution/{delivery.id}")
+    assert resp.status == 200
+    etag = resp.headers["ETag"]
+    resp = await client.get(
+        f"/distribution/{delivery.id}", headers={"If-None-Match": etag}
+    )
+    assert resp.status == 304
+    assert resp.body == b""
+    # Another user gets another tag.
+    client.login(email="someone@else.org")
+    resp = await client.get(
+        f"/distribution/{delivery.id}", headers={"If-None-Match": etag}
+    )
+    assert resp.status == 200
+    client.login()
+    delivery.name = "Changed"
+    delivery.persist()
+    resp = await client.get(
+        f"/distribution/{delivery.id}", headers={"If-None-Match": etag}
+    )
+    assert resp.status == 200
+    assert resp.headers["ETag"] != etag
+
+
+async def test_export_answers_not_modified_since(client, delivery):
+    delivery.persist()
+    url = f"/distribution/{delivery.id}/rapport-complet.xlsx"
+    resp = await client.get(url)
+    assert resp.status == 200
+    headers = {"If-Modified-Since": resp.headers["Last-Modified"]}
+    resp = await client.get(url, headers=headers)
+    assert resp.status == 304
+
+
+async def test_export_is_modified_by_a_groups_change(client, delivery, groups):
+    groups.persist()
+    delivery.persist()
+    url = f"/distribution/{delivery.id}/résumé-de-commandes"
+    resp = await client.get(url)
+    assert resp.status == 200
+    etag = resp.headers["ETag"]
+    resp = await client.get(url, headers={"If-None-Match": etag})
+    assert resp.status == 304
+    groups.groups["fractal-brocolis"].name = "Renamed"
+    groups.persist()
+    resp = await client.get(url, headers={"If-None-Match": etag})
+    assert resp.status == 200
+
+
+async def test_producer_tables_are_cached_by_delivery_version(client, delivery):
+    delivery.persist()
+    values = metrics.cache_requests.values
+    hits = values.get(("fragment", "hit"), 0)
+    url = f"/distribution/{delivery.id}"
+    resp = await client.get(url)
+    assert "Lait" in resp.body.decode()
+    resp = await client.get(url)
+    assert values[("fragment", "hit")] == hits + 1
+    assert "Lait" in resp.body.decode()
+    delivery.products[0].name = "Lait cru"
+    delivery.persist()
+    resp = await client.get(url)
+    assert values[("fragment", "hit")] == hits + 1
+    assert "Lait cru" in resp.body.decode()
+
+
+async def test_html_is_compressed_when_accepted(client, delivery):
+    delivery.persist()
+    url = f"/distribution/{delivery.id}"
+    resp = await client.get(url, headers={"Accept-Encoding": "gzip;q=1, br;q=0"})
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert resp.headers["Vary"] == "Accept-Encoding"
+    assert delivery.name in gzip.decompress(resp.body).decode()
+    resp = await client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in resp.headers
+    assert delivery.name in resp.body.decode()
+    # Already compressed.
+    resp = await client.get(
+        f"{url}/rapport-complet.xlsx", headers={"Accept-Encoding": "gzip"}
+    )
+    assert "Content-Encoding" not in resp.headers
+
+
+async def test_requests_are_timed_and_logged(client, delivery, caplog):
+    delivery.persist()
+    with caplog.at_level("INFO", logger="request_logger"):
+        resp = await client.get(f"/distribution/{delivery.id}")
+    assert resp.status == 200
+    assert "load;dur=" in resp.headers["Server-Timing"]
+    assert "render;dur=" in resp.headers["Server-Timing"]
+    log = json.loads(caplog.records[-1].getMessage())
+    assert log["route"] == "show_delivery"
+    assert log["status"] == 200
+    assert log["size"] == len(resp.body)
+    assert set(log["steps"]) >= {"load", "render"}
+
+
+async def test_server_timing_is_only_sent_to_staff(client, delivery, monkeypatch):
+    monkeypatch.setattr("copanier.config.STAFF", ["someone@else.org"])
+    delivery.persist()
+    resp = await client.get(f"/distribution/{delivery.id}")
+    assert resp.status == 200
+    assert "Server-Timing" not in resp.headers
+
+
+async def test_live_totals_are_streamed(client, delivery, monkeypatch):
+    monkeypatch.setattr("copanier.config.LIVE_POLL_SECONDS", 0.05)
+    monkeypatch.setattr("copanier.config.LIVE_STREAM_SECONDS", 0.5)
+    delivery.persist()
+    # The test client only returns once the stream is over.
+    request = asyncio.create_task(client.get(f"/distribution/{delivery.id}/direct"))
+    await asyncio.sleep(0.1)
+    delivery.orders["foo@bar.org"] = Order(products={"lait": ProductOrder(wanted=2)})
+    delivery.persist()
+    resp = await request
+    assert resp.status == 200
+    assert resp.headers["Content-Type"] == "text/event-stream"
+    stream = client.protocol.transport.data.decode()
+    assert "retry: 3000" in stream
+    assert ": ping" in stream
+    events = [
+        json.loads(line[len("data: ") :])
+        for line in stream.splitlines()
+        if line.startswith("data: ")
+    ]
+    assert events[0]["orders"] == 0
+    assert events[1] == {
+        "orders": 1,
+        "wanted:lait": 2,
+        "producer:ferme-du-coin": 3.0,
+        "total": 3.0,
+    }
+
+
+async def test_frozen_delivery_cannot_be_changed_until_unfrozen(
+    client, delivery, groups
+):
+    delivery.persist()
+    resp = await client.post(f"/distribution/{delivery.id}/figer")
+    assert resp.status == 302
+    assert not Delivery.is_frozen(delivery.id)  # Orders are still open.
+
+    delivery.over = True
+    delivery.persist()
+    resp = await client.post(f"/distribution/{delivery.id}/figer")
+    assert Delivery.is_frozen(delivery.id)
+    key = Delivery.load(delivery.id).bundle.key
+    assert artifacts.exists(delivery.id, "rapport-complet.xlsx", key)
+    resp = await client.get(f"/distribution/{delivery.id}/gérer")
+    assert "Défiger" in resp.body.decode()
+    resp = await client.get(f"/distribution/{delivery.id}/paiements")
+    assert resp.status == 200
+
+    url = f"/produits/{delivery.id}/producteurs/ferme-du-coin/supprimer"
+    resp = await client.post(url)
+    assert resp.status == 302
+    assert "ferme-du-coin" in Delivery.load(delivery.id).producers
+
+    resp = await client.post(f"/distribution/{delivery.id}/défiger")
+    assert resp.status == 302
+    resp = await client.post(url)
+    assert "ferme-du-coin" not in Delivery.load(delivery.id).producers
+
+
+async def test_adjust_all_products_at_once(client, delivery, yaourt):
+    delivery.order_before = datetime.now() - timedelta(days=1)
+    delivery.products[0].packing = 6
+    delivery.products.append(yaourt)
+    delivery.orders["fractal-brocolis"] = Order(
+        products={"lait": ProductOrder(wanted=2), "yaourt": ProductOrder(wanted=3)}
+    )
+    delivery.orders["another-group"] = Order(products={"lait": ProductOrder(wanted=1)})
+    delivery.persist()
+    url = f"/distribution/{delivery.id}/ajuster"
+    resp = await client.get(url)
+    doc = pq(resp.body)
+    assert doc('[name="lait:fractal-brocolis"]').attr("value") == "2"
+    assert doc('[name="lait:another-group"]').attr("value") == "1"
+    assert doc('[name="yaourt:fractal-brocolis"]').attr("value") == "1"
+
+    body = {"lait:fractal-brocolis": "2", "lait:another-group": "1", "yaourt:fractal-brocolis": "-3"}
+    resp = await client.post(url, body=body)
+    assert resp.status == 302
+    delivery = Delivery.load(delivery.id)
+    assert delivery.orders["fractal-brocolis"]["lait"].quantity == 4
+    assert delivery.orders["another-group"]["lait"].quantity == 2
+    assert delivery.orders["fractal-brocolis"]["yaourt"].quantity == 0
+    assert not delivery.propose_adjustments()
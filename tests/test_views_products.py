@@ -0,0 +1,27 @@
+import pytest
+
+from copanier.models import Delivery
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_import_products_from_csv_files(client, delivery):
+    delivery.persist()
+    products = (
+        b"ref,name,price,producer\n"
+        b"lait,Lait,2,ferme-du-coin\n"
+        b"pain,Pain,3,ferme-du-coin\n"
+    )
+    producers = b"id,name\nferme-du-coin,Ferme du coin\n"
+    resp = await client.post(
+        f"/produits/{delivery.id}/importer",
+        body={"merge": "1"},
+        files={
+            "products": (products, "produits.csv"),
+            "producers": (producers, "producteurs.csv"),
+        },
+    )
+    assert resp.status == 302
+    delivery = Delivery.load(delivery.id)
+    assert [p.ref for p in delivery.products] == ["lait", "pain"]
+    assert delivery.products[0].price == 2